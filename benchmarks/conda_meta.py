@@ -0,0 +1,151 @@
+"""Compare reading conda-meta records with json.loads against the streaming reader.
+
+For every record the executables of the record's own package are looked up, as
+condax does after finding the record by its file name.  The synthetic record is
+written the way conda writes them, with sorted keys, so `files` comes before `name`
+and `paths_data` after it.  Wall time and peak memory (as traced by tracemalloc) are
+reported for both readers.
+
+    $ python benchmarks/conda_meta.py ~/.condax/*/conda-meta
+    $ python benchmarks/conda_meta.py --synthetic 50000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from condax.conda_meta import read_package_files
+
+
+def is_executable(fn: str) -> bool:
+    return fn.startswith("bin/") or fn.startswith("sbin/")
+
+
+def read_with_json(path: Path, name: str) -> Optional[List[str]]:
+    package_info = json.loads(path.read_text())
+    if package_info["name"] != name:
+        return None
+    return [fn for fn in package_info["files"] if is_executable(fn)]
+
+
+def read_streaming(path: Path, name: str) -> Optional[List[str]]:
+    with open(path, encoding="utf-8") as fo:
+        return read_package_files(fo, name, is_executable)[1]
+
+
+def measure(fn: Callable[[], object], repeat: int = 3) -> Tuple[float, int]:
+    """Return the best wall time of `repeat` runs and the peak traced memory.
+
+    Memory is traced in a separate run since tracemalloc slows down Python code a lot
+    more than the C JSON decoder."""
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def write_synthetic_record(directory: Path, n_files: int) -> Path:
+    files = [f"lib/python3.11/site-packages/pkg/module_{i}.py" for i in range(n_files)]
+    files += [f"bin/tool_{i}" for i in range(20)]
+    record = {
+        "build": "h1234_0",
+        "build_number": 0,
+        "channel": "https://conda.anaconda.org/conda-forge/linux-64",
+        "depends": ["python >=3.11,<3.12.0a0"],
+        "files": sorted(files),
+        "license": "MIT",
+        "md5": "0" * 32,
+        "name": "synthetic",
+        "paths_data": {
+            "paths": [
+                {"_path": fn, "path_type": "hardlink", "sha256": "0" * 64, "size": 1}
+                for fn in files
+            ],
+            "paths_version": 1,
+        },
+        "size": 1,
+        "subdir": "linux-64",
+        "url": "https://conda.anaconda.org/conda-forge/linux-64/"
+        "synthetic-1.0-h1234_0.conda",
+        "version": "1.0",
+    }
+    path = directory / "synthetic-1.0-h1234_0.json"
+    path.write_text(json.dumps(record, indent=2, sort_keys=True))
+    return path
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("conda_meta_dirs", nargs="*", type=Path)
+    parser.add_argument(
+        "--synthetic",
+        type=int,
+        metavar="N_FILES",
+        help="Also benchmark a generated record listing this many files.",
+    )
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    dirs: List[Path] = list(args.conda_meta_dirs)
+    if not dirs and not args.synthetic:
+        dirs = [Path(os.environ.get("CONDA_PREFIX", sys.prefix)) / "conda-meta"]
+    paths = [p for d in dirs for p in sorted(d.glob("*.json"))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic:
+            paths.append(write_synthetic_record(Path(tmp), args.synthetic))
+        if not paths:
+            print("No conda-meta records found")
+            return 1
+
+        rows = []
+        for path in paths:
+            name = json.loads(path.read_text())["name"]
+            assert read_with_json(path, name) == read_streaming(path, name), path
+            row = [path.stat().st_size]
+            for reader in (read_with_json, read_streaming):
+                row.extend(measure(lambda: reader(path, name)))  # noqa: B023
+            rows.append((path, row))
+
+    print(f"{len(rows)} records, {sum(r[0] for _, r in rows) / 1e6:.1f} MB total")
+    print()
+    header = "{:>10} {:>10} {:>10} {:>10} {:>10}  {}".format(
+        "size", "json", "stream", "json", "stream", "record"
+    )
+    print("{:>10} {:>21} {:>21}".format("", "wall ms", "peak KiB"))
+    print(header)
+    for path, row in sorted(rows, key=lambda r: -r[1][0])[: args.top]:
+        size, jt, jm, st, sm = row
+        print(
+            f"{size / 1024:>8.0f}Ki {jt * 1000:>10.2f} {st * 1000:>10.2f} "
+            f"{jm / 1024:>10.0f} {sm / 1024:>10.0f}  {path.name}"
+        )
+
+    def total(i: int) -> float:
+        return sum(r[i] for _, r in rows)
+
+    def peak(i: int) -> float:
+        return max(r[i] for _, r in rows)
+
+    print()
+    print(
+        f"wall {total(1) * 1000:8.1f} ms -> {total(3) * 1000:8.1f} ms, "
+        f"max peak {peak(2) / 1024:8.0f} KiB -> {peak(4) / 1024:6.0f} KiB"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
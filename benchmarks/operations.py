@@ -0,0 +1,230 @@
+"""Time condax operations at different numbers of environments, fully offline.
+
+conda is replaced by the stub in `tests/fake_conda.py`, which writes conda-meta
+records listing `--files` files per package.  For every number of environments the
+environments are installed, their executables determined (with a cold and a warm
+executables index), updated without and with snapshots and removed.  Since the stub's own run time says nothing
+about condax, the time spent in conda subprocesses is measured separately (using
+`condax.tracing`) and subtracted, leaving condax's own overhead.
+
+Results can be saved and compared with an earlier run to catch regressions:
+
+    $ python benchmarks/operations.py --envs 1 50 500 --files 5000 --output base.json
+    $ python benchmarks/operations.py --envs 1 50 500 --files 5000 --compare base.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Generator, List
+
+from condax import conda, core, tracing
+from condax.config import CONFIG
+
+FAKE_CONDA = Path(__file__).resolve().parent.parent / "tests" / "fake_conda.py"
+
+Result = Dict[str, float]
+
+
+@contextlib.contextmanager
+def quiet() -> Generator[None, None, None]:
+    """Silence condax and the conda subprocesses it runs."""
+    saved = [os.dup(1), os.dup(2)]
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.dup2(devnull, 1)
+        os.dup2(devnull, 2)
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in (*saved, devnull):
+            os.close(fd)
+
+
+def measure(fn: Callable[[], None]) -> Result:
+    """Time `fn`, separating the time spent waiting for conda subprocesses."""
+    tracing.enable()
+    start = time.perf_counter()
+    with quiet():
+        fn()
+    wall = time.perf_counter() - start
+    conda_ms = sum(
+        e["dur"] / 1000 for e in tracing.events() if e["name"].startswith("conda ")
+    )
+    return {
+        "wall_ms": wall * 1000,
+        "conda_ms": conda_ms,
+        "condax_ms": wall * 1000 - conda_ms,
+    }
+
+
+def setup(root: Path, n_files: int) -> None:
+    exe = root / "conda"
+    exe.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{FAKE_CONDA}" "$@"\n')
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+    CONFIG.prefix_path = root / "prefix"
+    CONFIG.link_destination = root / "link"
+    CONFIG.conda_executable = exe
+    CONFIG.prefix_path.mkdir()
+    CONFIG.link_destination.mkdir()
+    os.environ["FAKE_CONDA_FILES"] = str(n_files)
+
+
+def run_scenario(n_envs: int, n_files: int, jobs: int) -> Dict[str, Result]:
+    packages = [f"tool{i}" for i in range(n_envs)]
+    results: Dict[str, Result] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        setup(Path(tmp), n_files)
+
+        def install() -> None:
+            for package in packages:
+                core.install_package(package)
+
+        def determine_executables() -> None:
+            for package in packages:
+                conda.determine_executables_from_env(package)
+
+        def invalidate_and_determine() -> None:
+            for package in packages:
+                conda.invalidate_executables_index(conda.conda_env_prefix(package))
+            determine_executables()
+
+        def remove() -> None:
+            for package in packages:
+                core.remove_package(package)
+
+        results["install_package"] = measure(install)
+        results["create_links"] = span_total("create links")
+        results["determine_executables (cold)"] = measure(invalidate_and_determine)
+        results["determine_executables (warm)"] = measure(determine_executables)
+        results["update_all_packages"] = measure(
+            lambda: core.update_all_packages(jobs=jobs)
+        )
+        CONFIG.update_snapshots = True
+        try:
+            results["update_all_packages (snapshots)"] = measure(
+                lambda: core.update_all_packages(jobs=jobs)
+            )
+            results["snapshot"] = span_total("snapshot")
+        finally:
+            CONFIG.update_snapshots = False
+        results["remove_package"] = measure(remove)
+    return results
+
+
+def span_total(name: str) -> Result:
+    """The time spent in the spans `name` of the last measurement, which is all
+    condax's own."""
+    ms = sum(e["dur"] / 1000 for e in tracing.events() if e["name"] == name)
+    return {"wall_ms": ms, "conda_ms": 0.0, "condax_ms": ms}
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(
+    results: Dict[str, Result], baseline: Dict[str, Result], threshold: float
+) -> List[str]:
+    """Names of the benchmarks whose condax overhead regressed beyond `threshold`.
+
+    Differences below 5 ms are ignored as noise."""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        now, then = result["condax_ms"], before["condax_ms"]
+        if now > then * threshold and now - then > 5:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--envs", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument(
+        "--files", type=int, default=2000, help="Files listed per package."
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Passed to update_all_packages.  With more than one job the conda time "
+        "overlaps, so condax's own time is underestimated.",
+    )
+    parser.add_argument("--output", type=Path, help="Save the results as JSON.")
+    parser.add_argument(
+        "--compare", type=Path, help="Fail if slower than the results in this file."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="Ratio of condax overhead to the baseline that counts as a regression.",
+    )
+    args = parser.parse_args(argv)
+    if sys.platform == "win32":
+        print("The fake conda is a shell script, which doesn't run on Windows")
+        return 1
+
+    results: Dict[str, Result] = {}
+    print(f"{'benchmark':<54} {'wall ms':>10} {'conda ms':>10} {'condax ms':>10}")
+    for n_envs in args.envs:
+        for name, result in run_scenario(n_envs, args.files, args.jobs).items():
+            key = f"{name} [{n_envs} envs, {args.files} files]"
+            results[key] = result
+            print(
+                f"{key:<54} {result['wall_ms']:>10.1f} {result['conda_ms']:>10.1f} "
+                f"{result['condax_ms']:>10.1f}"
+            )
+
+    if args.output is not None:
+        document = {
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }
+        args.output.write_text(json.dumps(document, indent=2) + "\n")
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        regressions = compare(results, baseline["results"], args.threshold)
+        print()
+        print(f"compared to {args.compare} (revision {baseline.get('revision')})")
+        for name in regressions:
+            before = baseline["results"][name]["condax_ms"]
+            print(
+                f"FAIL: {name}: {before:.1f} ms -> {results[name]['condax_ms']:.1f} ms"
+            )
+        if regressions:
+            return 1
+        print("no regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
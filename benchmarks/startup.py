@@ -0,0 +1,72 @@
+"""Measure (and optionally enforce) the import-time cost of starting condax.
+
+Runs ``python -X importtime -m condax.cli --version`` a few times, reports the best
+wall time together with the most expensive imports, and exits non-zero when the
+startup budget is exceeded or a module that must stay lazy was imported.
+
+    $ python benchmarks/startup.py --budget-ms 300
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+COMMAND = [sys.executable, "-X", "importtime", "-m", "condax.cli", "--version"]
+
+# Modules that only commands shelling out to conda should pay for.
+FORBIDDEN_MODULES = ("requests", "ensureconda")
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """Map each imported module to its cumulative import time in microseconds."""
+    cumulative: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        cumulative[name.strip()] = int(cumulative_us)
+    return cumulative
+
+
+def run_once() -> Tuple[float, Dict[str, int]]:
+    start = time.perf_counter()
+    proc = subprocess.run(COMMAND, capture_output=True, text=True, check=True)
+    elapsed = time.perf_counter() - start
+    return elapsed, parse_importtime(proc.stderr)
+
+
+def main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="Fail if the best wall time exceeds this many milliseconds.",
+    )
+    args = parser.parse_args(argv)
+
+    results = [run_once() for _ in range(args.runs)]
+    best_wall, imports = min(results, key=lambda r: r[0])
+
+    print(f"best wall time over {args.runs} runs: {best_wall * 1000:.1f} ms")
+    print(f"top {args.top} imports by cumulative time:")
+    for name, us in sorted(imports.items(), key=lambda kv: -kv[1])[: args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+    status = 0
+    eager = [m for m in FORBIDDEN_MODULES if m in imports]
+    if eager:
+        print(f"FAIL: imported at startup: {', '.join(eager)}")
+        status = 1
+    if args.budget_ms is not None and best_wall * 1000 > args.budget_ms:
+        print(f"FAIL: startup exceeded budget of {args.budget_ms:.0f} ms")
+        status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,23 +1,207 @@
-from textwrap import dedent
+"""Entrypoints that activate their environment before running the executable.
 
+Some tools (e.g. R or Java) only work in an activated environment, because their
+packages set variables like `JAVA_HOME` in `etc/conda/activate.d`.  Running them
+through `conda run` costs hundreds of milliseconds per call, so instead the
+activation scripts are run once, when the entrypoint is written, and the variables
+they set are written into the entrypoint.
+"""
 
-def write_activating_entrypoint_unix(executable, prefix):
-    dedent(
-        f"""
-        #!/bin/sh
-        export PATH="$PATH:{prefix}/bin"
+import json
+import logging
+import os
+import re
+import shlex
+import subprocess
+import sys
+import tempfile
+from pathlib import Path, PureWindowsPath
+from typing import Dict, List, Tuple
 
-        exec "{executable}" "$@"
-        """
-    ).strip()
+from .config import is_windows
 
+# variables that every shell sets or that the entrypoints set themselves
+_IGNORED_VARIABLES = {"_", "CONDA_PREFIX", "OLDPWD", "PROMPT", "PWD", "SHLVL"}
 
-def write_activating_entrypoint_windows(executable, prefix):
-    # TODO: Verify if this is right?
-    dedent(
-        f"""
-        SET PATH="%PATH%;{prefix}\\Library\\bin;{prefix}\\Scripts"
+# variables of the installer's environment that the activation scripts run with;
+# everything else is left out, so that the scripts' values of variables that happen
+# to be set already (e.g. `JAVA_HOME`) are still picked up
+_BASELINE_VARIABLES: Tuple[str, ...] = (
+    "HOME",
+    "LANG",
+    "LC_ALL",
+    "LC_CTYPE",
+    "LOGNAME",
+    "TMPDIR",
+    "USER",
+)
+_WINDOWS_BASELINE_VARIABLES: Tuple[str, ...] = (
+    "APPDATA",
+    "COMSPEC",
+    "LOCALAPPDATA",
+    "PATHEXT",
+    "SYSTEMDRIVE",
+    "SYSTEMROOT",
+    "TEMP",
+    "TMP",
+    "USERPROFILE",
+    "WINDIR",
+)
 
-        CALL "{executable}" "%@%"
-        """
-    ).strip()
+_RE_VARIABLE_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# directories of a prefix that activation puts on PATH on Windows
+_WINDOWS_BIN_DIRS = (
+    "",
+    "Library/mingw-w64/bin",
+    "Library/usr/bin",
+    "Library/bin",
+    "Scripts",
+    "bin",
+)
+
+
+def bin_dirs(prefix: Path) -> List[Path]:
+    """The directories of `prefix` that activation puts on PATH."""
+    if is_windows():
+        return [prefix / p for p in _WINDOWS_BIN_DIRS]
+    return [prefix / "bin"]
+
+
+def activation_environment(prefix: Path) -> Dict[str, str]:
+    """The environment variables set by activating `prefix`.
+
+    These are the variables set with `conda env config vars` and those set by the
+    scripts in `etc/conda/activate.d`.  `PATH`, if present, holds only the
+    directories the scripts put on it, to be prepended to the caller's `PATH` after
+    `bin_dirs(prefix)`.
+    """
+    env = _config_vars(prefix)
+    scripts = sorted(
+        (prefix / "etc" / "conda" / "activate.d").glob(
+            "*.bat" if is_windows() else "*.sh"
+        )
+    )
+    if scripts:
+        env.update(_run_activation_scripts(prefix, scripts))
+    return {k: v for k, v in env.items() if _RE_VARIABLE_NAME.match(k)}
+
+
+def _config_vars(prefix: Path) -> Dict[str, str]:
+    try:
+        state = json.loads((prefix / "conda-meta" / "state").read_text())
+    except (OSError, ValueError):
+        return {}
+    return {str(k): str(v) for k, v in (state.get("env_vars") or {}).items()}
+
+
+def _run_activation_scripts(prefix: Path, scripts: List[Path]) -> Dict[str, str]:
+    """Run the activation scripts in one shell, returning the variables they changed."""
+    before = _baseline_environment(prefix)
+    with tempfile.TemporaryDirectory() as tmp:
+        output = Path(tmp) / "environ.json"
+        code = (
+            "import json, os, sys; json.dump(dict(os.environ), open(sys.argv[1], 'w'))"
+        )
+        if is_windows():
+            # paths can't contain double quotes on Windows
+            calls = " && ".join(f'CALL "{script}"' for script in scripts)
+            dump = f'"{sys.executable}" -c "{code}" "{output}"'
+            args = ["cmd", "/d", "/c", f"{calls} && {dump}"]
+        else:
+            sources = "".join(f". {shlex.quote(str(script))}\n" for script in scripts)
+            dump = " ".join(
+                shlex.quote(arg) for arg in (sys.executable, "-c", code, str(output))
+            )
+            args = ["/bin/sh", "-c", f"{sources}{dump}"]
+        res = subprocess.run(
+            args, env=before, cwd=prefix, capture_output=True, text=True
+        )
+        try:
+            after: Dict[str, str] = json.loads(output.read_text())
+        except (OSError, ValueError):
+            logging.warning(
+                "Could not run the activation scripts of %s: %s",
+                prefix,
+                res.stderr.strip(),
+            )
+            return {}
+    changed = {
+        k: v
+        for k, v in after.items()
+        if before.get(k) != v and k not in _IGNORED_VARIABLES
+    }
+    if "PATH" in changed:
+        baseline_path = before["PATH"].split(os.pathsep)
+        added = [
+            p for p in changed.pop("PATH").split(os.pathsep) if p not in baseline_path
+        ]
+        if added:
+            changed["PATH"] = os.pathsep.join(added)
+    return changed
+
+
+def _baseline_environment(prefix: Path) -> Dict[str, str]:
+    """A minimal environment for running the activation scripts of `prefix`."""
+    if is_windows():
+        names = _WINDOWS_BASELINE_VARIABLES
+        system_root = os.environ.get("SYSTEMROOT", r"C:\Windows")
+        system_path = [os.path.join(system_root, "System32"), system_root]
+    else:
+        names = _BASELINE_VARIABLES
+        system_path = os.defpath.split(os.pathsep)
+    env = {k: os.environ[k] for k in names if k in os.environ}
+    env["CONDA_PREFIX"] = str(prefix)
+    # keep the Python that dumps the environment from setting `LC_CTYPE`
+    env["PYTHONCOERCECLOCALE"] = "0"
+    env["PATH"] = os.pathsep.join(
+        [*(str(p) for p in bin_dirs(prefix)), *filter(None, system_path)]
+    )
+    return env
+
+
+def write_activating_entrypoint_unix(
+    executable: Path, prefix: Path, env: Dict[str, str]
+) -> str:
+    lines = [
+        "#!/bin/sh",
+        "# Entrypoint created by condax",
+        f"export CONDA_PREFIX={shlex.quote(str(prefix))}",
+    ]
+    env = dict(env)
+    path = [str(prefix / "bin"), *filter(None, [env.pop("PATH", "")])]
+    lines.append(f'export PATH={shlex.quote(":".join(path))}:"$PATH"')
+    lines.extend(f"export {k}={shlex.quote(v)}" for k, v in sorted(env.items()))
+    lines.append(f'exec {shlex.quote(str(executable))} "$@"')
+    return "\n".join(lines) + "\n"
+
+
+def write_activating_entrypoint_windows(
+    executable: Path, prefix: Path, env: Dict[str, str]
+) -> str:
+    win_prefix = PureWindowsPath(prefix)
+    env = dict(env)
+    path = ";".join(
+        [
+            *(str(win_prefix / p) for p in _WINDOWS_BIN_DIRS),
+            *filter(None, [env.pop("PATH", "")]),
+        ]
+    )
+    lines = [
+        "@echo off",
+        "REM Entrypoint created by condax",
+        "SETLOCAL",
+        f'SET "CONDA_PREFIX={win_prefix}"',
+        f'SET "PATH={path};%PATH%"',
+    ]
+    lines.extend(f'SET "{k}={v}"' for k, v in sorted(env.items()))
+    lines.append(f'CALL "{PureWindowsPath(executable)}" %*')
+    return "\n".join(lines) + "\n"
+
+
+def write_activating_entrypoint(
+    executable: Path, prefix: Path, env: Dict[str, str]
+) -> str:
+    if is_windows():
+        return write_activating_entrypoint_windows(executable, prefix, env)
+    return write_activating_entrypoint_unix(executable, prefix, env)
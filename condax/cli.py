@@ -1,9 +1,12 @@
+import subprocess
 import sys
+from pathlib import Path
 from typing import List, Optional
 
 import typer
 
-from . import __version__, config, core, paths
+from . import __version__, config, core, events, manifest, paths, registry, tracing
+from .metadata import CondaxLock
 
 cli = typer.Typer(
     name="condax",
@@ -27,6 +30,23 @@ _OPTION_LINK_ACTION = typer.Option(
             overwrite the existing link.  If `skip` is specified, condax will skip linking the
             conflicting executable.""",
 )
+_OPTION_JOBS = typer.Option(
+    1,
+    "--jobs",
+    "-j",
+    min=1,
+    help="""\
+            Number of environments to create or update concurrently when operating on
+            several packages.  Links and metadata are still updated one environment at a
+            time.""",
+)
+_OPTION_OFFLINE = typer.Option(
+    False,
+    "--offline",
+    help="""\
+            Don't connect to the internet.  Packages have to be in the package cache
+            already (see `condax cache populate`) or in a local `file://` channel.""",
+)
 
 
 def version_callback(value: bool):
@@ -37,6 +57,7 @@ def version_callback(value: bool):
 
 @cli.callback()
 def main(
+    ctx: typer.Context,
     version: bool = typer.Option(
         None,
         "--version",
@@ -44,8 +65,42 @@ def main(
         is_eager=True,
         help="Print version and exit",
     ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        help="Print how long each phase of the command took when it finishes.",
+    ),
+    trace_file: Optional[Path] = typer.Option(
+        None,
+        "--trace-file",
+        dir_okay=False,
+        help="Write the timing of each phase to this file as Chrome trace events.",
+    ),
+    json_output: bool = typer.Option(
+        False,
+        "--json",
+        help="""\
+            Write progress events, including conda's, and finally the result of the
+            command to stdout as JSON lines.  Other output goes to stderr.""",
+    ),
 ):
-    return
+    if json_output:
+        events.enable()
+        ctx.call_on_close(lambda: events.finish(ctx.invoked_subcommand))
+    if profile or trace_file:
+        tracing.enable()
+
+        def report() -> None:
+            tracing.finish(f"condax {ctx.invoked_subcommand}")
+            if profile:
+                typer.echo(tracing.format_profile(), err=True)
+            if trace_file is not None:
+                tracing.write_chrome_trace(trace_file)
+
+        # runs when the command returns or exits
+        ctx.call_on_close(report)
+    # write the registry once, as the command ends (before the callbacks above)
+    ctx.with_resource(registry.batch())
 
 
 @cli.command(
@@ -53,7 +108,8 @@ def main(
         Install a package with condax.
 
         This will install a package into a new conda environment and link the executable
-        provided by it to `{config.CONFIG.link_destination}`.
+        provided by it to `{config.CONFIG.link_destination}`.  When several packages are
+        given each is installed into its own environment.
         """,
 )
 def install(
@@ -67,17 +123,117 @@ def install(
     ),
     link_conflict: core.LinkConflictAction = _OPTION_LINK_ACTION,
     mamba: bool = _OPTION_MAMBA,
-    package: str = typer.Argument(...),
+    from_file: Optional[Path] = typer.Option(
+        None,
+        "--from-file",
+        "-f",
+        exists=True,
+        dir_okay=False,
+        help="""\
+            Install the packages listed in this file, one package spec per line.
+            Blank lines and `#` comments are ignored.""",
+    ),
+    locked: Optional[Path] = typer.Option(
+        None,
+        "--locked",
+        exists=True,
+        dir_okay=False,
+        help="""\
+            Recreate the environments in a lock file written by `condax export`, with
+            exactly the same packages and without solving.  If packages are given only
+            those environments are recreated.""",
+    ),
+    jobs: int = _OPTION_JOBS,
+    offline: bool = _OPTION_OFFLINE,
+    dedupe: bool = typer.Option(
+        False,
+        "--dedupe",
+        help="""\
+            Afterwards replace files that are identical to files in other condax
+            environments by hard links, see `condax dedupe`.""",
+    ),
+    activate: bool = typer.Option(
+        False,
+        "--activate",
+        help="""\
+            Link through small scripts that set the environment variables of the
+            activated environment before running the executable, for tools that
+            need activation.""",
+    ),
+    all_deps_apps: bool = typer.Option(
+        False,
+        "--all-deps-apps",
+        help="""\
+            Also link the executables of the dependencies of the package, not only
+            those of the package itself.""",
+    ),
+    force: bool = typer.Option(
+        False,
+        "--force",
+        help="""\
+            Change packages that are already installed from another spec or other
+            channels to the spec given, in place.""",
+    ),
+    packages: Optional[List[str]] = typer.Argument(None, metavar="PACKAGE..."),
 ):
+    if offline:
+        config.CONFIG.offline = True
+    packages = list(packages or [])
+    if from_file is not None:
+        packages.extend(core.read_package_file(from_file))
+    if locked is not None:
+        # the lock file records the channels and options of every environment
+        ignored = {
+            "--channel": bool(channel),
+            "--activate": activate,
+            "--all-deps-apps": all_deps_apps,
+            "--force": force,
+        }
+        if any(ignored.values()):
+            options = ", ".join(name for name, given in ignored.items() if given)
+            typer.echo(f"Cannot specify {options} with --locked")
+            sys.exit(1)
+        config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+        lock = CondaxLock.model_validate_json(locked.read_text())
+        core.install_locked(
+            lock,
+            packages=packages,
+            link_conflict_action=link_conflict,
+            jobs=jobs,
+        )
+        if dedupe:
+            core.dedupe_environments(
+                packages or [env.name for env in lock.environments]
+            )
+        return
+    if not packages:
+        typer.echo("Must specify at least one package, --from-file or --locked")
+        sys.exit(1)
     if channel is None or (len(channel) == 0):
         channel = config.CONFIG.channels
     config.CONFIG.ensure_conda_executable(require_mamba=mamba)
 
-    core.install_package(
-        package,
-        channels=channel,
-        link_conflict_action=link_conflict,
-    )
+    if len(packages) == 1:
+        core.install_package(
+            packages[0],
+            channels=channel,
+            link_conflict_action=link_conflict,
+            activate=activate,
+            force=force,
+            all_deps_apps=all_deps_apps,
+        )
+    else:
+        core.install_packages(
+            packages,
+            channels=channel,
+            link_conflict_action=link_conflict,
+            jobs=jobs,
+            activate=activate,
+            force=force,
+            all_deps_apps=all_deps_apps,
+        )
+    if dedupe:
+        core.dedupe_environments(packages)
 
 
 @cli.command(
@@ -101,9 +257,12 @@ def inject(
     include_apps: bool = typer.Option(
         False, "--include-apps", help="Adds applications of injected package to PATH."
     ),
+    offline: bool = _OPTION_OFFLINE,
     package: str = typer.Argument(..., help="The condax environment inject into."),
     extra_packages: List[str] = typer.Argument(..., help="Extra packages to install."),
 ):
+    if offline:
+        config.CONFIG.offline = True
     if channel is None or (len(channel) == 0):
         channel = config.CONFIG.channels
     config.CONFIG.ensure_conda_executable(require_mamba=mamba)
@@ -117,6 +276,178 @@ def inject(
     )
 
 
+@cli.command(
+    help="""\
+        Run an application from a cached environment, without installing it.
+
+        The environment is created on first use and reused for the same package spec
+        and channels.  Pass arguments for the application after `--`.
+        """,
+    context_settings={"ignore_unknown_options": True},
+)
+def run(
+    channel: Optional[List[str]] = typer.Option(
+        None,
+        "--channel",
+        "-c",
+        help=f"""\
+            Use the channels specified to create the environment.  If not specified
+            condax will default to using {config.CONFIG.channels}.""",
+    ),
+    mamba: bool = _OPTION_MAMBA,
+    offline: bool = _OPTION_OFFLINE,
+    app: Optional[str] = typer.Option(
+        None,
+        "--app",
+        help="""\
+            The executable to run, if it isn't named like the package.  It may also be
+            an executable of a dependency.""",
+    ),
+    package: str = typer.Argument(..., help="The package spec to run."),
+    args: Optional[List[str]] = typer.Argument(None, help="Arguments to pass on."),
+):
+    if offline:
+        config.CONFIG.offline = True
+    if channel is None or (len(channel) == 0):
+        channel = config.CONFIG.channels
+    if not core.run_environment_cached(package, channel):
+        config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+    sys.exit(core.run_package(package, list(args or []), channels=channel, app=app))
+
+
+@cli.command(
+    help="""
+    Export the exact contents of condax environments to a lock file.
+
+    The lock lists the url and hash of every package in each environment, so that
+    `condax install --locked` can recreate them without solving.
+    """
+)
+def export(
+    output: Optional[Path] = typer.Option(
+        None, "--output", "-o", dir_okay=False, help="Write to this file, not stdout."
+    ),
+    packages: Optional[List[str]] = typer.Argument(
+        None, metavar="[PACKAGE]...", help="Environments to export, default all."
+    ),
+) -> None:
+    lock = core.export_environments(packages)
+    events.update_result(lock=lock.model_dump(mode="json"))
+    text = lock.model_dump_json(indent=2)
+    if output is None:
+        typer.echo(text)
+    else:
+        output.write_text(text + "\n")
+
+
+@cli.command(
+    help="""
+    Hard-link identical package files across condax environments.
+
+    conda copies package files into each environment when it can't hard-link them
+    from its package cache.  This finds files of the same package build that are
+    identical (byte for byte) in several environments and replaces the copies by hard
+    links to a single file.
+    """
+)
+def dedupe(
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Only report what would be linked and saved."
+    ),
+    packages: Optional[List[str]] = typer.Argument(
+        None,
+        metavar="[PACKAGE]...",
+        help="Only replace files in these environments, default all.",
+    ),
+) -> None:
+    core.dedupe_environments(packages, dry_run=dry_run)
+
+
+@cli.command(
+    help=f"""
+    Recreate the links of condax environments in {config.CONFIG.link_destination}.
+
+    Links that are missing (e.g. deleted by hand) are created, and links to
+    executables that are no longer in the environment are removed.
+    """
+)
+def relink(
+    link_conflict: core.LinkConflictAction = _OPTION_LINK_ACTION,
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Only print the links that would be changed."
+    ),
+    packages: Optional[List[str]] = typer.Argument(
+        None,
+        metavar="[PACKAGE]...",
+        help="Only relink these environments, default all.",
+    ),
+) -> None:
+    core.relink_packages(packages, link_conflict, dry_run=dry_run)
+
+
+@cli.command(
+    help="""
+    Install, update and remove condax environments to match a manifest.
+
+    The manifest is a YAML file listing the tools to install, optionally with a
+    version, the channels to install from and packages to inject.  Only the
+    environments that differ from the manifest are changed, and environments that
+    aren't listed are removed.
+    """
+)
+def sync(
+    link_conflict: core.LinkConflictAction = _OPTION_LINK_ACTION,
+    mamba: bool = _OPTION_MAMBA,
+    jobs: int = _OPTION_JOBS,
+    offline: bool = _OPTION_OFFLINE,
+    dry_run: bool = typer.Option(
+        False, "--dry-run", help="Only print the changes that would be made."
+    ),
+    keep_unlisted: bool = typer.Option(
+        False,
+        "--keep-unlisted",
+        help="Don't remove environments that aren't listed in the manifest.",
+    ),
+    manifest_file: Path = typer.Argument(
+        ..., exists=True, dir_okay=False, metavar="MANIFEST"
+    ),
+) -> None:
+    if offline:
+        config.CONFIG.offline = True
+    try:
+        tools = manifest.read_manifest(manifest_file)
+    except ValueError as e:
+        typer.secho(str(e), err=True, fg=typer.colors.RED)
+        sys.exit(1)
+    changes = manifest.plan_sync(tools, remove_unlisted=not keep_unlisted)
+    events.update_result(changes=[change.model_dump(mode="json") for change in changes])
+    if not changes:
+        typer.echo("Nothing to do")
+        return
+    for change in changes:
+        typer.echo(change.describe())
+    if dry_run:
+        return
+    config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+    core.sync_tools(changes, link_conflict, jobs=jobs)
+
+
+@cli.command(
+    help="""
+    Check condax environments, links and metadata for problems.
+
+    Reports dangling links to executables that no longer exist, links recorded in
+    the metadata of an environment that don't exist, environments without metadata,
+    environments named after a spec by older versions of condax and an out of date
+    registry.  Exits with status 1 if problems were found and not fixed.
+    """
+)
+def doctor(
+    fix: bool = typer.Option(False, "--fix", help="Repair the problems found."),
+) -> None:
+    core.check_installation(fix=fix)
+
+
 @cli.command(
     help="""
     Remove a package installed by condax.
@@ -147,7 +478,33 @@ def ensure_path() -> None:
 
 @cli.command(help="""Display the conda prefix for a condax package.""")
 def prefix(package: str) -> None:
-    typer.echo(core.prefix(package))
+    env_prefix = core.prefix(package)
+    events.update_result(prefix=str(env_prefix))
+    typer.echo(env_prefix)
+
+
+@cli.command(
+    name="list",
+    help="""
+    List the packages installed by condax.
+
+    Shows the version, build and channel of the main package of each environment.
+    With `condax --json` the packages are in the result instead.
+    """,
+)
+def list_(
+    links: bool = typer.Option(
+        False, "--links", help="Also show the links created for each package."
+    ),
+    injected: bool = typer.Option(
+        False,
+        "--injected",
+        help="Also show the packages injected into each environment.",
+    ),
+) -> None:
+    packages = core.list_packages()
+    events.update_result(packages=[p.model_dump(mode="json") for p in packages])
+    core.print_packages(packages, show_links=links, show_injected=injected)
 
 
 @cli.command(
@@ -161,22 +518,122 @@ def update(
     all: bool = typer.Option(
         False, "--all", help="Set to update all packages installed by condax"
     ),
+    jobs: int = _OPTION_JOBS,
+    check: bool = typer.Option(
+        False,
+        "--check",
+        help="""\
+            First compare the installed packages against the channels' repodata, and
+            only update environments for which newer packages exist.""",
+    ),
     link_conflict: core.LinkConflictAction = _OPTION_LINK_ACTION,
     mamba: bool = _OPTION_MAMBA,
+    offline: bool = _OPTION_OFFLINE,
     package: Optional[str] = typer.Argument(None),
 ):
-    config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+    if offline:
+        config.CONFIG.offline = True
     if all and package is not None:
         typer.echo("Cannot specify --all and a package name")
         sys.exit(1)
+
+    def ensure_conda() -> None:
+        # with --check, up to date environments don't need conda
+        config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+
     if all:
-        core.update_all_packages(link_conflict)
+        core.update_all_packages(
+            link_conflict, jobs=jobs, check=check, ensure_conda=ensure_conda
+        )
     elif package:
-        core.update_package(package, link_conflict)
+        try:
+            core.update_package(
+                package, link_conflict, check=check, ensure_conda=ensure_conda
+            )
+        except subprocess.CalledProcessError:
+            sys.exit(1)
     else:
         typer.echo("Must specify --all or a package name")
         sys.exit(1)
 
 
+@cli.command(
+    help="""
+    Restore a condax environment to how it was before its last update.
+
+    Rolling back again returns to the updated environment.
+    """
+)
+def rollback(
+    link_conflict: core.LinkConflictAction = _OPTION_LINK_ACTION,
+    package: str = typer.Argument(...),
+) -> None:
+    core.rollback_package(package, link_conflict)
+
+
+cache_cli = typer.Typer(
+    name="cache",
+    help="Manage the package cache used for offline installs.",
+    no_args_is_help=True,
+)
+cli.add_typer(cache_cli)
+
+
+@cache_cli.command(
+    help="""
+    Download the packages needed to install tools, without installing them.
+
+    Packages are stored in the package cache, from which `condax install --offline`
+    links them without any network access.  With `--local-channel` they are also
+    published as a `file://` channel that can be copied to machines without internet.
+    """
+)
+def populate(
+    channel: Optional[List[str]] = typer.Option(
+        None,
+        "--channel",
+        "-c",
+        help=f"""\
+            Use the channels specified to download.  If not specified condax will
+            default to using {config.CONFIG.channels}.""",
+    ),
+    mamba: bool = _OPTION_MAMBA,
+    from_file: Optional[Path] = typer.Option(
+        None,
+        "--from-file",
+        "-f",
+        exists=True,
+        dir_okay=False,
+        help="Download the packages listed in this file, one package spec per line.",
+    ),
+    pkgs_dir: Optional[Path] = typer.Option(
+        None,
+        "--pkgs-dir",
+        file_okay=False,
+        help="Download to this package cache instead of the configured one.",
+    ),
+    local_channel: Optional[Path] = typer.Option(
+        None,
+        "--local-channel",
+        file_okay=False,
+        help="Also add the packages to the local channel in this directory.",
+    ),
+    packages: Optional[List[str]] = typer.Argument(None, metavar="PACKAGE..."),
+) -> None:
+    packages = list(packages or [])
+    if from_file is not None:
+        packages.extend(core.read_package_file(from_file))
+    if not packages:
+        typer.echo("Must specify at least one package or --from-file")
+        sys.exit(1)
+    if channel is None or (len(channel) == 0):
+        channel = config.CONFIG.channels
+    if pkgs_dir is not None:
+        config.CONFIG.pkgs_dirs = [pkgs_dir.expanduser()]
+    config.CONFIG.ensure_conda_executable(require_mamba=mamba)
+
+    core.populate_cache(packages, channels=channel, channel_dir=local_channel)
+
+
 if __name__ == "__main__":
     cli()
@@ -1,13 +1,24 @@
+import abc
+import codecs
+import contextlib
 import enum
+import hashlib
 import json
 import logging
 import os
+import platform
 import re
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Optional, Set
+from typing import Any, Callable, Dict, Generator, List, Optional, Set, Tuple
 
+from . import events, locking, tracing
+from .conda_meta import read_package_files
 from .config import CONFIG, is_windows
+from .metadata import ExecutablesIndex, IndexedCondaMeta, LockedPackage
 
 
 def ensure_dest_prefix() -> None:
@@ -29,20 +40,313 @@ def write_condarc_to_prefix(
         fo.write("\n")
 
 
+def run_conda(
+    args: List[str],
+    capture_output: bool = False,
+    pkgs_dirs: Optional[List[Path]] = None,
+) -> Optional[str]:
+    """Run a conda command, raising `CalledProcessError` if it fails.
+
+    If `capture_output` is set the combined stdout/stderr of conda is returned instead
+    of being written to the terminal, so that concurrent commands don't interleave.
+    On failure the captured output is available as `CalledProcessError.output`.
+
+    Packages are cached in `pkgs_dirs`, by default `CONFIG.pkgs_dirs` if that is set.
+
+    With `condax --json` commands that change environments report their progress as
+    events instead, and return no output.
+    """
+    env = _conda_environ(CONFIG.pkgs_dirs if pkgs_dirs is None else pkgs_dirs)
+    with tracing.span(f"conda {args[1]}", argv=args) as span:
+        try:
+            if events.is_enabled() and args[1] in _JSON_COMMANDS:
+                get_backend().run_json(_json_args(args), env, _ProgressEvents(args))
+                return "" if capture_output else None
+            return get_backend().run(args, capture_output, env)
+        except subprocess.CalledProcessError as e:
+            span["exit_code"] = e.returncode
+            raise
+        finally:
+            span.setdefault("exit_code", 0)
+
+
+class Backend(abc.ABC):
+    """Runs conda commands for `run_conda`.
+
+    `args` is a full command line, starting with the conda executable.  The command
+    must run with the environment variables `env`, raise `CalledProcessError` if it
+    fails and return its combined stdout/stderr if `capture_output` is set.
+
+    Backends that aren't `thread_safe` get their commands from one thread only, see
+    `executor`.
+    """
+
+    thread_safe = True
+
+    @abc.abstractmethod
+    def run(
+        self, args: List[str], capture_output: bool, env: Dict[str, str]
+    ) -> Optional[str]: ...
+
+    def run_json(
+        self, args: List[str], env: Dict[str, str], on_document: "_ProgressEvents"
+    ) -> None:
+        """Run a command with `--json` output, passing each JSON document it writes to
+        `on_document`.  If it fails the error reported by conda is the `output` of the
+        `CalledProcessError`."""
+        stream = events.JsonStream()
+        try:
+            output = self.run(args, True, env)
+        except subprocess.CalledProcessError as e:
+            for document in stream.feed(e.output or ""):
+                on_document(document)
+            e.output = on_document.error or e.output
+            raise
+        for document in stream.feed(output or ""):
+            on_document(document)
+
+
+class SubprocessBackend(Backend):
+    """Run every command in a new conda process."""
+
+    def run(
+        self, args: List[str], capture_output: bool, env: Dict[str, str]
+    ) -> Optional[str]:
+        if capture_output:
+            return subprocess.run(
+                args,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                env=env,
+            ).stdout
+        subprocess.check_call(args, env=env, stdout=events.child_stdout())
+        return None
+
+    def run_json(
+        self, args: List[str], env: Dict[str, str], on_document: "_ProgressEvents"
+    ) -> None:
+        # read as the output arrives, rather than all of it at the end
+        stream = events.JsonStream()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with subprocess.Popen(args, stdout=subprocess.PIPE, env=env) as proc:
+            assert proc.stdout is not None
+            while True:
+                chunk = os.read(proc.stdout.fileno(), 65536)
+                for document in stream.feed(decoder.decode(chunk, final=not chunk)):
+                    on_document(document)
+                if not chunk:
+                    break
+        if proc.returncode:
+            raise subprocess.CalledProcessError(
+                proc.returncode, args, output=on_document.error
+            )
+
+
+class InProcessBackend(Backend):
+    """Run commands with conda's Python API, in this process.
+
+    A new conda process has to load its configuration and parse the repodata of every
+    channel again, which for large channels takes longer than the solve itself.  In
+    process both happen once per condax run, and the parsed repodata is reused for
+    every environment.  This needs condax to be installed into an environment that
+    has conda (which may use the libmamba solver).
+
+    conda isn't thread safe and reads its settings from `os.environ`, which is
+    replaced while a command runs.  So commands run one at a time on the thread that
+    condax runs on, and `--jobs` has no effect.
+    """
+
+    thread_safe = False
+
+    def __init__(self) -> None:
+        from conda.cli.python_api import run_command  # type: ignore
+
+        self._run_command = run_command
+        self._lock = threading.Lock()
+
+    def run(
+        self, args: List[str], capture_output: bool, env: Dict[str, str]
+    ) -> Optional[str]:
+        streams = {} if capture_output else {"stdout": None, "stderr": None}
+        with self._lock, _environ(env):
+            stdout, stderr, returncode = self._run_command(
+                args[1], *args[2:], use_exception_handler=True, **streams
+            )
+        output = (stdout or "") + (stderr or "") if capture_output else None
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, args, output=output)
+        return output
+
+
+@contextlib.contextmanager
+def _environ(env: Dict[str, str]) -> Generator[None, None, None]:
+    """Temporarily replace `os.environ`, which conda reads its settings from."""
+    saved = dict(os.environ)
+    os.environ.clear()
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        os.environ.clear()
+        os.environ.update(saved)
+
+
+_backend: Optional[Backend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Backend:
+    """The backend used for the rest of this run, see `CONFIG.conda_backend`."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = SubprocessBackend()
+            if CONFIG.conda_backend == "in-process":
+                try:
+                    _backend = InProcessBackend()
+                except ImportError as e:
+                    logging.warning("Running conda in a subprocess instead: %s", e)
+        return _backend
+
+
+def set_backend(backend: Optional[Backend]) -> None:
+    """Use `backend` for running conda commands, or reset to the configured one."""
+    global _backend
+    _backend = backend
+
+
+def executor(jobs: int) -> Executor:
+    """An executor for conda commands of up to `jobs` environments at a time.  If the
+    backend isn't thread safe they run one after the other, as they are submitted."""
+    if get_backend().thread_safe:
+        return ThreadPoolExecutor(max_workers=max(jobs, 1))
+    return _CallingThreadExecutor()
+
+
+class _CallingThreadExecutor(Executor):
+    def submit(self, fn: Callable[..., Any], /, *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        # like in a worker thread, link conflicts are reported through sys.exit
+        except (Exception, SystemExit) as e:
+            future.set_exception(e)
+        return future
+
+
+def _conda_environ(pkgs_dirs: List[Path]) -> Dict[str, str]:
+    env = dict(os.environ)
+    if pkgs_dirs:
+        env["CONDA_PKGS_DIRS"] = ",".join(str(p) for p in pkgs_dirs)
+    if CONFIG.repodata_ttl is not None:
+        # Reuse the repodata cached in the package cache by an earlier command rather
+        # than fetching it again for every environment.
+        env.setdefault("CONDA_LOCAL_REPODATA_TTL", str(CONFIG.repodata_ttl))
+        env.setdefault("MAMBA_REPODATA_TTL", str(CONFIG.repodata_ttl))
+    return env
+
+
+def prefetch_repodata(channels: List[str], package: str) -> None:
+    """Fetch the repodata of `channels` into the package cache.
+
+    When several conda commands are about to run concurrently they would all find an
+    empty or expired cache and download the same repodata.  Searching for a package
+    fetches the repodata without solving, so that they can all reuse it instead.
+    Failures are not fatal, the commands will just fetch the repodata themselves.
+    """
+    if CONFIG.offline:
+        return
+    conda_exe = CONFIG.get_conda_executable()
+    channels_args: List[str] = []
+    for c in channels:
+        channels_args.extend(["--channel", c])
+    try:
+        run_conda(
+            [
+                str(conda_exe),
+                "search",
+                "--override-channels",
+                *channels_args,
+                "--json",
+                package_name(package),
+            ],
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.info("Could not prefetch repodata for %s: %s", channels, e)
+
+
+# commands whose progress is reported as events with `condax --json`
+_JSON_COMMANDS = ("create", "install", "update", "remove")
+
+
+def _json_args(args: List[str]) -> List[str]:
+    """`args` with conda's JSON output, which includes progress unless `--quiet`."""
+    return [args[0], args[1], "--json", *(a for a in args[2:] if a != "--quiet")]
+
+
+class _ProgressEvents:
+    """Turn the JSON documents written by a conda command into events."""
+
+    def __init__(self, args: List[str]) -> None:
+        self.command = args[1]
+        self.environment = (
+            Path(args[args.index("--prefix") + 1]).name if "--prefix" in args else None
+        )
+        self.error: Optional[str] = None
+
+    def __call__(self, document: Any) -> None:
+        if not isinstance(document, dict):
+            return
+        if "fetch" in document:
+            self._emit(
+                "conda_download",
+                package=document["fetch"],
+                progress=document.get("progress"),
+                finished=document.get("finished", False),
+            )
+        elif "error" in document or "exception_name" in document:
+            self.error = document.get("message") or document.get("error")
+            self._emit("conda_error", message=self.error)
+        else:
+            actions = document.get("actions") or {}
+            for action, event in (("UNLINK", "conda_unlink"), ("LINK", "conda_link")):
+                for dist in actions.get(action) or []:
+                    self._emit(
+                        event,
+                        package=dist.get("name"),
+                        version=dist.get("version"),
+                        build=dist.get("build_string"),
+                        channel=dist.get("channel"),
+                    )
+
+    def _emit(self, event: str, **fields: Any) -> None:
+        events.emit(event, command=self.command, environment=self.environment, **fields)
+
+
+def _offline_args() -> List[str]:
+    return ["--offline"] if CONFIG.offline else []
+
+
 class CreateResult(enum.Enum):
     CREATED = enum.auto()
     ALREADY_EXISTS = enum.auto()
 
 
 def create_conda_environment(
-    package: str, channels: Optional[List[str]] = None
+    package: str,
+    channels: Optional[List[str]] = None,
+    capture_output: bool = False,
+    prefix: Optional[Path] = None,
 ) -> CreateResult:
-    if conda_environment_exists(package):
+    if prefix is None:
+        prefix = conda_env_prefix(package)
+    if prefix.exists():
         return CreateResult.ALREADY_EXISTS
 
-    conda_exe = CONFIG.conda_executable
-    assert conda_exe is not None
-    prefix = conda_env_prefix(package)
+    conda_exe = CONFIG.get_conda_executable()
     if channels is None:
         channels = CONFIG.channels
 
@@ -50,7 +354,7 @@ def create_conda_environment(
     for c in channels:
         channels_args.extend(["--channel", c])
 
-    subprocess.check_call(
+    run_conda(
         [
             str(conda_exe),
             "create",
@@ -58,26 +362,137 @@ def create_conda_environment(
             str(prefix),
             "--override-channels",
             *channels_args,
+            *_offline_args(),
             "--quiet",
             "--yes",
             package,
-        ]
+        ],
+        capture_output=capture_output,
     )
 
+    invalidate_executables_index(prefix)
+    write_condarc_to_prefix(prefix, channels)
+    return CreateResult.CREATED
+
+
+def create_conda_environment_explicit(
+    package: str,
+    packages: List[LockedPackage],
+    channels: List[str],
+    capture_output: bool = False,
+) -> CreateResult:
+    """Create the environment from explicit package urls, without solving."""
+    if conda_environment_exists(package):
+        return CreateResult.ALREADY_EXISTS
+
+    conda_exe = CONFIG.get_conda_executable()
+    prefix = conda_env_prefix(package)
+    with tempfile.TemporaryDirectory() as tmp:
+        explicit_file = Path(tmp) / "explicit.txt"
+        explicit_file.write_text(explicit_specs(packages))
+        run_conda(
+            [
+                str(conda_exe),
+                "create",
+                "--prefix",
+                str(prefix),
+                *_offline_args(),
+                "--quiet",
+                "--yes",
+                "--file",
+                str(explicit_file),
+            ],
+            capture_output=capture_output,
+        )
+
+    invalidate_executables_index(prefix)
     write_condarc_to_prefix(prefix, channels)
     return CreateResult.CREATED
 
 
+def download_packages(
+    package: str,
+    channels: List[str],
+    pkgs_dirs: Optional[List[Path]] = None,
+    capture_output: bool = False,
+) -> Optional[str]:
+    """Download (and extract) everything needed to install `package` into the
+    package cache, without creating an environment."""
+    conda_exe = CONFIG.get_conda_executable()
+    channels_args: List[str] = []
+    for c in channels:
+        channels_args.extend(["--channel", c])
+    with tempfile.TemporaryDirectory() as tmp:
+        return run_conda(
+            [
+                str(conda_exe),
+                "create",
+                "--prefix",
+                str(Path(tmp) / "env"),
+                "--override-channels",
+                *channels_args,
+                *_offline_args(),
+                "--download-only",
+                "--quiet",
+                "--yes",
+                package,
+            ],
+            capture_output=capture_output,
+            pkgs_dirs=pkgs_dirs,
+        )
+
+
+def explicit_specs(packages: List[LockedPackage]) -> str:
+    """Render packages in conda's `@EXPLICIT` environment file format."""
+    lines = ["@EXPLICIT"]
+    for package in packages:
+        lines.append(f"{package.url}#{package.md5}" if package.md5 else package.url)
+    return "\n".join(lines) + "\n"
+
+
+def locked_packages(env_prefix: Path) -> List[LockedPackage]:
+    """The exact packages installed in a prefix, sorted by url."""
+    packages = []
+    for path in (env_prefix / "conda-meta").glob("*.json"):
+        record = json.loads(path.read_text())
+        if not record.get("url"):
+            raise ValueError(f"{path} does not record where the package came from")
+        packages.append(
+            LockedPackage(
+                url=record["url"], md5=record.get("md5"), sha256=record.get("sha256")
+            )
+        )
+    return sorted(packages, key=lambda p: p.url)
+
+
+def current_platform() -> str:
+    """The conda subdir of this machine, e.g. `linux-64` or `osx-arm64`."""
+    system = {"Linux": "linux", "Darwin": "osx", "Windows": "win"}.get(
+        platform.system(), platform.system().lower()
+    )
+    machine = platform.machine().lower()
+    arch = {
+        "x86_64": "64",
+        "amd64": "64",
+        "i386": "32",
+        "i686": "32",
+        "arm64": "aarch64" if system == "linux" else "arm64",
+    }.get(machine, machine)
+    return f"{system}-{arch}"
+
+
 def conda_environment_exists(package: str):
     prefix = conda_env_prefix(package)
     return prefix.exists()
 
 
 def install_conda_packages(
-    packages: List[str], prefix: Path, channels: Optional[List[str]] = None
-):
-    conda_exe = CONFIG.conda_executable
-    assert conda_exe is not None
+    packages: List[str],
+    prefix: Path,
+    channels: Optional[List[str]] = None,
+    capture_output: bool = False,
+) -> Optional[str]:
+    conda_exe = CONFIG.get_conda_executable()
     if channels is None:
         channels = CONFIG.channels
 
@@ -86,82 +501,168 @@ def install_conda_packages(
         for c in channels:
             channels_args.extend(["--channel", c])
 
-    subprocess.check_call(
-        [
-            str(conda_exe),
-            "install",
-            "--prefix",
-            str(prefix),
-            "--override-channels",
-            *channels_args,
-            "--quiet",
-            "--yes",
-            *packages,
-        ]
-    )
-
-
-def remove_conda_env(package) -> None:
-    conda_exe = CONFIG.conda_executable
-    assert conda_exe is not None
+    try:
+        return run_conda(
+            [
+                str(conda_exe),
+                "install",
+                "--prefix",
+                str(prefix),
+                "--override-channels",
+                *channels_args,
+                *_offline_args(),
+                "--quiet",
+                "--yes",
+                *packages,
+            ],
+            capture_output=capture_output,
+        )
+    finally:
+        invalidate_executables_index(prefix)
+
+
+def remove_conda_env(package, capture_output: bool = False) -> Optional[str]:
+    conda_exe = CONFIG.get_conda_executable()
 
     prefix = conda_env_prefix(package)
-    subprocess.check_call(
-        [str(conda_exe), "remove", "--prefix", str(prefix), "--all", "--yes"]
+    return run_conda(
+        [str(conda_exe), "remove", "--prefix", str(prefix), "--all", "--yes"],
+        capture_output=capture_output,
     )
 
 
-def update_conda_env(package) -> None:
-    conda_exe = CONFIG.conda_executable
-    assert conda_exe is not None
+def update_conda_env(package, capture_output: bool = False) -> Optional[str]:
+    conda_exe = CONFIG.get_conda_executable()
 
     prefix = conda_env_prefix(package)
-    subprocess.check_call(
-        [str(conda_exe), "update", "--prefix", str(prefix), "--all", "--yes"]
-    )
+    try:
+        return run_conda(
+            [
+                str(conda_exe),
+                "update",
+                "--prefix",
+                str(prefix),
+                "--all",
+                *_offline_args(),
+                "--yes",
+            ],
+            capture_output=capture_output,
+        )
+    finally:
+        invalidate_executables_index(prefix)
 
 
 def conda_env_prefix(package: str) -> Path:
-    return CONFIG.prefix_path / package
+    """The prefix of the environment for a package spec, named after the package so
+    that every spec of a package maps to the same environment."""
+    return CONFIG.prefix_path / package_name(package)
+
+
+def installed_prefixes() -> List[Path]:
+    """All environments managed by condax, sorted by name."""
+    if not CONFIG.prefix_path.exists():
+        return []
+    return sorted(
+        p
+        for p in CONFIG.prefix_path.iterdir()
+        if p.is_dir() and not p.name.startswith(".")
+    )
 
 
 _RE_PKG_NAME = re.compile(r"^[a-zA-Z0-9._-]+")
 
 
 def package_name(package_spec: str):
-    """Get the package name from a package spec"""
-    m = _RE_PKG_NAME.match(package_spec)
+    """Get the package name from a package spec, like `conda-forge::black>=23`"""
+    m = _RE_PKG_NAME.match(package_spec.split("::")[-1])
     assert m is not None
     return m.group(0)
 
 
-def determine_executables_from_env(
-    package: str, env_prefix: Optional[Path] = None
-) -> Set[Path]:
-    if env_prefix is None:
-        env_prefix = conda_env_prefix(package)
-    name = package_name(package)
-    metas = (env_prefix / "conda-meta").glob(f"{name}*.json")
-    for path in metas:
-        package_info = json.loads(path.read_text())
-        if package_info["name"] == name:
-            logging.debug("Candidate files: %s", package_info["files"])
-            potential_executables: List[str] = []
-            for fn in package_info["files"]:
-                if is_windows():
-                    processed_fn = fn.lower().replace("\\", "/")
-                    if (
-                        processed_fn.startswith("scripts/")
-                        or processed_fn.startswith("library/mingw-w64/bin/")
-                        or re.match(r"library/.*/bin/", processed_fn)
-                    ):
-                        potential_executables.append(fn)
-                else:
-                    if fn.startswith("bin/") or fn.startswith("sbin/"):
-                        potential_executables.append(fn)
-            break
+def split_conda_meta_filename(filename: str) -> Optional[Tuple[str, str, str]]:
+    """Split a conda-meta file name into the name, version and build of the package.
+
+    conda-meta records are named `{name}-{version}-{build}.json` and neither the
+    version nor the build may contain dashes."""
+    if not filename.endswith(".json"):
+        return None
+    parts = filename[: -len(".json")].rsplit("-", 2)
+    if len(parts) != 3:
+        return None
+    return parts[0], parts[1], parts[2]
+
+
+def find_conda_meta_record(name: str, env_prefix: Path) -> Optional[Path]:
+    """Find the conda-meta record of the package `name` using only file names."""
+    for path in (env_prefix / "conda-meta").glob(f"{name}-*.json"):
+        parts = split_conda_meta_filename(path.name)
+        if parts is not None and parts[0] == name:
+            return path
+    return None
+
+
+def resolved_hash(env_prefix: Path) -> str:
+    """A hash of the exact set of packages installed in a prefix, from the names of
+    its conda-meta records."""
+    names = sorted(p.name for p in (env_prefix / "conda-meta").glob("*.json"))
+    return hashlib.sha256("\n".join(names).encode()).hexdigest()
+
+
+EXECUTABLES_INDEX = ".condax-executables.json"
+
+
+def invalidate_executables_index(prefix: Path) -> None:
+    """Drop the cached executables index after conda has modified `prefix`."""
+    try:
+        os.remove(prefix / EXECUTABLES_INDEX)
+    except FileNotFoundError:
+        pass
+
+
+def _load_executables_index(env_prefix: Path) -> ExecutablesIndex:
+    index_path = env_prefix / EXECUTABLES_INDEX
+    try:
+        return ExecutablesIndex.model_validate_json(index_path.read_text())
+    except FileNotFoundError:
+        return ExecutablesIndex()
+    except ValueError:
+        logging.debug("Ignoring corrupt executables index %s", index_path)
+        return ExecutablesIndex()
+
+
+def _save_executables_index(env_prefix: Path, index: ExecutablesIndex) -> None:
+    try:
+        locking.write_text_atomic(
+            env_prefix / EXECUTABLES_INDEX, index.model_dump_json()
+        )
+    except OSError:
+        logging.debug("Could not write executables index to %s", env_prefix)
+
+
+def _is_potential_executable(fn: str) -> bool:
+    if is_windows():
+        processed_fn = fn.lower().replace("\\", "/")
+        return (
+            processed_fn.startswith("scripts/")
+            or processed_fn.startswith("library/mingw-w64/bin/")
+            or re.match(r"library/.*/bin/", processed_fn) is not None
+        )
     else:
-        raise ValueError("Could not determine package files")
+        return fn.startswith("bin/") or fn.startswith("sbin/")
+
+
+def _index_conda_meta(
+    path: Path, env_prefix: Path, stat: os.stat_result, name: str
+) -> IndexedCondaMeta:
+    with open(path, encoding="utf-8") as fo:
+        record_name, potential_executables = read_package_files(
+            fo, name, _is_potential_executable
+        )
+    if potential_executables is None:
+        return IndexedCondaMeta(
+            mtime_ns=stat.st_mtime_ns, size=stat.st_size, name=record_name
+        )
+    logging.debug("Candidate files: %s", potential_executables)
 
     pathext = os.environ.get("PATHEXT", "").split(";")
     executables: Set[Path] = set()
@@ -175,5 +676,76 @@ def determine_executables_from_env(
             if ext and abs_executable_path.name.endswith(ext):
                 executables.add(abs_executable_path)
 
+    return IndexedCondaMeta(
+        mtime_ns=stat.st_mtime_ns,
+        size=stat.st_size,
+        name=record_name,
+        executables=sorted(executables),
+    )
+
+
+def determine_executables_from_env(
+    package: str, env_prefix: Optional[Path] = None
+) -> Set[Path]:
+    """Find the executables provided by `package` (but not its dependencies).
+
+    Only the conda-meta record of the package is opened, found by its file name.
+    Results are cached per conda-meta record in an index stored in the prefix, keyed
+    on the modification time and size of the record, so repeated lookups don't have
+    to parse the (potentially huge) conda-meta JSON files again.
+    """
+    with tracing.span("determine executables", package=package) as span:
+        if env_prefix is None:
+            env_prefix = conda_env_prefix(package)
+        name = package_name(package)
+        path = find_conda_meta_record(name, env_prefix)
+        if path is None:
+            raise ValueError("Could not determine package files")
+        index = _load_executables_index(env_prefix)
+        record, reindexed = _indexed_record(index, path, env_prefix, name)
+        span["reindexed"] = reindexed
+        if reindexed:
+            _save_executables_index(env_prefix, index)
+        if record.executables is None:
+            raise ValueError("Could not determine package files")
+        executables = set(record.executables)
     logging.debug(executables)
     return executables
+
+
+def determine_all_executables(env_prefix: Path) -> Set[Path]:
+    """Find the executables provided by every package in the environment, including
+    the dependencies of the package it was created for."""
+    with tracing.span("determine all executables", prefix=env_prefix.name) as span:
+        index = _load_executables_index(env_prefix)
+        executables: Set[Path] = set()
+        reindexed = False
+        for path in (env_prefix / "conda-meta").glob("*.json"):
+            parts = split_conda_meta_filename(path.name)
+            if parts is None:
+                continue
+            record, changed = _indexed_record(index, path, env_prefix, parts[0])
+            reindexed |= changed
+            executables.update(record.executables or [])
+        span["reindexed"] = reindexed
+        if reindexed:
+            _save_executables_index(env_prefix, index)
+    return executables
+
+
+def _indexed_record(
+    index: ExecutablesIndex, path: Path, env_prefix: Path, name: str
+) -> Tuple[IndexedCondaMeta, bool]:
+    """The indexed executables of the conda-meta record `path` of package `name`, and
+    whether it had to be (re)indexed."""
+    stat = path.stat()
+    record = index.records.get(path.name)
+    if (
+        record is not None
+        and record.mtime_ns == stat.st_mtime_ns
+        and record.size == stat.st_size
+        and not (record.name == name and record.executables is None)
+    ):
+        return record, False
+    record = index.records[path.name] = _index_conda_meta(path, env_prefix, stat, name)
+    return record, True
@@ -0,0 +1,211 @@
+"""Incremental reader for conda-meta records.
+
+conda-meta records list every file of a package twice (`files` and `paths_data`), so
+for packages like `python` they easily run into megabytes.  To find the executables
+of a package we only need `name` and the `bin/` entries of `files`, so instead of
+`json.loads`-ing the whole record this streams it, keeps only the `files` entries that
+are asked for and stops as soon as both keys have been seen.  conda writes the keys
+in sorted order, so that is right after `name`, before `paths_data`.  Records are
+found by their file name (`name-version-build.json`), so checking `name` is only a
+safeguard: since `files` sorts first, a record of another package is still read up
+to its `name`.
+"""
+
+import json
+import re
+from typing import IO, Any, Callable, Collection, Dict, List, Optional, Tuple
+
+_CHUNK_SIZE = 64 * 1024
+
+_STRING = r'"[^"\\]*(?:\\.[^"\\]*)*"'
+_RE_STRING = re.compile(_STRING)
+_RE_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_RE_STRUCTURE = re.compile(r'[\[\]{}"]')
+_RE_SCALAR = re.compile(r"[^,}\] \t\n\r]*")
+# a run of complete array items, each followed by a comma, and the final item
+_RE_STRING_ITEMS = re.compile(rf"(?:[ \t\n\r]*{_STRING}[ \t\n\r]*,)*")
+_RE_LAST_STRING_ITEM = re.compile(rf"[ \t\n\r]*({_STRING})[ \t\n\r]*\]")
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """A minimal pull parser over a text stream that is read in chunks."""
+
+    def __init__(self, fo: IO[str]) -> None:
+        self._fo = fo
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> None:
+        if self._eof:
+            raise ValueError("Unexpected end of conda-meta record")
+        chunk = self._fo.read(_CHUNK_SIZE)
+        if not chunk:
+            self._eof = True
+        self._buf = self._buf[self._pos :] + chunk
+        self._pos = 0
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            m = _RE_WHITESPACE.match(self._buf, self._pos)
+            assert m is not None
+            self._pos = m.end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            self._fill()
+
+    def expect(self, chars: str) -> str:
+        ch = self.peek()
+        if ch not in chars:
+            raise ValueError(
+                f"Expected one of {chars!r} in conda-meta record, got {ch!r}"
+            )
+        self._pos += 1
+        return ch
+
+    def _match(self, pattern: "re.Pattern[str]") -> "re.Match[str]":
+        """Match `pattern` at the current position, reading more data until the match
+        can no longer grow."""
+        while True:
+            m = pattern.match(self._buf, self._pos)
+            if m is not None and (m.end() < len(self._buf) or self._eof):
+                return m
+            self._fill()
+
+    def read_string(self) -> str:
+        self.peek()
+        m = self._match(_RE_STRING)
+        self._pos = m.end()
+        s = m.group(0)
+        return json.loads(s) if "\\" in s else s[1:-1]
+
+    def read_value(self) -> Any:
+        if self.peek() not in '"[{':
+            # a number (or literal) only ends where the next token starts, which may
+            # be in a later chunk: `1` is a valid prefix of `1.5`
+            m = self._match(_RE_SCALAR)
+            self._pos = m.end()
+            return json.loads(m.group(0))
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def read_string_array(self, select: Callable[[str], bool]) -> List[str]:
+        """Read an array of strings, keeping only the items for which `select` is true.
+
+        Items are decoded a buffer at a time so that only the selected ones are kept
+        around."""
+        self.expect("[")
+        selected: List[str] = []
+        if self.peek() == "]":
+            self._pos += 1
+            return selected
+        while True:
+            m = _RE_STRING_ITEMS.match(self._buf, self._pos)
+            if m is not None and m.end() > self._pos:
+                items = json.loads(f"[{self._buf[self._pos : m.end() - 1]}]")
+                selected.extend(filter(select, items))
+                self._pos = m.end()
+            m = _RE_LAST_STRING_ITEM.match(self._buf, self._pos)
+            if m is not None:
+                item = json.loads(m.group(1))
+                if select(item):
+                    selected.append(item)
+                self._pos = m.end()
+                return selected
+            self._fill()
+
+    def skip_value(self) -> None:
+        """Consume the next value without building any Python objects for it."""
+        ch = self.peek()
+        if ch == '"':
+            self._pos = self._match(_RE_STRING).end()
+            return
+        if ch not in "[{":
+            self._pos = self._match(_RE_SCALAR).end()
+            return
+        depth = 0
+        while True:
+            m = _RE_STRUCTURE.search(self._buf, self._pos)
+            if m is None:
+                self._pos = len(self._buf)
+                self._fill()
+                continue
+            self._pos = m.start()
+            ch = m.group(0)
+            if ch == '"':
+                self._pos = self._match(_RE_STRING).end()
+                continue
+            self._pos += 1
+            depth += 1 if ch in "[{" else -1
+            if depth == 0:
+                return
+
+
+def read_package_files(
+    fo: IO[str], name: str, select: Callable[[str], bool]
+) -> Tuple[str, Optional[List[str]]]:
+    """Return the package name of the record and the entries of `files` for which
+    `select` is true.
+
+    If the record is not for the package `name` the files are None.
+    """
+    reader = _Reader(fo)
+    files: List[str] = []
+    record_name = ""
+    seen_name = seen_files = False
+    reader.expect("{")
+    if reader.peek() == "}":
+        raise ValueError("Empty conda-meta record")
+    while True:
+        key = reader.read_string()
+        reader.expect(":")
+        if key == "name":
+            record_name = reader.read_value()
+            if record_name != name:
+                return record_name, None
+            seen_name = True
+        elif key == "files":
+            files = reader.read_string_array(select)
+            seen_files = True
+        else:
+            reader.skip_value()
+        if seen_name and seen_files:
+            return record_name, files
+        if reader.expect(",}") == "}":
+            break
+    if not seen_name:
+        raise ValueError("conda-meta record has no name")
+    return record_name, files
+
+
+def read_record_fields(fo: IO[str], fields: Collection[str]) -> Dict[str, Any]:
+    """Return the requested top-level fields of a record.
+
+    Reading stops as soon as all of them have been seen, so asking for fields that
+    sort before `files` (like `build` or `channel`) is cheap."""
+    reader = _Reader(fo)
+    wanted = set(fields)
+    found: Dict[str, Any] = {}
+    reader.expect("{")
+    if reader.peek() == "}":
+        return found
+    while True:
+        key = reader.read_string()
+        reader.expect(":")
+        if key in wanted:
+            found[key] = reader.read_value()
+            if len(found) == len(wanted):
+                return found
+        else:
+            reader.skip_value()
+        if reader.expect(",}") == "}":
+            return found
@@ -2,17 +2,10 @@ import os
 import platform
 import warnings
 from pathlib import Path
-from typing import TYPE_CHECKING, Generator, List, Optional
+from typing import TYPE_CHECKING, Generator, List, Literal, Optional
 
 import yaml
-from pydantic import ConfigDict, Field, field_validator
-
-with warnings.catch_warnings():
-    # requests which is a transitive dependency has some chatty warnings during import
-    warnings.simplefilter("ignore", Warning)
-    import requests  # noqa: F401
-
-from ensureconda.api import ensureconda
+from pydantic import ConfigDict, field_validator
 from pydantic_settings import BaseSettings
 
 if TYPE_CHECKING:
@@ -23,15 +16,47 @@ def is_windows() -> bool:
     return platform.system() == "Windows"
 
 
+def _ensureconda(**kwargs) -> "Optional[StrPath]":
+    """Call ``ensureconda`` without paying for its import at module load time.
+
+    ensureconda pulls in requests (and friends) and probes binaries on PATH, which
+    only commands that actually shell out to conda should have to pay for.
+    """
+    with warnings.catch_warnings():
+        # requests which is a transitive dependency has some chatty warnings during import
+        warnings.simplefilter("ignore", Warning)
+        from ensureconda.api import ensureconda
+
+    return ensureconda(**kwargs)
+
+
 class Config(BaseSettings):
     prefix_path: Path = Path("~").expanduser() / ".condax"
     link_destination: Path = Path("~").expanduser() / ".local" / "bin"
     channels: List[str] = ["conda-forge", "defaults"]
-    conda_executable: Optional[Path] = Field(
-        default=ensureconda(
-            mamba=True, micromamba=True, conda=True, conda_exe=True, no_install=True
-        )
-    )
+    conda_executable: Optional[Path] = None
+    # Never reach the network; packages must come from the package cache or a local
+    # `file://` channel.
+    offline: bool = False
+    # Package caches to use instead of conda's own, the first one is written to.
+    pkgs_dirs: List[Path] = []
+    # Seconds for which downloaded channel repodata is reused, by condax and by the
+    # conda commands it runs.  If not set conda follows the channel's Cache-Control
+    # and condax fetches repodata once per command.
+    repodata_ttl: Optional[int] = None
+    # How conda commands are run: `subprocess`, or `in-process` with conda's Python
+    # API if condax is installed alongside conda.
+    conda_backend: Literal["subprocess", "in-process"] = "subprocess"
+    # Number of environments that `condax run` keeps, least recently used ones are
+    # removed first.
+    run_cache_size: int = 10
+    # Seconds after which an environment of `condax run` is created anew, to pick up
+    # new versions of the tool.
+    run_cache_max_age: int = 14 * 24 * 3600
+    # Keep a copy (of hard links) of an environment from before its last update, for
+    # `condax rollback` and to undo failed updates without reinstalling.  Taking it
+    # walks the whole environment, so it is off by default.
+    update_snapshots: bool = False
     model_config = ConfigDict(env_prefix="CONDAX_")
 
     @field_validator("prefix_path", "link_destination", mode="before")
@@ -43,9 +68,25 @@ class Config(BaseSettings):
         v = v.resolve()
         return v
 
+    @field_validator("pkgs_dirs", mode="before")
+    @classmethod
+    def expand_pkgs_dirs(cls, v: List[os.PathLike]) -> List[Path]:
+        return [Path(p).expanduser() for p in v]
+
+    def get_conda_executable(self) -> Path:
+        """Return the conda executable, resolving it from PATH on first use."""
+        if self.conda_executable is None:
+            exe = _ensureconda(
+                mamba=True, micromamba=True, conda=True, conda_exe=True, no_install=True
+            )
+            if exe is None:
+                raise RuntimeError("Could not find conda executable")
+            self.conda_executable = Path(exe)
+        return self.conda_executable
+
     def ensure_conda_executable(self, require_mamba: bool = True):
         def candidates() -> "Generator[Optional[StrPath], None, None]":
-            yield ensureconda(
+            yield _ensureconda(
                 mamba=True,
                 micromamba=True,
                 conda=False,
@@ -53,14 +94,14 @@ class Config(BaseSettings):
                 no_install=True,
             )
             if not require_mamba:
-                yield ensureconda(
+                yield _ensureconda(
                     mamba=False,
                     micromamba=False,
                     conda=True,
                     conda_exe=True,
                     no_install=True,
                 )
-            yield ensureconda(
+            yield _ensureconda(
                 mamba=True,
                 micromamba=True,
                 no_install=False,
@@ -68,7 +109,7 @@ class Config(BaseSettings):
                 conda_exe=False,
             )
             if not require_mamba:
-                yield ensureconda(
+                yield _ensureconda(
                     mamba=False,
                     micromamba=False,
                     no_install=False,
@@ -1,155 +1,160 @@
 import contextlib
 import os
-import pathlib
+import re
+import shutil
 import subprocess
 import sys
-from enum import Enum
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import Collection, Dict, Generator, List, Optional
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
 
 import typer
 
-from . import conda
-from .config import CONFIG, is_windows
-from .metadata import PrefixMetadata
+from . import (
+    activation,
+    conda,
+    dedupe,
+    doctor,
+    ephemeral,
+    events,
+    local_channel,
+    locking,
+    manifest,
+    registry,
+    repodata,
+    snapshots,
+    tracing,
+)
+from .conda_meta import read_record_fields
+from .config import CONFIG
+from .links import LinkConflictAction, LinkDestination, LinkPlan, env_prefix_of
+from .metadata import (
+    METADATA_FILENAME,
+    CondaxLock,
+    InstalledPackage,
+    LockedEnvironment,
+    PrefixMetadata,
+    RunEnvironment,
+    read_prefix_metadata,
+)
 
 
-class LinkConflictAction(str, Enum):
-    ERROR = "error"
-    OVERWRITE = "overwrite"
-    SKIP = "skip"
+def _link_owner_msg(link: Optional[Path]) -> str:
+    owner = registry.link_owner(link) if link is not None else None
+    return f" (owned by condax package `{owner}`)" if owner else ""
 
 
-def link_path(exe: Path) -> Path:
-    if is_windows():
-        executable_name = exe.name
-        name_only, _ = os.path.splitext(executable_name)
-        return CONFIG.link_destination / f"{name_only}.bat"
-    else:
-        executable_name = exe.name
-        return CONFIG.link_destination / executable_name
-
-
-def create_link_windows(
-    exe: Path, link_conflict_action: LinkConflictAction
-) -> Optional[Path]:
-    executable_name = os.path.basename(exe)
-    # create a batch file to run our application
-    win_path = pathlib.PureWindowsPath(exe)
-    bat_path = link_path(exe)
-    if bat_path.exists():
-        if link_conflict_action == LinkConflictAction.ERROR:
-            link_conflict_error_msg(executable_name)
-        elif link_conflict_action == LinkConflictAction.SKIP:
-            link_conflict_exists_msg(executable_name)
-            return None
-        elif link_conflict_action == LinkConflictAction.OVERWRITE:
-            typer.secho(
-                f"Overwriting existing link {bat_path}", err=True, fg=typer.colors.CYAN
-            )
-            os.remove(bat_path)
-    with open(bat_path, "w") as fo:
-        fo.writelines(
-            [
-                "@echo off\n",
-                "REM Entrypoint created by condax\n",
-                f'CALL "{win_path}" %*',
-            ]
-        )
-    return bat_path
-
-
-def create_link_unix(
-    exe: Path, link_conflict_action: LinkConflictAction
-) -> Optional[Path]:
-    executable_name = os.path.basename(exe)
-    dst = link_path(exe)
-    if link_conflict_action == LinkConflictAction.OVERWRITE and os.path.exists(dst):
-        typer.secho(f"Overwriting existing link {dst}", err=True, fg=typer.colors.CYAN)
-        os.remove(dst)
-    try:
-        dest = CONFIG.link_destination / executable_name
-        os.symlink(exe, dest)
-        return dest
-    except FileExistsError:
-        if link_conflict_action == LinkConflictAction.ERROR:
-            link_conflict_error_msg(executable_name)
-        elif link_conflict_action == LinkConflictAction.SKIP:
-            link_conflict_exists_msg(executable_name)
-    return None
-
-
-def link_conflict_exists_msg(executable_name: str):
+def link_conflict_exists_msg(executable_name: str, link: Optional[Path] = None):
     typer.secho(
-        f"Skipping link for {executable_name} because it already exists",
+        f"Skipping link for {executable_name} because it already exists"
+        f"{_link_owner_msg(link)}",
         err=True,
         fg=typer.colors.YELLOW,
     )
 
 
-def link_conflict_error_msg(executable_name: str):
+def link_conflict_error_msg(executable_name: str, link: Optional[Path] = None):
     typer.secho(
-        f"Error: link already exists for {executable_name}, use --link-conflict to overwrite or skip",
+        f"Error: link already exists for {executable_name}{_link_owner_msg(link)}, "
+        "use --link-conflict to overwrite or skip",
         err=True,
         fg=typer.colors.RED,
     )
     sys.exit(1)
 
 
-def create_link(exe: Path, link_conflict_action: LinkConflictAction) -> Optional[Path]:
-    if is_windows():
-        return create_link_windows(exe, link_conflict_action)
-    else:
-        return create_link_unix(exe, link_conflict_action)
-
-
 def create_links(
     executables_to_link: Collection[Path],
     link_conflict_action: LinkConflictAction,
     env_prefix: Path,
 ) -> None:
-    link_succeeded: Dict[Path, Optional[Path]] = {}
-    for exe in executables_to_link:
-        link_succeeded[exe] = create_link(exe, link_conflict_action)
+    plan = LinkPlan()
+    with prefix_metadata(env_prefix) as metadata, locking.link_destination_lock():
+        plan.add_links(
+            executables_to_link, link_conflict_action, LinkDestination.scan()
+        )
+        if metadata.activate and (plan.create or plan.overwrite):
+            plan.entrypoint = _activating_entrypoints([env_prefix])
+        if plan.conflicts:
+            exe, link = plan.conflicts[0]
+            link_conflict_error_msg(exe.name, link)
+        for exe, link in plan.skip:
+            link_conflict_exists_msg(exe.name, link)
+        for exe, link in plan.overwrite:
+            typer.secho(
+                f"Overwriting existing link {link}", err=True, fg=typer.colors.CYAN
+            )
+        metadata.links.update(plan.unchanged)
+        try:
+            with tracing.span("create links", count=len(executables_to_link)):
+                plan.apply()
+        finally:
+            # record the links that were made even if a later one failed
+            metadata.links.update(plan.made)
     if len(executables_to_link):
         typer.secho(
             "Created the following entrypoint links:", err=True, fg=typer.colors.CYAN
         )
-        for exe in executables_to_link:
-            if link_succeeded[exe]:
-                executable_name = os.path.basename(exe)
-                typer.secho(f"    {executable_name}", err=True, fg=typer.colors.CYAN)
+        for exe in sorted({*plan.made, *(exe for exe, _ in plan.unchanged)}):
+            typer.secho(f"    {exe.name}", err=True, fg=typer.colors.CYAN)
 
-    with prefix_metadata(env_prefix) as metadata:
-        metadata.links.update(
-            {k: v for k, v in link_succeeded.items() if v is not None}
-        )
+
+_open_metadata = threading.local()
 
 
 @contextlib.contextmanager
 def prefix_metadata(env_prefix: Path) -> Generator[PrefixMetadata, None, None]:
-    metadata_path = env_prefix / ".condax-metadata.json"
-    if metadata_path.exists():
-        ret = PrefixMetadata.model_validate_json(metadata_path.read_text())
-    else:
-        ret = PrefixMetadata(prefix=env_prefix)
-    yield ret
+    """Load the metadata of a prefix for modification, holding the prefix lock.
 
-    metadata_path.write_text(ret.model_dump_json(indent=2, exclude_unset=True))
+    Nested uses for the same prefix share the outermost instance, which is the only
+    one that writes it back, so an operation loads and flushes the metadata once.  It
+    is written back (atomically) even if the operation fails part way, so that links
+    that were created are not forgotten.
+    """
+    if not hasattr(_open_metadata, "by_prefix"):
+        _open_metadata.by_prefix = {}
+    open_metadata: Dict[Path, PrefixMetadata] = _open_metadata.by_prefix
+    if env_prefix in open_metadata:
+        yield open_metadata[env_prefix]
+        return
 
+    with locking.prefix_lock(env_prefix):
+        with tracing.span("read metadata", prefix=env_prefix.name):
+            ret = open_metadata[env_prefix] = read_prefix_metadata(env_prefix)
+        try:
+            yield ret
+        finally:
+            del open_metadata[env_prefix]
+            if env_prefix.exists():
+                with tracing.span("write metadata", prefix=env_prefix.name):
+                    locking.write_text_atomic(
+                        env_prefix / METADATA_FILENAME, ret.model_dump_json(indent=2)
+                    )
+                    registry.record_environment(env_prefix.name, ret)
 
-def remove_links(executables_to_unlink: Collection[Path], env_prefix: Path) -> None:
-    removed_links: Dict[Path, Path] = {}
 
-    for exe in executables_to_unlink:
-        link = link_path(exe)
-        if is_windows():
-            os.unlink(link)
-            removed_links[exe] = link
-        else:
-            if os.path.islink(link) and (os.readlink(link) == str(exe)):
-                os.unlink(link)
-                removed_links[exe] = link
+def remove_links(executables_to_unlink: Collection[Path], env_prefix: Path) -> None:
+    plan = LinkPlan()
+    with prefix_metadata(env_prefix) as metadata, locking.link_destination_lock():
+        plan.remove_links(executables_to_unlink, LinkDestination.scan())
+        try:
+            with tracing.span("remove links", count=len(executables_to_unlink)):
+                plan.apply()
+        finally:
+            for k in plan.unlinked:
+                metadata.links.pop(k, None)
 
     if len(executables_to_unlink):
         typer.secho(
@@ -159,39 +164,590 @@ def remove_links(executables_to_unlink: Collection[Path], env_prefix: Path) -> N
             executable_name = os.path.basename(exe)
             typer.secho(f"    {executable_name}", err=True, fg=typer.colors.CYAN)
 
-    with prefix_metadata(env_prefix) as metadata:
-        for k in removed_links:
-            if k in metadata.links:
-                del metadata.links[k]
+
+def _activating_entrypoints(
+    env_prefixes: Collection[Path],
+) -> Callable[[Path], Optional[str]]:
+    """Entrypoints that activate the environment, for the executables in
+    `env_prefixes`.
+
+    The activation scripts of each environment are run once, here, rather than
+    every time an entrypoint is written or run."""
+    environments = {
+        env_prefix: activation.activation_environment(env_prefix)
+        for env_prefix in env_prefixes
+    }
+
+    def entrypoint(exe: Path) -> Optional[str]:
+        env_prefix = env_prefix_of(exe)
+        if env_prefix not in environments:
+            return None
+        return activation.write_activating_entrypoint(
+            exe, env_prefix, environments[env_prefix]
+        )
+
+    return entrypoint
+
+
+def refresh_entrypoints(env_prefix: Path) -> None:
+    """Rewrite the activating entrypoints of an environment, e.g. after an update
+    changed its activation scripts."""
+    with prefix_metadata(env_prefix) as metadata, locking.link_destination_lock():
+        if not metadata.activate:
+            return
+        snapshot = LinkDestination.scan()
+        entrypoint = _activating_entrypoints([env_prefix])
+        for exe, link in metadata.links.items():
+            script = entrypoint(exe)
+            if script is not None and snapshot.points_to(link, exe):
+                locking.write_text_atomic(link, script)
 
 
 def install_package(
     package: str,
     channels: Optional[List[str]] = None,
     link_conflict_action=LinkConflictAction.ERROR,
+    activate: bool = False,
+    force: bool = False,
+    all_deps_apps: bool = False,
+) -> None:
+    if channels is None:
+        channels = CONFIG.channels
+    with locking.prefix_lock(conda.conda_env_prefix(package)):
+        try:
+            res = _create_or_change(package, channels, force)
+        except ValueError as e:
+            typer.secho(str(e), err=True, fg=typer.colors.RED)
+            sys.exit(1)
+        if res == conda.CreateResult.ALREADY_EXISTS:
+            _already_installed_msg(package)
+            return
+        _link_installed_package(
+            package, channels, link_conflict_action, activate, all_deps_apps
+        )
+
+
+def install_packages(
+    packages: List[str],
+    channels: Optional[List[str]] = None,
+    link_conflict_action=LinkConflictAction.ERROR,
+    jobs: int = 1,
+    activate: bool = False,
+    force: bool = False,
+    all_deps_apps: bool = False,
+) -> None:
+    """Install several packages, each into its own environment.
+
+    Up to `jobs` environments are created concurrently; linking happens one package at
+    a time as environments become ready.
+    """
+    if channels is None:
+        channels = CONFIG.channels
+    _channels = channels
+
+    def create(package: str) -> conda.CreateResult:
+        return _create_or_change(package, _channels, force, capture_output=True)
+
+    def link(package: str) -> None:
+        _link_installed_package(
+            package, _channels, link_conflict_action, activate, all_deps_apps
+        )
+
+    packages = list(dict.fromkeys(packages))
+    if jobs > 1 and len(packages) > 1:
+        conda.prefetch_repodata(channels, packages[0])
+    _install_concurrently(packages, create, link, jobs)
+
+
+def install_locked(
+    lock: CondaxLock,
+    packages: Optional[List[str]] = None,
+    link_conflict_action=LinkConflictAction.ERROR,
+    jobs: int = 1,
+) -> None:
+    """Recreate environments from a lock written by `condax export`.
+
+    conda installs the exact packages listed in the lock, so no solve is needed."""
+    environments = {env.name: env for env in lock.environments}
+    if packages:
+        missing = [p for p in packages if p not in environments]
+        if missing:
+            typer.secho(
+                f"Not in the lock file: {', '.join(missing)}",
+                err=True,
+                fg=typer.colors.RED,
+            )
+            sys.exit(1)
+        environments = {name: environments[name] for name in packages}
+    platform = conda.current_platform()
+    for env in environments.values():
+        if env.platform and env.platform != platform:
+            typer.secho(
+                f"`{env.name}` was locked on {env.platform}, not {platform}",
+                err=True,
+                fg=typer.colors.RED,
+            )
+            sys.exit(1)
+
+    def create(package: str) -> conda.CreateResult:
+        env = environments[package]
+        return conda.create_conda_environment_explicit(
+            package, env.packages, env.channels, capture_output=True
+        )
+
+    def link(package: str) -> None:
+        env = environments[package]
+        env_prefix = conda.conda_env_prefix(package)
+        with prefix_metadata(env_prefix) as metadata:
+            _link_installed_package(
+                package,
+                env.channels,
+                link_conflict_action,
+                env.activate,
+                env.link_dependencies,
+            )
+            metadata.injected_packages = list(env.injected_packages)
+            metadata.injected_packages_with_apps = list(env.injected_packages_with_apps)
+            for extra_package in env.injected_packages_with_apps:
+                create_links(
+                    conda.determine_executables_from_env(
+                        extra_package, env_prefix=env_prefix
+                    ),
+                    link_conflict_action,
+                    env_prefix=env_prefix,
+                )
+
+    _install_concurrently(list(environments), create, link, jobs)
+
+
+def _create_or_change(
+    package: str, channels: List[str], force: bool, capture_output: bool = False
+) -> conda.CreateResult:
+    """Create the environment for the spec `package`.
+
+    An existing environment of the package is kept if it was installed from the same
+    channels and its package matches the spec.  Otherwise it is changed to the spec in
+    place with `force`, or a ValueError is raised."""
+    env_prefix = conda.conda_env_prefix(package)
+    if not env_prefix.exists():
+        return conda.create_conda_environment(
+            package, channels=channels, capture_output=capture_output
+        )
+    metadata = read_prefix_metadata(env_prefix)
+    installed_channels = metadata.channels or CONFIG.channels
+    if installed_channels == list(channels) and (
+        metadata.spec == package or manifest.spec_satisfied(package, env_prefix)
+    ):
+        return conda.CreateResult.ALREADY_EXISTS
+    if not force:
+        raise ValueError(
+            f"`{env_prefix.name}` is already installed as "
+            f"`{metadata.spec or env_prefix.name}` from {', '.join(installed_channels)}"
+            f", use --force to change it to `{package}` from {', '.join(channels)}"
+        )
+    conda.install_conda_packages(
+        [package], env_prefix, channels=channels, capture_output=capture_output
+    )
+    conda.write_condarc_to_prefix(env_prefix, channels)
+    return conda.CreateResult.CREATED
+
+
+def _install_concurrently(
+    packages: List[str],
+    create: Callable[[str], conda.CreateResult],
+    link: Callable[[str], None],
+    jobs: int,
 ) -> None:
+    succeeded: List[str] = []
+    skipped: List[str] = []
+    failed: Dict[str, str] = {}
+
+    def create_with_lock(package: str) -> conda.CreateResult:
+        with locking.prefix_lock(conda.conda_env_prefix(package)):
+            return create(package)
+
+    with conda.executor(jobs) as executor:
+        futures = {
+            executor.submit(create_with_lock, package): package for package in packages
+        }
+        for future in as_completed(futures):
+            package = futures[future]
+            try:
+                try:
+                    res = future.result()
+                except subprocess.CalledProcessError as e:
+                    typer.secho(
+                        f"==> {package}", err=True, fg=typer.colors.CYAN, bold=True
+                    )
+                    typer.echo(e.output or "", err=True, nl=False)
+                    raise
+                if res == conda.CreateResult.ALREADY_EXISTS:
+                    _already_installed_msg(package)
+                    skipped.append(package)
+                    continue
+                link(package)
+            # link conflicts are reported through sys.exit
+            except (Exception, SystemExit) as e:
+                failed[package] = _describe_failure(e)
+            else:
+                succeeded.append(package)
+
+    _print_summary("Installed", succeeded, failed, skipped=skipped)
+    if failed:
+        sys.exit(1)
+
+
+def export_environments(packages: Optional[List[str]] = None) -> CondaxLock:
+    """Lock the exact contents of the given (or all) condax environments."""
+    if packages:
+        for package in packages:
+            exit_if_not_installed(package)
+        prefixes = [conda.conda_env_prefix(package) for package in packages]
+    else:
+        prefixes = conda.installed_prefixes()
+    environments = registry.load_registry().environments
+    platform = conda.current_platform()
+
+    lock = CondaxLock()
+    for env_prefix in prefixes:
+        metadata = environments.get(env_prefix.name) or read_prefix_metadata(env_prefix)
+        lock.environments.append(
+            LockedEnvironment(
+                name=env_prefix.name,
+                platform=platform,
+                channels=metadata.channels or CONFIG.channels,
+                injected_packages=metadata.injected_packages,
+                injected_packages_with_apps=metadata.injected_packages_with_apps,
+                activate=metadata.activate,
+                link_dependencies=metadata.link_dependencies,
+                packages=conda.locked_packages(env_prefix),
+            )
+        )
+    return lock
+
+
+def read_package_file(path: Path) -> List[str]:
+    """Read package specs from a file, one per line.
+
+    Blank lines and anything following a `#` are ignored."""
+    packages = []
+    for line in path.read_text().splitlines():
+        spec = line.split("#", 1)[0].strip()
+        if spec:
+            packages.append(spec)
+    return packages
+
+
+def populate_cache(
+    packages: List[str],
+    channels: Optional[List[str]] = None,
+    channel_dir: Optional[Path] = None,
+) -> None:
+    """Download everything needed to install `packages` ahead of time.
+
+    Packages are downloaded to the first of `CONFIG.pkgs_dirs`, or conda's own package
+    cache, from which `condax install --offline` can then install them.  If
+    `channel_dir` is given they are also published as a local `file://` channel there.
+    """
     if channels is None:
         channels = CONFIG.channels
-    res = conda.create_conda_environment(package, channels=channels)
-    if res == conda.CreateResult.ALREADY_EXISTS:
+    succeeded: List[str] = []
+    failed: Dict[str, str] = {}
+    with contextlib.ExitStack() as stack:
+        pkgs_dirs = list(CONFIG.pkgs_dirs)
+        if not pkgs_dirs and channel_dir is not None:
+            # conda's own cache can't be located without asking conda, so download
+            # into a fresh one that holds nothing but these packages
+            pkgs_dirs = [Path(stack.enter_context(tempfile.TemporaryDirectory()))]
+        for package in dict.fromkeys(packages):
+            try:
+                conda.download_packages(package, channels, pkgs_dirs=pkgs_dirs)
+            except subprocess.CalledProcessError as e:
+                failed[package] = _describe_failure(e)
+            else:
+                succeeded.append(package)
+        _print_summary("Downloaded", succeeded, failed)
+
+        if channel_dir is not None and succeeded:
+            added = local_channel.write_local_channel(pkgs_dirs[0], channel_dir)
+            url = local_channel.channel_url(channel_dir)
+            typer.secho(
+                f"Added {added} package file(s) to {url}, install from it with "
+                f"`condax install --offline --channel {url}`",
+                err=True,
+                fg=typer.colors.GREEN,
+            )
+    if failed:
+        sys.exit(1)
+
+
+def dedupe_environments(
+    packages: Optional[List[str]] = None, dry_run: bool = False
+) -> None:
+    """Hard-link identical package files of the given (or all) environments to the
+    copies in other environments."""
+    targets = None
+    if packages:
+        for package in packages:
+            exit_if_not_installed(package)
+        targets = [conda.conda_env_prefix(package) for package in packages]
+    stats = dedupe.dedupe(conda.installed_prefixes(), targets, dry_run=dry_run)
+    typer.secho(
+        f"{'Would hard-link' if dry_run else 'Hard-linked'} {stats.files} identical "
+        f"file(s), saving {_format_bytes(stats.bytes_saved)}",
+        err=True,
+        fg=typer.colors.GREEN,
+    )
+
+
+def _format_bytes(n: float) -> str:
+    for unit in ("B", "KiB", "MiB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GiB"
+
+
+def relink_packages(
+    packages: Optional[List[str]] = None,
+    link_conflict_action=LinkConflictAction.ERROR,
+    dry_run: bool = False,
+) -> None:
+    """Make the links of the given (or all) environments match their executables.
+
+    Missing links (e.g. deleted by hand) are created and links to executables that no
+    longer exist are removed.  The link destination is scanned once and every change
+    is planned before any is made, so with `dry_run` the plan is only printed.
+    """
+    if packages:
+        for package in packages:
+            exit_if_not_installed(package)
+        env_prefixes = sorted({conda.conda_env_prefix(p) for p in packages})
+    else:
+        env_prefixes = conda.installed_prefixes()
+
+    plan = LinkPlan()
+    owners: Dict[Path, PrefixMetadata] = {}
+    stale: Set[Path] = set()
+    with contextlib.ExitStack() as stack:
+        all_metadata: Dict[Path, PrefixMetadata] = {}
+        for env_prefix in env_prefixes:
+            if dry_run:
+                all_metadata[env_prefix] = read_prefix_metadata(env_prefix)
+            else:
+                all_metadata[env_prefix] = stack.enter_context(
+                    prefix_metadata(env_prefix)
+                )
+        if not dry_run:
+            stack.enter_context(locking.link_destination_lock())
+
+        snapshot = LinkDestination.scan()
+        for env_prefix, metadata in all_metadata.items():
+            wanted = _wanted_executables(env_prefix, metadata)
+            plan.add_links(wanted, link_conflict_action, snapshot)
+            stale |= set(metadata.links) - wanted
+            plan.remove_links(set(metadata.links) - wanted, snapshot)
+            owners.update((exe, metadata) for exe in set(metadata.links) | wanted)
+
+        if dry_run:
+            for line in plan.describe():
+                typer.echo(line)
+            if not (plan.create or plan.overwrite or plan.remove or plan.conflicts):
+                typer.secho("All links are up to date", err=True, fg=typer.colors.GREEN)
+            return
+        if plan.conflicts:
+            exe, link = plan.conflicts[0]
+            link_conflict_error_msg(exe.name, link)
+        for exe, link in plan.skip:
+            link_conflict_exists_msg(exe.name, link)
+        for exe, link in plan.unchanged:
+            owners[exe].links[exe] = link
+        plan.entrypoint = _activating_entrypoints(
+            {
+                env_prefix_of(exe)
+                for exe, _ in plan.create + plan.overwrite
+                if owners[exe].activate
+            }
+        )
+        try:
+            with tracing.span("relink", count=len(plan.create) + len(plan.remove)):
+                plan.apply()
+        finally:
+            for exe, link in plan.made.items():
+                owners[exe].links[exe] = link
+            # forget links that were removed or are gone already, but not ones that
+            # could not be removed
+            failed = {exe for exe, _ in plan.remove} - set(plan.unlinked)
+            for exe in stale - failed:
+                del owners[exe].links[exe]
+    removed = len(set(plan.unlinked) - set(plan.made))
+    typer.secho(
+        f"Created {len(plan.made)} and removed {removed} link(s)",
+        err=True,
+        fg=typer.colors.GREEN,
+    )
+
+
+def check_installation(fix: bool = False) -> None:
+    """Report, and with `fix` repair, dangling links, recorded links that don't
+    exist, environments without metadata, environments named after a spec and a
+    registry that is out of date."""
+    problems = doctor.diagnose()
+    for problem in problems:
         typer.secho(
-            f"`{package}` already installed, skipping installation",
+            f"{problem.issue.value}: {problem.describe()}",
             err=True,
             fg=typer.colors.YELLOW,
         )
+    if not problems:
+        typer.secho("No problems found", err=True, fg=typer.colors.GREEN)
         return
-    executables_to_link = conda.determine_executables_from_env(package)
-    CONFIG.link_destination.mkdir(parents=True, exist_ok=True)
-    create_links(
-        executables_to_link,
-        link_conflict_action,
-        env_prefix=conda.conda_env_prefix(package),
-    )
+    if not fix:
+        typer.secho(
+            f"Found {len(problems)} problem(s), use --fix to repair them",
+            err=True,
+            fg=typer.colors.RED,
+        )
+        sys.exit(1)
+    _repair(problems)
+    typer.secho(f"Repaired {len(problems)} problem(s)", err=True, fg=typer.colors.GREEN)
+
+
+def _repair(problems: List[doctor.Problem]) -> None:
+    by_issue: Dict[doctor.Issue, List[doctor.Problem]] = {}
+    for problem in problems:
+        by_issue.setdefault(problem.issue, []).append(problem)
+
+    with locking.link_destination_lock():
+        for problem in by_issue.get(doctor.Issue.DANGLING_LINK, []):
+            if problem.exe is not None and not problem.exe.exists():
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(problem.path)
+
+    missing = by_issue.get(doctor.Issue.MISSING_METADATA, [])
+    if missing:
+        snapshot = LinkDestination.scan()
+        targets = {name: snapshot.target(name) for name in snapshot.entries}
+    for problem in missing:
+        env_prefix = problem.path.parent
+        with locking.prefix_lock(env_prefix):
+            with contextlib.suppress(FileNotFoundError):
+                problem.path.unlink()
+            with prefix_metadata(env_prefix) as metadata:
+                # take over the links that point into the environment
+                for name, exe in targets.items():
+                    if exe is not None and env_prefix in exe.parents and exe.exists():
+                        metadata.links[exe] = CONFIG.link_destination / name
+
+    stale: Dict[Path, List[Path]] = {}
+    for problem in by_issue.get(doctor.Issue.STALE_LINK_RECORD, []):
+        if problem.env_prefix is not None and problem.exe is not None:
+            stale.setdefault(problem.env_prefix, []).append(problem.exe)
+    for env_prefix, executables in stale.items():
+        with prefix_metadata(env_prefix) as metadata:
+            for exe in executables:
+                metadata.links.pop(exe, None)
+            # recreate the links of executables that are still there, unless
+            # something else took their place
+            existing = [exe for exe in executables if exe.exists()]
+            if existing:
+                create_links(existing, LinkConflictAction.SKIP, env_prefix)
+
+    for problem in by_issue.get(doctor.Issue.SPEC_NAMED_ENV, []):
+        _rename_spec_named_env(problem.path)
+
+    if doctor.Issue.STALE_REGISTRY in by_issue:
+        with locking.registry_lock():
+            registry.save_registry(registry.build_registry())
+
+
+def _rename_spec_named_env(old_prefix: Path) -> None:
+    """Move an environment named after its spec to the one named after its package.
+
+    conda environments can't be moved, so the environment is recreated from the spec
+    and options in its metadata.  If the package is installed under its name as well,
+    that environment is the one condax uses and the old one is only removed."""
+    metadata = read_prefix_metadata(old_prefix)
+    spec = metadata.spec or old_prefix.name
+    package = conda.package_name(spec)
+    linked = [exe for exe in metadata.links if old_prefix in exe.parents]
+    with locking.prefix_lock(old_prefix):
+        remove_links(linked, env_prefix=old_prefix)
+        if not conda.conda_env_prefix(package).exists():
+            try:
+                install_package(
+                    spec,
+                    channels=metadata.channels or None,
+                    activate=metadata.activate,
+                    all_deps_apps=metadata.link_dependencies,
+                )
+                with_apps = metadata.injected_packages_with_apps
+                without_apps = [
+                    p for p in metadata.injected_packages if p not in with_apps
+                ]
+                if without_apps:
+                    inject_packages(package, without_apps)
+                if with_apps:
+                    inject_packages(package, with_apps, include_apps=True)
+            except (Exception, SystemExit):
+                # keep using the old environment
+                create_links(linked, LinkConflictAction.SKIP, env_prefix=old_prefix)
+                raise
+        shutil.rmtree(old_prefix)
+        snapshots.discard(old_prefix)
+        registry.forget_environment(old_prefix.name)
+
+
+def _link_installed_package(
+    package: str,
+    channels: List[str],
+    link_conflict_action: LinkConflictAction,
+    activate: bool = False,
+    all_deps_apps: bool = False,
+) -> None:
+    env_prefix = conda.conda_env_prefix(package)
+    with prefix_metadata(env_prefix) as metadata:
+        metadata.spec = package
+        metadata.channels = list(channels)
+        metadata.resolved_hash = conda.resolved_hash(env_prefix)
+        # an environment changed to another spec keeps its options
+        metadata.activate = activate or metadata.activate
+        metadata.link_dependencies = all_deps_apps or metadata.link_dependencies
+        if metadata.link_dependencies:
+            executables_to_link = conda.determine_all_executables(env_prefix)
+        else:
+            executables_to_link = conda.determine_executables_from_env(package)
+        if metadata.links:
+            # and loses the links to executables the package no longer has
+            wanted = _wanted_executables(env_prefix, metadata)
+            remove_links(set(metadata.links) - wanted, env_prefix=env_prefix)
+        CONFIG.link_destination.mkdir(parents=True, exist_ok=True)
+        create_links(executables_to_link, link_conflict_action, env_prefix=env_prefix)
     typer.secho(
         f"`{package}` has been installed by condax", err=True, fg=typer.colors.GREEN
     )
 
 
+def _wanted_executables(env_prefix: Path, metadata: PrefixMetadata) -> Set[Path]:
+    """The executables that should be linked for an environment."""
+    if metadata.link_dependencies:
+        return conda.determine_all_executables(env_prefix)
+    wanted = set(
+        conda.determine_executables_from_env(env_prefix.name, env_prefix=env_prefix)
+    )
+    for p in metadata.injected_packages_with_apps:
+        wanted |= conda.determine_executables_from_env(p, env_prefix=env_prefix)
+    return wanted
+
+
+def _already_installed_msg(package: str) -> None:
+    typer.secho(
+        f"`{package}` already installed, skipping installation",
+        err=True,
+        fg=typer.colors.YELLOW,
+    )
+
+
 def inject_packages(
     package: str,
     extra_packages: List[str],
@@ -203,15 +759,17 @@ def inject_packages(
         channels = CONFIG.channels
 
     prefix = conda.conda_env_prefix(package)
-    conda.install_conda_packages(extra_packages, channels=channels, prefix=prefix)
-    if include_apps:
-        for extra_package in extra_packages:
-            executables_to_link = conda.determine_executables_from_env(
-                extra_package, env_prefix=prefix
-            )
-            CONFIG.link_destination.mkdir(parents=True, exist_ok=True)
-            create_links(executables_to_link, link_conflict_action, env_prefix=prefix)
     with prefix_metadata(prefix) as metadata:
+        conda.install_conda_packages(extra_packages, channels=channels, prefix=prefix)
+        if include_apps:
+            for extra_package in extra_packages:
+                executables_to_link = conda.determine_executables_from_env(
+                    extra_package, env_prefix=prefix
+                )
+                CONFIG.link_destination.mkdir(parents=True, exist_ok=True)
+                create_links(
+                    executables_to_link, link_conflict_action, env_prefix=prefix
+                )
         metadata.injected_packages = sorted(
             set(metadata.injected_packages) | set(extra_packages)
         )
@@ -219,6 +777,7 @@ def inject_packages(
             metadata.injected_packages_with_apps = sorted(
                 set(metadata.injected_packages_with_apps) | set(extra_packages)
             )
+        metadata.resolved_hash = conda.resolved_hash(prefix)
 
     typer.secho(
         f"`{' '.join(extra_packages)}` have been installed into {prefix} by condax",
@@ -240,21 +799,309 @@ def remove_package(package) -> None:
     exit_if_not_installed(package)
     executables_to_unlink = conda.determine_executables_from_env(package)
     prefix = conda.conda_env_prefix(package)
-    remove_links(executables_to_unlink, env_prefix=prefix)
-    with prefix_metadata(prefix) as metadata:
-        additional_removals = metadata.links.keys()
-    remove_links(additional_removals, env_prefix=prefix)
+    with locking.prefix_lock(prefix):
+        with prefix_metadata(prefix) as metadata:
+            remove_links(executables_to_unlink, env_prefix=prefix)
+            remove_links(list(metadata.links.keys()), env_prefix=prefix)
 
-    conda.remove_conda_env(package)
+        conda.remove_conda_env(package)
+        snapshots.discard(prefix)
+        registry.forget_environment(prefix.name)
     typer.secho(
         f"`{package}` has been removed from condax", err=True, fg=typer.colors.GREEN
     )
 
 
-def update_all_packages(link_conflict_action=LinkConflictAction.ERROR) -> None:
-    for package in CONFIG.prefix_path.iterdir():
-        if package.is_dir():
-            update_package(package.name, link_conflict_action)
+def list_packages() -> List[InstalledPackage]:
+    prefixes = conda.installed_prefixes()
+    environments = registry.load_registry().environments
+
+    def describe(env_prefix: Path) -> InstalledPackage:
+        metadata = environments.get(env_prefix.name)
+        if metadata is None:
+            metadata = read_prefix_metadata(env_prefix)
+        return _describe_prefix(env_prefix, metadata)
+
+    # reading conda-meta is I/O bound, which matters on network home directories
+    with ThreadPoolExecutor(max_workers=min(32, len(prefixes) or 1)) as executor:
+        return list(executor.map(describe, prefixes))
+
+
+def _describe_prefix(env_prefix: Path, metadata: PrefixMetadata) -> InstalledPackage:
+    name = conda.package_name(env_prefix.name)
+    info = InstalledPackage(
+        name=name,
+        prefix=env_prefix,
+        links=metadata.links,
+        injected_packages=metadata.injected_packages,
+        injected_packages_with_apps=metadata.injected_packages_with_apps,
+    )
+    record = conda.find_conda_meta_record(name, env_prefix)
+    parts = conda.split_conda_meta_filename(record.name) if record else None
+    if record is not None and parts is not None:
+        _, info.version, info.build = parts
+        with open(record, encoding="utf-8") as fo:
+            channel = read_record_fields(fo, ["channel"]).get("channel")
+        if channel:
+            info.channel = _channel_name(channel)
+    return info
+
+
+def _channel_name(channel: str) -> str:
+    """Turn a channel url like `https://conda.anaconda.org/conda-forge/linux-64` into
+    `conda-forge`."""
+    channel = channel.rstrip("/")
+    for prefix in ("https://conda.anaconda.org/", "http://conda.anaconda.org/"):
+        if channel.startswith(prefix):
+            channel = channel[len(prefix) :]
+            break
+    head, _, subdir = channel.rpartition("/")
+    if head and (subdir == "noarch" or re.match(r"^(linux|osx|win)-\w+$", subdir)):
+        return head
+    return channel
+
+
+def print_packages(
+    packages: List[InstalledPackage], show_links: bool, show_injected: bool
+) -> None:
+    for package in packages:
+        typer.echo(
+            " ".join(
+                x
+                for x in (package.name, package.version, package.build, package.channel)
+                if x
+            )
+        )
+        if show_links:
+            for link in sorted(package.links.values()):
+                typer.echo(f"    link: {link}")
+        if show_injected:
+            for injected in package.injected_packages:
+                apps = (
+                    " (with apps)"
+                    if injected in package.injected_packages_with_apps
+                    else ""
+                )
+                typer.echo(f"    injected: {injected}{apps}")
+
+
+def run_package(
+    spec: str,
+    args: List[str],
+    channels: Optional[List[str]] = None,
+    app: Optional[str] = None,
+) -> int:
+    """Run an executable of `spec` from a cached environment, creating it if needed.
+
+    Returns the exit code of the executable."""
+    if channels is None:
+        channels = CONFIG.channels
+    env_prefix = ephemeral.environment_prefix(spec, channels)
+    with contextlib.ExitStack() as stack:
+        with locking.prefix_lock(env_prefix):
+            info = ephemeral.read_info(env_prefix)
+            if info is None and ephemeral.in_use(env_prefix):
+                # expired, but recreating it would break the runs using it
+                info = ephemeral.read_info(env_prefix, include_expired=True)
+            if info is None:
+                info = _create_run_environment(spec, channels, env_prefix)
+            else:
+                ephemeral.mark_used(env_prefix)
+            stack.enter_context(ephemeral.using(env_prefix))
+        ephemeral.evict(keep=env_prefix)
+
+        exe = _run_executable(spec, env_prefix, app)
+        env = {**os.environ, **info.environment, "CONDA_PREFIX": str(env_prefix)}
+        env["PATH"] = os.pathsep.join(
+            [
+                *(str(p) for p in activation.bin_dirs(env_prefix)),
+                *filter(None, [info.environment.get("PATH")]),
+                os.environ.get("PATH", ""),
+            ]
+        )
+        with tracing.span("run", executable=exe.name):
+            return subprocess.run(
+                [str(exe), *args], env=env, stdout=events.child_stdout()
+            ).returncode
+
+
+def run_environment_cached(spec: str, channels: List[str]) -> bool:
+    """Whether `run_package` can run `spec` without creating an environment."""
+    return ephemeral.read_info(ephemeral.environment_prefix(spec, channels)) is not None
+
+
+def _create_run_environment(
+    spec: str, channels: List[str], env_prefix: Path
+) -> RunEnvironment:
+    typer.secho(f"Creating an environment for `{spec}`", err=True, fg=typer.colors.CYAN)
+    shutil.rmtree(env_prefix, ignore_errors=True)
+    try:
+        # conda's output would mix with the output of the executable
+        conda.create_conda_environment(
+            spec, channels=channels, capture_output=True, prefix=env_prefix
+        )
+    except subprocess.CalledProcessError as e:
+        typer.echo(e.output or "", err=True, nl=False)
+        shutil.rmtree(env_prefix, ignore_errors=True)
+        typer.secho(
+            f"Could not create an environment for `{spec}`",
+            err=True,
+            fg=typer.colors.RED,
+        )
+        sys.exit(1)
+    info = RunEnvironment(
+        spec=spec,
+        channels=list(channels),
+        created=time.time(),
+        environment=activation.activation_environment(env_prefix),
+    )
+    ephemeral.write_info(env_prefix, info)
+    return info
+
+
+def _run_executable(spec: str, env_prefix: Path, app: Optional[str]) -> Path:
+    """The executable named `app` (by default named like the package) or the only
+    executable of the package."""
+    executables = conda.determine_executables_from_env(spec, env_prefix=env_prefix)
+    by_name = {os.path.splitext(exe.name)[0]: exe for exe in executables}
+    name = app or conda.package_name(spec)
+    if name in by_name:
+        return by_name[name]
+    if app is None and len(executables) == 1:
+        return next(iter(executables))
+    if app is not None:
+        # an executable of a dependency
+        for bin_dir in activation.bin_dirs(env_prefix):
+            for candidate in (bin_dir / app, bin_dir / f"{app}.exe"):
+                if candidate.is_file():
+                    return candidate
+    typer.secho(
+        f"`{spec}` has no executable `{name}`, use --app to run one of: "
+        f"{', '.join(sorted(by_name))}",
+        err=True,
+        fg=typer.colors.RED,
+    )
+    sys.exit(1)
+
+
+def sync_tools(
+    changes: List[manifest.ToolChange],
+    link_conflict_action=LinkConflictAction.ERROR,
+    jobs: int = 1,
+) -> None:
+    """Make the changes planned by `manifest.plan_sync`.
+
+    The conda operations of different tools run concurrently with their output
+    buffered.  Links and metadata are only touched from this thread, one tool at a
+    time, as the conda operations complete."""
+    # environments that are replaced give up their links first, so that they can't
+    # conflict with the links of other tools
+    for change in changes:
+        if change.action in (manifest.SyncAction.REMOVE, manifest.SyncAction.RECREATE):
+            env_prefix = conda.conda_env_prefix(change.env_name)
+            with prefix_metadata(env_prefix) as metadata:
+                remove_links(list(metadata.links), env_prefix=env_prefix)
+
+    succeeded: List[str] = []
+    failed: Dict[str, str] = {}
+    with conda.executor(jobs) as executor:
+        futures = {executor.submit(_sync_conda, change): change for change in changes}
+        for future in as_completed(futures):
+            change = futures[future]
+            typer.secho(
+                f"==> {change.action.value} {change.env_name}",
+                err=True,
+                fg=typer.colors.CYAN,
+                bold=True,
+            )
+            try:
+                try:
+                    future.result()
+                except subprocess.CalledProcessError as e:
+                    typer.echo(e.output or "", err=True, nl=False)
+                    raise
+                _sync_links(change, link_conflict_action)
+            # link conflicts are reported through sys.exit
+            except (Exception, SystemExit) as e:
+                failed[change.env_name] = _describe_failure(e)
+            else:
+                succeeded.append(change.env_name)
+
+    _print_summary("Synced", succeeded, failed)
+    if failed:
+        sys.exit(1)
+
+
+def _sync_conda(change: manifest.ToolChange) -> None:
+    env_prefix = conda.conda_env_prefix(change.env_name)
+    with locking.prefix_lock(env_prefix):
+        if change.action in (manifest.SyncAction.REMOVE, manifest.SyncAction.RECREATE):
+            conda.remove_conda_env(change.env_name, capture_output=True)
+            # along with the condax files that conda doesn't know about
+            shutil.rmtree(env_prefix, ignore_errors=True)
+        tool = change.tool
+        if tool is None:
+            return
+        if change.action in (manifest.SyncAction.INSTALL, manifest.SyncAction.RECREATE):
+            conda.create_conda_environment(
+                tool.name,
+                channels=change.channels,
+                capture_output=True,
+                prefix=env_prefix,
+            )
+            inject = tool.inject + tool.inject_apps
+        elif change.action == manifest.SyncAction.UPDATE:
+            conda.install_conda_packages(
+                [tool.name], env_prefix, channels=change.channels, capture_output=True
+            )
+            inject = []
+        else:
+            inject = change.inject + change.inject_apps
+        if inject:
+            conda.install_conda_packages(
+                sorted(set(inject)),
+                env_prefix,
+                channels=change.channels,
+                capture_output=True,
+            )
+
+
+def _sync_links(
+    change: manifest.ToolChange, link_conflict_action: LinkConflictAction
+) -> None:
+    if change.action == manifest.SyncAction.REMOVE:
+        registry.forget_environment(change.env_name)
+        typer.secho(
+            f"`{change.env_name}` has been removed from condax",
+            err=True,
+            fg=typer.colors.GREEN,
+        )
+        return
+    tool = change.tool
+    assert tool is not None
+    env_prefix = conda.conda_env_prefix(change.env_name)
+    with prefix_metadata(env_prefix) as metadata:
+        if change.action != manifest.SyncAction.INJECT:
+            metadata.spec = tool.name
+        if change.action in (manifest.SyncAction.INSTALL, manifest.SyncAction.RECREATE):
+            metadata.channels = list(change.channels)
+            metadata.injected_packages = sorted({*tool.inject, *tool.inject_apps})
+            metadata.injected_packages_with_apps = sorted(tool.inject_apps)
+        elif change.action == manifest.SyncAction.INJECT:
+            metadata.injected_packages = sorted(
+                {*metadata.injected_packages, *change.inject, *change.inject_apps}
+            )
+            metadata.injected_packages_with_apps = sorted(
+                {*metadata.injected_packages_with_apps, *change.inject_apps}
+            )
+        metadata.resolved_hash = conda.resolved_hash(env_prefix)
+        wanted = _wanted_executables(env_prefix, metadata)
+        CONFIG.link_destination.mkdir(parents=True, exist_ok=True)
+        remove_links(set(metadata.links) - wanted, env_prefix=env_prefix)
+        create_links(
+            wanted - set(metadata.links), link_conflict_action, env_prefix=env_prefix
+        )
+    typer.secho(f"`{tool.name}` is in sync", err=True, fg=typer.colors.GREEN)
 
 
 def prefix(package: str) -> Path:
@@ -262,45 +1109,305 @@ def prefix(package: str) -> Path:
     return conda.conda_env_prefix(package)
 
 
-def update_package(package: str, link_conflict_action=LinkConflictAction.ERROR) -> None:
+def update_package(
+    package: str,
+    link_conflict_action=LinkConflictAction.ERROR,
+    check: bool = False,
+    ensure_conda: Optional[Callable[[], None]] = None,
+) -> None:
+    """Update an environment.
+
+    `ensure_conda` is called before conda is first needed, which with `check` is
+    only once the environment turns out to be outdated.  If conda fails the
+    environment is restored from its snapshot (or recreated if snapshots are
+    disabled) and the `CalledProcessError` is raised."""
     exit_if_not_installed(package)
+    if check and not repodata.RepodataIndex().has_updates(
+        conda.conda_env_prefix(package)
+    ):
+        _up_to_date_msg(package)
+        return
+    if ensure_conda is not None:
+        ensure_conda()
     env_prefix = conda.conda_env_prefix(package)
-    with prefix_metadata(env_prefix) as metadata:
-        executables_already_linked = set(metadata.links.keys())
-        injected = metadata.injected_packages
-        injected_with_apps = metadata.injected_packages_with_apps
-    try:
-        executables_already_linked |= set(conda.determine_executables_from_env(package))
+    with locking.prefix_lock(env_prefix):
+        executables_already_linked, injected, injected_with_apps = (
+            _snapshot_before_update(package)
+        )
+        if CONFIG.update_snapshots:
+            snapshots.take(env_prefix)
+        try:
+            conda.update_conda_env(package)
+        except subprocess.CalledProcessError:
+            if CONFIG.update_snapshots:
+                _restore_after_failed_update(package)
+                raise
+            _recreate_package(package, injected, injected_with_apps)
+            return
+        _relink_after_update(package, executables_already_linked, link_conflict_action)
 
-        conda.update_conda_env(package)
-        env_prefix = conda.conda_env_prefix(package)
-        executables_linked_in_updated = set(
-            conda.determine_executables_from_env(package)
+
+def update_all_packages(
+    link_conflict_action=LinkConflictAction.ERROR,
+    jobs: int = 1,
+    check: bool = False,
+    ensure_conda: Optional[Callable[[], None]] = None,
+) -> None:
+    """Update every environment.
+
+    With `check` only the environments for which the channels have newer packages are
+    updated, without running conda for the others.  `ensure_conda` is called before
+    conda is first needed, so not at all if every environment is up to date."""
+    packages = [p.name for p in conda.installed_prefixes()]
+    up_to_date: List[str] = []
+    if check:
+        packages, up_to_date = _split_outdated(packages)
+    if packages and ensure_conda is not None:
+        ensure_conda()
+    succeeded: List[str] = []
+    failed: Dict[str, str] = {}
+    if jobs <= 1:
+        for package in packages:
+            typer.secho(f"==> {package}", err=True, fg=typer.colors.CYAN, bold=True)
+            try:
+                update_package(package, link_conflict_action)
+            # link conflicts are reported through sys.exit
+            except (Exception, SystemExit) as e:
+                failed[package] = _describe_failure(e)
+            else:
+                succeeded.append(package)
+    else:
+        _update_concurrently(packages, link_conflict_action, jobs, succeeded, failed)
+
+    _print_summary(
+        "Updated", succeeded, failed, skipped=up_to_date, skipped_reason="up to date"
+    )
+    if failed:
+        sys.exit(1)
+
+
+def _update_concurrently(
+    packages: List[str],
+    link_conflict_action: LinkConflictAction,
+    jobs: int,
+    succeeded: List[str],
+    failed: Dict[str, str],
+) -> None:
+    # The conda solves/downloads run concurrently with their output buffered.  Links
+    # and metadata are only touched from this thread, one package at a time, as the
+    # updates complete.
+    before_update: Dict[str, Tuple[Set[Path], List[str], List[str]]] = {}
+    for package in packages:
+        try:
+            before_update[package] = _snapshot_before_update(package)
+        except Exception as e:
+            failed[package] = _describe_failure(e)
+
+    _prefetch_repodata(list(before_update))
+    with conda.executor(jobs) as executor:
+        futures = {
+            executor.submit(_update_locked, package): package
+            for package in before_update
+        }
+        for future in as_completed(futures):
+            package = futures[future]
+            executables_already_linked, injected, injected_with_apps = before_update[
+                package
+            ]
+            typer.secho(f"==> {package}", err=True, fg=typer.colors.CYAN, bold=True)
+            try:
+                try:
+                    output = future.result()
+                except subprocess.CalledProcessError as e:
+                    typer.echo(e.output or "", err=True, nl=False)
+                    if CONFIG.update_snapshots:
+                        _restore_after_failed_update(package)
+                        raise
+                    _recreate_package(package, injected, injected_with_apps)
+                else:
+                    typer.echo(output or "", err=True, nl=False)
+                    _relink_after_update(
+                        package, executables_already_linked, link_conflict_action
+                    )
+            # link conflicts and missing packages are reported through sys.exit
+            except (Exception, SystemExit) as e:
+                failed[package] = _describe_failure(e)
+            else:
+                succeeded.append(package)
+
+
+def _prefetch_repodata(packages: List[str]) -> None:
+    """Fetch the repodata for the channels of these environments once, rather than
+    in each of the concurrent updates."""
+    if len(packages) < 2:
+        return
+    environments = registry.load_registry().environments
+    by_channels: Dict[Tuple[str, ...], str] = {}
+    for package in packages:
+        metadata = environments.get(package)
+        channels = metadata.channels if metadata and metadata.channels else None
+        by_channels.setdefault(tuple(channels or CONFIG.channels), package)
+    for channel_set, package in by_channels.items():
+        conda.prefetch_repodata(list(channel_set), package)
+
+
+def _split_outdated(packages: List[str]) -> Tuple[List[str], List[str]]:
+    """Split packages into those with newer packages in their channels and those that
+    are up to date."""
+    index = repodata.RepodataIndex()
+    # fetching repodata is I/O bound and each channel subdir is only fetched once
+    with ThreadPoolExecutor(max_workers=min(32, len(packages) or 1)) as executor:
+        outdated = list(
+            executor.map(
+                lambda p: index.has_updates(conda.conda_env_prefix(p)), packages
+            )
         )
-        for p in injected_with_apps:
-            executables_linked_in_updated |= set(
-                conda.determine_executables_from_env(p, env_prefix=env_prefix)
+    up_to_date = [p for p, o in zip(packages, outdated) if not o]
+    for package in up_to_date:
+        _up_to_date_msg(package)
+    return [p for p, o in zip(packages, outdated) if o], up_to_date
+
+
+def _up_to_date_msg(package: str) -> None:
+    typer.secho(
+        f"`{package}` is up to date, skipping update", err=True, fg=typer.colors.GREEN
+    )
+
+
+def _update_locked(package: str) -> Optional[str]:
+    env_prefix = conda.conda_env_prefix(package)
+    with locking.prefix_lock(env_prefix):
+        if CONFIG.update_snapshots:
+            snapshots.take(env_prefix)
+        return conda.update_conda_env(package, capture_output=True)
+
+
+def _restore_after_failed_update(package: str) -> None:
+    env_prefix = conda.conda_env_prefix(package)
+    with locking.prefix_lock(env_prefix):
+        snapshots.restore(env_prefix)
+    typer.secho(
+        f"`{package}` could not be updated, restored the environment from before the "
+        "update",
+        err=True,
+        fg=typer.colors.YELLOW,
+    )
+
+
+def rollback_package(
+    package: str, link_conflict_action=LinkConflictAction.ERROR
+) -> None:
+    """Swap an environment with its snapshot from before the last update.
+
+    The environment that is replaced becomes the snapshot, so rolling back again
+    undoes the rollback."""
+    exit_if_not_installed(package)
+    env_prefix = conda.conda_env_prefix(package)
+    with locking.prefix_lock(env_prefix):
+        if not snapshots.has_snapshot(env_prefix):
+            typer.secho(
+                f"`{package}` has no snapshot to roll back to, snapshots are only "
+                "taken with the update_snapshots setting",
+                err=True,
+                fg=typer.colors.RED,
             )
+            sys.exit(1)
+        linked_before = set(read_prefix_metadata(env_prefix).links)
+        snapshots.swap(env_prefix)
+        with prefix_metadata(env_prefix) as metadata:
+            remove_links(linked_before - set(metadata.links), env_prefix=env_prefix)
+            refresh_entrypoints(env_prefix)
+            # links that the update removed
+            create_links(set(metadata.links), link_conflict_action, env_prefix)
+    typer.secho(f"`{package}` has been rolled back", err=True, fg=typer.colors.GREEN)
+
+
+def _snapshot_before_update(package: str) -> Tuple[Set[Path], List[str], List[str]]:
+    """Collect the currently linked executables and injected packages of `package`."""
+    env_prefix = conda.conda_env_prefix(package)
+    metadata = read_prefix_metadata(env_prefix)
+    executables_already_linked = set(metadata.links.keys())
+    injected = metadata.injected_packages
+    injected_with_apps = metadata.injected_packages_with_apps
+    executables_already_linked |= _wanted_executables(env_prefix, metadata)
+    return executables_already_linked, injected, injected_with_apps
+
+
+def _relink_after_update(
+    package: str,
+    executables_already_linked: Set[Path],
+    link_conflict_action: LinkConflictAction,
+) -> None:
+    env_prefix = conda.conda_env_prefix(package)
+    executables_linked_in_updated = _wanted_executables(
+        env_prefix, read_prefix_metadata(env_prefix)
+    )
 
-        to_create = executables_linked_in_updated - executables_already_linked
-        to_delete = executables_already_linked - executables_linked_in_updated
+    to_create = executables_linked_in_updated - executables_already_linked
+    to_delete = executables_already_linked - executables_linked_in_updated
 
+    with prefix_metadata(env_prefix) as metadata:
+        metadata.resolved_hash = conda.resolved_hash(env_prefix)
         remove_links(to_delete, env_prefix=env_prefix)
+        refresh_entrypoints(env_prefix)
         create_links(to_create, link_conflict_action, env_prefix=env_prefix)
-        typer.secho(f"`{package}` has been updated", err=True, fg=typer.colors.GREEN)
+    typer.secho(f"`{package}` has been updated", err=True, fg=typer.colors.GREEN)
 
-    except subprocess.CalledProcessError:
-        typer.secho(
-            f"`{package}` could not be updated", err=True, fg=typer.colors.YELLOW
-        )
+
+def _recreate_package(
+    package: str, injected: List[str], injected_with_apps: List[str]
+) -> None:
+    typer.secho(f"`{package}` could not be updated", err=True, fg=typer.colors.YELLOW)
+    typer.secho(f"removing and recreating instead", err=True, fg=typer.colors.YELLOW)
+
+    metadata = read_prefix_metadata(conda.conda_env_prefix(package))
+    remove_package(package)
+    install_package(
+        metadata.spec or package,
+        channels=metadata.channels or None,
+        activate=metadata.activate,
+        all_deps_apps=metadata.link_dependencies,
+    )
+    if injected:
+        inject_packages(package, injected, include_apps=False)
+    if injected_with_apps:
+        inject_packages(package, injected_with_apps, include_apps=True)
+    typer.secho(f"`{package}` has been updated", err=True, fg=typer.colors.GREEN)
+
+
+def _describe_failure(e: BaseException) -> str:
+    if isinstance(e, subprocess.CalledProcessError):
+        return f"conda exited with status {e.returncode}"
+    if isinstance(e, SystemExit):
+        return "aborted, see the messages above"
+    return str(e) or type(e).__name__
+
+
+def _print_summary(
+    verb: str,
+    succeeded: List[str],
+    failed: Dict[str, str],
+    skipped: Collection[str] = (),
+    skipped_reason: str = "already installed",
+) -> None:
+    summary = {
+        "succeeded": list(succeeded),
+        "failed": dict(failed),
+        "skipped": {package: skipped_reason for package in skipped},
+    }
+    events.emit("summary", operation=verb.lower(), **summary)
+    events.update_result(**summary)
+    message = f"{verb} {len(succeeded)} package(s), {len(failed)} failed"
+    if skipped:
+        message += f", {len(skipped)} {skipped_reason}"
+    typer.secho(
+        message, err=True, fg=typer.colors.RED if failed else typer.colors.GREEN
+    )
+    for package in succeeded:
+        typer.secho(f"    {package}", err=True, fg=typer.colors.GREEN)
+    for package in skipped:
         typer.secho(
-            f"removing and recreating instead", err=True, fg=typer.colors.YELLOW
+            f"    {package} ({skipped_reason})", err=True, fg=typer.colors.YELLOW
         )
-
-        remove_package(package)
-        install_package(package)
-        if injected:
-            inject_packages(package, injected, include_apps=False)
-        if injected_with_apps:
-            inject_packages(package, injected_with_apps, include_apps=True)
-        typer.secho(f"`{package}` has been updated", err=True, fg=typer.colors.GREEN)
+    for package, reason in failed.items():
+        typer.secho(f"    {package}: {reason}", err=True, fg=typer.colors.RED)
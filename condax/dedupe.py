@@ -0,0 +1,149 @@
+"""Hard-link identical package files across condax environments.
+
+conda hard-links package files from its package cache into each environment when it
+can, but falls back to copying (across file systems, with `always_copy`, or once the
+cache has been cleaned), so every environment that needs e.g. `python` or `openssl`
+ends up with its own copy.
+
+Candidates are found through conda-meta: the same file of the same package build
+(`name-version-build`) in several environments.  Files that conda rewrote to contain
+the prefix differ between environments, and every candidate is compared byte for
+byte before it is replaced by a hard link, so only truly identical files are shared.
+"""
+
+import contextlib
+import filecmp
+import logging
+import os
+import stat
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from . import locking, tracing
+from .conda_meta import read_record_fields
+
+# fields of a conda-meta record that are needed to find the package files
+_RECORD_FIELDS = ("files", "paths_data")
+
+
+class DedupeStats(NamedTuple):
+    files: int
+    bytes_saved: int
+
+
+def _package_files(env_prefix: Path) -> Iterator[Tuple[str, str]]:
+    """Yield the dist name and relative path of every regular file of every package
+    in the environment, except those that conda rewrote to contain the prefix."""
+    for path in (env_prefix / "conda-meta").glob("*.json"):
+        try:
+            with open(path, encoding="utf-8") as fo:
+                record = read_record_fields(fo, _RECORD_FIELDS)
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable conda-meta record %s", path)
+            continue
+        dist = path.name[: -len(".json")]
+        paths_data = record.get("paths_data") or {}
+        placeholders = {
+            p["_path"]
+            for p in paths_data.get("paths", [])
+            if p.get("prefix_placeholder") or p.get("path_type") == "softlink"
+        }
+        for fn in record.get("files", []):
+            if fn not in placeholders:
+                yield dist, fn
+
+
+def dedupe(
+    env_prefixes: List[Path],
+    targets: Optional[List[Path]] = None,
+    dry_run: bool = False,
+) -> DedupeStats:
+    """Replace identical copies of package files in `env_prefixes` by hard links.
+
+    Only files in `targets` (by default all of `env_prefixes`) are replaced; the other
+    environments only provide the copies to link to.  Bytes are counted as saved
+    only for files that had no other hard links, since only those are freed.
+    """
+    target_set = set(env_prefixes if targets is None else targets)
+    files: Dict[Tuple[str, str], List[Path]] = {}
+    with tracing.span("find duplicates", environments=len(env_prefixes)):
+        for env_prefix in env_prefixes:
+            for key in _package_files(env_prefix):
+                files.setdefault(key, []).append(env_prefix)
+
+    n_files = bytes_saved = 0
+    with contextlib.ExitStack() as stack:
+        if not dry_run:
+            # sorted, so that concurrent dedupes can't deadlock
+            for env_prefix in sorted(env_prefixes):
+                stack.enter_context(locking.prefix_lock(env_prefix))
+        with tracing.span("link duplicates"):
+            for (_, fn), prefixes in files.items():
+                if len(prefixes) < 2 or not target_set.intersection(prefixes):
+                    continue
+                # prefer keeping the copies in environments that aren't targets
+                prefixes.sort(key=lambda p: p in target_set)
+                for path, size in _link_identical(
+                    [p / fn for p in prefixes],
+                    {p / fn for p in prefixes if p in target_set},
+                    dry_run,
+                ):
+                    n_files += 1
+                    bytes_saved += size
+    return DedupeStats(n_files, bytes_saved)
+
+
+def _link_identical(
+    paths: List[Path], replaceable: Set[Path], dry_run: bool
+) -> Iterator[Tuple[Path, int]]:
+    """Hard-link each replaceable path to the first identical file before it.
+
+    Yields the replaced paths with the number of bytes freed."""
+    originals: List[Tuple[Path, os.stat_result]] = []
+    for path in paths:
+        try:
+            st = path.lstat()
+        except OSError:
+            continue
+        if not stat.S_ISREG(st.st_mode):
+            continue
+        original = _find_identical(path, st, originals)
+        if original is None or path not in replaceable:
+            if original is None:
+                originals.append((path, st))
+            continue
+        if original[1].st_ino == st.st_ino:
+            # already the same file
+            continue
+        freed = st.st_size if st.st_nlink == 1 else 0
+        if not dry_run:
+            try:
+                _replace_with_link(original[0], path)
+            except OSError as e:
+                logging.warning("Could not hard-link %s: %s", path, e)
+                continue
+        yield path, freed
+
+
+def _find_identical(
+    path: Path, st: os.stat_result, originals: List[Tuple[Path, os.stat_result]]
+) -> Optional[Tuple[Path, os.stat_result]]:
+    key = (st.st_dev, st.st_mode, st.st_size)
+    for original, ost in originals:
+        # hard links can't cross file systems and share the mode
+        if (ost.st_dev, ost.st_mode, ost.st_size) != key:
+            continue
+        if ost.st_ino == st.st_ino or filecmp.cmp(original, path, shallow=False):
+            return original, ost
+    return None
+
+
+def _replace_with_link(original: Path, path: Path) -> None:
+    tmp = path.with_name(f".{path.name}.condax-dedupe")
+    os.link(original, tmp)
+    try:
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
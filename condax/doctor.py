@@ -0,0 +1,107 @@
+"""Consistency checks of condax environments, their links and metadata.
+
+Broken state builds up when prefixes are deleted or links removed by hand.  Every
+prefix and every entry of the link destination is checked in one pass: the link
+destination is scanned once, and the prefixes are checked concurrently against that
+snapshot, so that this stays fast with hundreds of environments.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from . import conda, registry, tracing
+from .config import CONFIG
+from .links import LinkDestination, env_prefix_of
+from .metadata import METADATA_FILENAME, read_prefix_metadata
+
+_MAX_WORKERS = 32
+
+
+class Issue(str, Enum):
+    DANGLING_LINK = "dangling link"
+    STALE_LINK_RECORD = "stale link record"
+    MISSING_METADATA = "missing metadata"
+    STALE_REGISTRY = "stale registry"
+    SPEC_NAMED_ENV = "spec named environment"
+
+
+class Problem(NamedTuple):
+    issue: Issue
+    # the link, metadata file or registry that is wrong
+    path: Path
+    env_prefix: Optional[Path] = None
+    exe: Optional[Path] = None
+
+    def describe(self) -> str:
+        if self.issue == Issue.DANGLING_LINK:
+            return f"{self.path} points to {self.exe}, which doesn't exist"
+        if self.issue == Issue.STALE_LINK_RECORD:
+            return f"{self.path} is recorded for {self.exe}, but doesn't link to it"
+        if self.issue == Issue.MISSING_METADATA:
+            return f"{self.path} is missing or unreadable"
+        if self.issue == Issue.SPEC_NAMED_ENV:
+            return f"{self.path} is named after a spec rather than its package"
+        return f"{self.path} doesn't match the installed environments"
+
+
+def diagnose() -> List[Problem]:
+    env_prefixes = conda.installed_prefixes()
+    with tracing.span("doctor", environments=len(env_prefixes)):
+        snapshot = LinkDestination.scan()
+        workers = min(_MAX_WORKERS, max(len(env_prefixes), len(snapshot.entries), 1))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            by_env = executor.map(
+                lambda p: _check_environment(p, snapshot), env_prefixes
+            )
+            by_link = executor.map(
+                lambda name: _check_link(name, snapshot), sorted(snapshot.entries)
+            )
+            problems = [p for ps in by_env for p in ps]
+            problems.extend(p for p in by_link if p is not None)
+        problems.extend(_check_registry(env_prefixes))
+    return problems
+
+
+def _check_environment(env_prefix: Path, snapshot: LinkDestination) -> List[Problem]:
+    metadata_path = env_prefix / METADATA_FILENAME
+    try:
+        if not metadata_path.exists():
+            raise FileNotFoundError(metadata_path)
+        metadata = read_prefix_metadata(env_prefix)
+    except (OSError, ValueError):
+        return [Problem(Issue.MISSING_METADATA, metadata_path, env_prefix)]
+    problems = [
+        Problem(Issue.STALE_LINK_RECORD, link, env_prefix, exe)
+        for exe, link in sorted(metadata.links.items())
+        if not snapshot.points_to(link, exe)
+    ]
+    # older versions of condax named environments after the whole spec
+    if conda.conda_env_prefix(metadata.spec or env_prefix.name) != env_prefix:
+        problems.append(Problem(Issue.SPEC_NAMED_ENV, env_prefix, env_prefix))
+    return problems
+
+
+def _check_link(name: str, snapshot: LinkDestination) -> Optional[Problem]:
+    """Check for a link into the condax prefixes whose executable is gone."""
+    exe = snapshot.target(name)
+    if exe is None or CONFIG.prefix_path not in exe.parents or os.path.exists(exe):
+        return None
+    return Problem(
+        Issue.DANGLING_LINK, CONFIG.link_destination / name, env_prefix_of(exe), exe
+    )
+
+
+def _check_registry(env_prefixes: List[Path]) -> List[Problem]:
+    if not registry.registry_path().exists():
+        # it is rebuilt when it is next needed
+        return []
+    try:
+        names = set(registry.load_registry().environments)
+    except OSError:
+        names = set()
+    if names != {p.name for p in env_prefixes}:
+        return [Problem(Issue.STALE_REGISTRY, registry.registry_path())]
+    return []
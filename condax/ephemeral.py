@@ -0,0 +1,147 @@
+"""Cached environments for `condax run`.
+
+Each combination of package spec and channels gets its own environment in
+`CONFIG.prefix_path / ".cache" / "run"`, which is reused until it is older than
+`CONFIG.run_cache_max_age`, so that running the same tool again doesn't need conda
+at all.  The time an environment was last used is the modification time of its
+info file; beyond `CONFIG.run_cache_size` environments the least recently used ones
+are removed.
+
+While an executable runs its environment holds a marker file named after the
+process, and environments with markers of live processes are neither evicted nor
+recreated, so that concurrent runs of other tools don't pull an environment from
+under a running one.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Generator, List, Optional, Tuple
+
+from . import locking
+from .config import CONFIG, is_windows
+from .metadata import RunEnvironment
+
+RUN_INFO_FILENAME = ".condax-run.json"
+IN_USE_PREFIX = ".condax-running-"
+
+
+def cache_dir() -> Path:
+    return CONFIG.prefix_path / ".cache" / "run"
+
+
+def environment_prefix(spec: str, channels: List[str]) -> Path:
+    key = json.dumps([spec, channels])
+    return cache_dir() / hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def read_info(
+    env_prefix: Path, include_expired: bool = False
+) -> Optional[RunEnvironment]:
+    """The info of a cached environment, if it exists and is recent enough."""
+    try:
+        info = RunEnvironment.model_validate_json(
+            (env_prefix / RUN_INFO_FILENAME).read_text()
+        )
+    except (OSError, ValueError):
+        return None
+    if not include_expired and time.time() - info.created > CONFIG.run_cache_max_age:
+        return None
+    return info
+
+
+@contextlib.contextmanager
+def using(env_prefix: Path) -> Generator[None, None, None]:
+    """Mark the environment as in use by this process until the block ends.  Must be
+    entered holding the prefix lock."""
+    marker = env_prefix / f"{IN_USE_PREFIX}{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    marker.touch()
+    try:
+        yield
+    finally:
+        with contextlib.suppress(OSError):
+            marker.unlink()
+
+
+def in_use(env_prefix: Path) -> bool:
+    """Whether a live process uses the environment.  Markers of processes that died
+    without removing them are removed."""
+    used = False
+    for marker in env_prefix.glob(f"{IN_USE_PREFIX}*"):
+        try:
+            pid = int(marker.name[len(IN_USE_PREFIX) :].split("-")[0])
+            age = time.time() - marker.stat().st_mtime
+        except (OSError, ValueError):
+            continue
+        if _process_alive(pid, age):
+            used = True
+        else:
+            with contextlib.suppress(OSError):
+                marker.unlink()
+    return used
+
+
+def _process_alive(pid: int, age: float) -> bool:
+    if is_windows():
+        # os.kill would terminate the process, so trust markers for a while
+        return age < CONFIG.run_cache_max_age
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_info(env_prefix: Path, info: RunEnvironment) -> None:
+    locking.write_text_atomic(
+        env_prefix / RUN_INFO_FILENAME, info.model_dump_json(indent=2)
+    )
+
+
+def mark_used(env_prefix: Path) -> None:
+    with contextlib.suppress(OSError):
+        os.utime(env_prefix / RUN_INFO_FILENAME)
+
+
+def evict(keep: Path) -> List[Path]:
+    """Remove expired environments and the least recently used ones beyond
+    `CONFIG.run_cache_size`, except `keep` and environments in use.  Returns the
+    removed prefixes."""
+    try:
+        prefixes = [p for p in cache_dir().iterdir() if p.is_dir() and p != keep]
+    except FileNotFoundError:
+        return []
+
+    def last_used(env_prefix: Path) -> float:
+        for path in (env_prefix / RUN_INFO_FILENAME, env_prefix):
+            with contextlib.suppress(OSError):
+                return path.stat().st_mtime
+        return 0.0
+
+    by_use: List[Tuple[float, Path]] = sorted(
+        ((last_used(p), p) for p in prefixes), reverse=True
+    )
+    # `keep` counts towards the size
+    n_keep = max(CONFIG.run_cache_size - 1, 0)
+    removed = []
+    for i, (_, env_prefix) in enumerate(by_use):
+        if i < n_keep and (
+            read_info(env_prefix) is not None
+            # still being created
+            or not (env_prefix / RUN_INFO_FILENAME).exists()
+        ):
+            continue
+        # skip environments that are being created or run rather than waiting
+        with locking.try_prefix_lock(env_prefix) as locked:
+            if not locked or in_use(env_prefix):
+                continue
+            shutil.rmtree(env_prefix, ignore_errors=True)
+        removed.append(env_prefix)
+    return removed
@@ -0,0 +1,197 @@
+"""Machine readable output of a condax command, for `condax --json`.
+
+Once enabled, stdout carries nothing but events, one JSON object per line, and
+everything condax would otherwise print there goes to stderr, as does the output of
+the processes it starts (see `child_stdout`).  Events are written as
+they happen:
+
+* `phase_start` and `phase_end` for every `tracing.span`,
+* `conda_download`, `conda_link`, `conda_unlink` and `conda_error` for the progress
+  that conda reports with its own `--json` output,
+* `summary` for operations on several packages,
+
+and the last event is the `result` of the command, with its exit code and the fields
+collected by `update_result`.  Commands whose output is data (like `list`, `export`
+or `prefix`) put it in the result, since their usual output goes to stderr.
+"""
+
+import json
+import re
+import sys
+import threading
+import time
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple
+
+_enabled = False
+_stream: Optional[IO[str]] = None
+_saved_stdout: Optional[IO[str]] = None
+_start = 0.0
+_result: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+_STDERR_FILENO = 2
+
+_RE_DELIMITER = re.compile(r"[\0\n]")
+_RE_NOT_DELIMITER = re.compile(r"[^\0 \t\r\n]")
+_RE_STRUCTURE = re.compile(r'["{}\[\]\0]')
+_RE_STRING_SPECIAL = re.compile(r'["\\]')
+
+
+def enable() -> None:
+    global _enabled, _stream, _saved_stdout, _start
+    _enabled = True
+    _start = time.perf_counter()
+    _result.clear()
+    _stream = _saved_stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def child_stdout() -> Optional[int]:
+    """The `stdout` for processes whose output isn't captured: stderr while events are
+    written, since the processes would otherwise write into them through fd 1."""
+    return _STDERR_FILENO if _enabled else None
+
+
+def emit(event: str, **fields: Any) -> None:
+    if not _enabled:
+        return
+    line = json.dumps({"event": event, **fields}, default=str)
+    with _lock:
+        assert _stream is not None
+        _stream.write(line + "\n")
+        _stream.flush()
+
+
+def update_result(**fields: Any) -> None:
+    """Add fields to the `result` event written at the end of the command, e.g. the
+    output of commands that print something."""
+    if not _enabled:
+        return
+    with _lock:
+        _result.update(fields)
+
+
+def finish(command: Optional[str]) -> None:
+    """Write the `result` event and stop writing events.
+
+    Called as the command ends, including when it exits or raises, in which case the
+    exit code is taken from the exception being handled."""
+    global _enabled
+    if not _enabled:
+        return
+    exc = sys.exc_info()[1]
+    if exc is None:
+        exit_code = 0
+    elif isinstance(exc, SystemExit):
+        code = exc.code
+        exit_code = code if isinstance(code, int) else (0 if code is None else 1)
+    else:
+        # click's Exit
+        exit_code = getattr(exc, "exit_code", 1)
+    emit(
+        "result",
+        command=command,
+        exit_code=exit_code,
+        success=exit_code == 0,
+        duration=round(time.perf_counter() - _start, 3),
+        **_result,
+    )
+    _enabled = False
+    if _saved_stdout is not None:
+        sys.stdout = _saved_stdout
+
+
+class JsonStream:
+    """Split concatenated JSON documents, as written by `conda --json`, fed in chunks.
+
+    conda separates its progress objects with NUL characters and ends with a (pretty
+    printed) result document.  Objects and arrays are scanned once as they arrive,
+    keeping track of their nesting, and decoded when they are closed; anything else
+    (numbers, or lines that aren't JSON like warnings) only once a NUL or newline
+    ends it.  Documents are yielded as soon as they are complete and only the
+    incomplete rest is kept, so long outputs aren't held in memory.  Lines that
+    aren't JSON are skipped."""
+
+    def __init__(self) -> None:
+        # the incomplete document, and where it is in scanning an object or array
+        self._parts: List[str] = []
+        self._kind: Optional[str] = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> Iterator[Any]:
+        start = i = 0
+        if self._escape and text:
+            # the character after a backslash that ended the last chunk
+            self._escape = False
+            i = 1
+        while True:
+            if self._kind is None:
+                m = _RE_NOT_DELIMITER.search(text, i)
+                if m is None:
+                    return
+                start = i = m.start()
+                self._kind = "container" if text[i] in "{[" else "line"
+            if self._kind == "line":
+                m = _RE_DELIMITER.search(text, i)
+                if m is None:
+                    self._parts.append(text[start:])
+                    return
+                i = m.end()
+                document = self._complete(text[start : m.start()])
+            else:
+                i, closed = self._scan(text, i)
+                if not closed:
+                    self._parts.append(text[start:])
+                    return
+                document = self._complete(text[start:i])
+            try:
+                yield json.loads(document)
+            except ValueError:
+                continue
+
+    def _scan(self, text: str, i: int) -> Tuple[int, bool]:
+        """Scan an object or array up to where it is closed, if it is in `text`."""
+        while True:
+            if self._in_string:
+                m = _RE_STRING_SPECIAL.search(text, i)
+                if m is None:
+                    return len(text), False
+                if m.group() == '"':
+                    self._in_string = False
+                elif m.end() == len(text):
+                    self._escape = True
+                    return len(text), False
+                else:
+                    i = m.end() + 1
+                    continue
+            else:
+                m = _RE_STRUCTURE.search(text, i)
+                if m is None:
+                    return len(text), False
+                c = m.group()
+                if c == '"':
+                    self._in_string = True
+                elif c in "{[":
+                    self._depth += 1
+                elif c in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return m.end(), True
+                else:
+                    # a NUL ends a document, this one wasn't JSON
+                    return m.end(), True
+            i = m.end()
+
+    def _complete(self, rest: str) -> str:
+        document = "".join(self._parts) + rest
+        self._parts = []
+        self._kind = None
+        self._depth = 0
+        self._in_string = False
+        return document
@@ -0,0 +1,228 @@
+"""Changes to `CONFIG.link_destination`, planned from a single scan of it.
+
+The link destination is often a home directory on a network file system, where every
+`exists`/`islink`/`readlink` is a round trip.  So it is read once with `os.scandir`,
+all creations, overwrites and removals are worked out from that snapshot, and the
+links are then written concurrently.
+"""
+
+import contextlib
+import functools
+import os
+import pathlib
+import re
+import shlex
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+
+from .config import CONFIG, is_windows
+
+# creating fewer links than this isn't worth starting threads for
+_MIN_CONCURRENT = 8
+_MAX_WORKERS = 16
+
+_RE_BATCH_CALL = re.compile(r'^CALL "(.+)" %\*$', re.MULTILINE)
+# the executable is quoted for the shell
+_RE_EXEC = re.compile(r'^exec (.+) "\$@"$', re.MULTILINE)
+_ENTRYPOINT_MARKER = "Entrypoint created by condax"
+
+
+class LinkConflictAction(str, Enum):
+    ERROR = "error"
+    OVERWRITE = "overwrite"
+    SKIP = "skip"
+
+
+def link_path(exe: Path) -> Path:
+    if is_windows():
+        executable_name = exe.name
+        name_only, _ = os.path.splitext(executable_name)
+        return CONFIG.link_destination / f"{name_only}.bat"
+    else:
+        executable_name = exe.name
+        return CONFIG.link_destination / executable_name
+
+
+def env_prefix_of(exe: Path) -> Path:
+    """The condax environment that `exe` (a path within `CONFIG.prefix_path`) is in."""
+    relative = exe.relative_to(CONFIG.prefix_path)
+    return CONFIG.prefix_path / relative.parts[0]
+
+
+class LinkDestination:
+    """The entries of the link destination, as read by one `os.scandir`."""
+
+    def __init__(self, entries: Dict[str, "os.DirEntry[str]"]) -> None:
+        self.entries = entries
+
+    @classmethod
+    def scan(cls) -> "LinkDestination":
+        try:
+            with os.scandir(CONFIG.link_destination) as it:
+                return cls({entry.name: entry for entry in it})
+        except FileNotFoundError:
+            return cls({})
+
+    def exists(self, link: Path) -> bool:
+        return link.name in self.entries
+
+    def points_to(self, link: Path, exe: Path) -> bool:
+        """Whether `link` is the link to `exe` created by condax."""
+        return self.target(link.name) == exe
+
+    def target(self, name: str) -> Optional[Path]:
+        """The executable that the entry `name` runs, if it looks like a condax link."""
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        try:
+            if not is_windows() and entry.is_symlink():
+                return Path(os.readlink(entry.path))
+            if not entry.is_file():
+                return None
+            # a batch file or an activating entrypoint
+            with open(entry.path, "rb") as fo:
+                head = fo.read(4096).decode("utf-8", "replace")
+        except OSError:
+            return None
+        if _ENTRYPOINT_MARKER not in head:
+            return None
+        if is_windows():
+            match = _RE_BATCH_CALL.search(head)
+            return Path(match.group(1)) if match else None
+        match = _RE_EXEC.search(head)
+        if match is None:
+            return None
+        try:
+            (exe,) = shlex.split(match.group(1))
+        except ValueError:
+            return None
+        return Path(exe)
+
+
+class LinkPlan:
+    """Links to create, overwrite and remove, as pairs of executable and link."""
+
+    def __init__(self) -> None:
+        # the contents of the script to create instead of a symlink or plain batch
+        # file for an executable, if any
+        self.entrypoint: Optional[Callable[[Path], Optional[str]]] = None
+        self.create: List[Tuple[Path, Path]] = []
+        self.overwrite: List[Tuple[Path, Path]] = []
+        self.remove: List[Tuple[Path, Path]] = []
+        # links that already point to their executable
+        self.unchanged: List[Tuple[Path, Path]] = []
+        # conflicting links that are left alone
+        self.skip: List[Tuple[Path, Path]] = []
+        # conflicting links that are an error
+        self.conflicts: List[Tuple[Path, Path]] = []
+        # filled in by `apply`, even if it fails part way
+        self.made: Dict[Path, Path] = {}
+        self.unlinked: Dict[Path, Path] = {}
+
+    def add_links(
+        self,
+        executables: Collection[Path],
+        link_conflict_action: LinkConflictAction,
+        snapshot: LinkDestination,
+    ) -> None:
+        for exe in sorted(executables):
+            link = link_path(exe)
+            if not snapshot.exists(link):
+                self.create.append((exe, link))
+            elif snapshot.points_to(link, exe):
+                self.unchanged.append((exe, link))
+            elif link_conflict_action == LinkConflictAction.OVERWRITE:
+                self.overwrite.append((exe, link))
+            elif link_conflict_action == LinkConflictAction.SKIP:
+                self.skip.append((exe, link))
+            else:
+                self.conflicts.append((exe, link))
+
+    def remove_links(
+        self, executables: Collection[Path], snapshot: LinkDestination
+    ) -> None:
+        """Plan to remove the links to `executables`, if they still point to them."""
+        for exe in sorted(executables):
+            link = link_path(exe)
+            if snapshot.points_to(link, exe):
+                self.remove.append((exe, link))
+
+    def describe(self) -> List[str]:
+        lines: List[str] = []
+        for action, items in (
+            ("create", self.create),
+            ("overwrite", self.overwrite),
+            ("remove", self.remove),
+            ("skip", self.skip),
+            ("conflict", self.conflicts),
+        ):
+            lines.extend(f"{action:<9} {link} -> {exe}" for exe, link in items)
+        return lines
+
+    def apply(self) -> None:
+        """Remove, then create the planned links."""
+        for exe, link in _run_all(_unlink, self.remove + self.overwrite):
+            self.unlinked[exe] = link
+        write = functools.partial(_write_link, entrypoint=self.entrypoint)
+        for exe, link in _run_all(write, self.create + self.overwrite):
+            self.made[exe] = link
+
+
+def _run_all(
+    fn: Callable[[Path, Path], None], items: List[Tuple[Path, Path]]
+) -> List[Tuple[Path, Path]]:
+    """Call `fn` for every item, returning those for which it succeeded.
+
+    If it failed for any item the first error is raised, but only once it has been
+    tried for all of them."""
+    done: List[Tuple[Path, Path]] = []
+    errors: List[BaseException] = []
+
+    def call(item: Tuple[Path, Path]) -> None:
+        try:
+            fn(*item)
+        except OSError as e:
+            errors.append(e)
+        else:
+            done.append(item)
+
+    if len(items) < _MIN_CONCURRENT:
+        for item in items:
+            call(item)
+    else:
+        with ThreadPoolExecutor(max_workers=min(_MAX_WORKERS, len(items))) as executor:
+            list(executor.map(call, items))
+    if errors:
+        raise errors[0]
+    return done
+
+
+def _unlink(exe: Path, link: Path) -> None:
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(link)
+
+
+def _write_link(
+    exe: Path, link: Path, entrypoint: Optional[Callable[[Path], Optional[str]]] = None
+) -> None:
+    script = entrypoint(exe) if entrypoint is not None else None
+    if script is not None:
+        with open(link, "x") as fo:
+            fo.write(script)
+        if not is_windows():
+            os.chmod(link, 0o755)
+    elif is_windows():
+        # create a batch file to run our application
+        with open(link, "x") as fo:
+            fo.writelines(
+                [
+                    "@echo off\n",
+                    "REM Entrypoint created by condax\n",
+                    f'CALL "{pathlib.PureWindowsPath(exe)}" %*',
+                ]
+            )
+    else:
+        os.symlink(exe, link)
@@ -0,0 +1,88 @@
+"""Local `file://` channels built from a conda package cache.
+
+Every package extracted into a package cache (`pkgs_dirs`) keeps its repodata record
+in `info/repodata_record.json` next to the downloaded tarball.  That is all that is
+needed to serve the package from a plain directory: the tarballs are hard-linked into
+`{channel}/{subdir}/` and the records collected into `{subdir}/repodata.json`, so no
+`conda index` is required to install from the channel with `--offline`.
+"""
+
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+
+from . import conda, locking
+
+# fields of repodata_record.json that point at where the package was downloaded from
+_SOURCE_FIELDS = ("channel", "url")
+
+
+def channel_url(channel_dir: Path) -> str:
+    return channel_dir.resolve().as_uri()
+
+
+def cached_packages(pkgs_dir: Path) -> Iterator[Tuple[Path, Dict[str, Any]]]:
+    """Yield the tarball and repodata record of every extracted package in a cache."""
+    for record_path in sorted(pkgs_dir.glob("*/info/repodata_record.json")):
+        try:
+            record = json.loads(record_path.read_text())
+        except (OSError, ValueError):
+            logging.warning("Ignoring unreadable package record %s", record_path)
+            continue
+        fn = record.get("fn")
+        # `conda clean --tarballs` keeps the extracted package but not the tarball
+        if fn and (pkgs_dir / fn).is_file():
+            yield pkgs_dir / fn, record
+
+
+def write_local_channel(pkgs_dir: Path, channel_dir: Path) -> int:
+    """Add every package in the cache `pkgs_dir` to the channel in `channel_dir`.
+
+    Packages already in the channel are kept.  Returns the number of packages that
+    were added."""
+    repodatas: Dict[str, Dict[str, Any]] = {}
+
+    def repodata(subdir: str) -> Dict[str, Any]:
+        if subdir not in repodatas:
+            try:
+                data = json.loads((channel_dir / subdir / "repodata.json").read_text())
+            except FileNotFoundError:
+                data = {"info": {"subdir": subdir}, "packages": {}}
+            repodatas[subdir] = data
+        return repodatas[subdir]
+
+    # conda expects both subdirs to exist in every channel
+    repodata("noarch")
+    repodata(conda.current_platform())
+
+    added = 0
+    for tarball, record in cached_packages(pkgs_dir):
+        subdir = record.get("subdir") or "noarch"
+        key = "packages.conda" if tarball.name.endswith(".conda") else "packages"
+        entries = repodata(subdir).setdefault(key, {})
+        dest = channel_dir / subdir / tarball.name
+        if not dest.exists():
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(tarball, dest)
+        if tarball.name not in entries:
+            added += 1
+        entries[tarball.name] = {
+            k: v for k, v in record.items() if k not in _SOURCE_FIELDS
+        }
+
+    for subdir, data in repodatas.items():
+        path = channel_dir / subdir / "repodata.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        locking.write_text_atomic(path, json.dumps(data, indent=2, sort_keys=True))
+    return added
+
+
+def _link_or_copy(src: Path, dest: Path) -> None:
+    try:
+        os.link(src, dest)
+    except OSError:
+        # different file systems
+        shutil.copy2(src, dest)
@@ -0,0 +1,102 @@
+"""Inter-process locks and atomic writes for condax state.
+
+Several condax processes may run at once (e.g. a configuration management tool
+running `condax inject` in parallel), so everything that does a read-modify-write of
+shared state holds a lock:
+
+* one lock per environment, for its `.condax-metadata.json` and conda operations,
+* one lock for the link destination,
+* one lock for the registry.
+
+Locks must be taken in that order.  They are reentrant within a thread.  All lock
+files live in `CONFIG.prefix_path / ".locks"`.
+"""
+
+import contextlib
+import os
+import stat
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Generator
+
+from filelock import FileLock, Timeout
+
+from . import tracing
+from .config import CONFIG
+
+_locks: Dict[Path, FileLock] = {}
+_locks_guard = threading.Lock()
+
+
+def _lock(name: str) -> FileLock:
+    lock_dir = CONFIG.prefix_path / ".locks"
+    path = lock_dir / f"{name}.lock"
+    with _locks_guard:
+        lock = _locks.get(path)
+        if lock is None:
+            lock_dir.mkdir(parents=True, exist_ok=True)
+            lock = _locks[path] = FileLock(str(path))
+    return lock
+
+
+@contextlib.contextmanager
+def _hold(name: str) -> Generator[None, None, None]:
+    lock = _lock(name)
+    with tracing.span("wait for lock", lock=name):
+        lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+@contextlib.contextmanager
+def prefix_lock(env_prefix: Path) -> Generator[None, None, None]:
+    with _hold(f"prefix-{env_prefix.name}"):
+        yield
+
+
+@contextlib.contextmanager
+def try_prefix_lock(env_prefix: Path) -> Generator[bool, None, None]:
+    """Like `prefix_lock` without waiting, yields whether the lock was taken."""
+    lock = _lock(f"prefix-{env_prefix.name}")
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        lock.release()
+
+
+@contextlib.contextmanager
+def link_destination_lock() -> Generator[None, None, None]:
+    with _hold("link-destination"):
+        yield
+
+
+@contextlib.contextmanager
+def registry_lock() -> Generator[None, None, None]:
+    with _hold("registry"):
+        yield
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    """Write `text` to `path` so that readers see either the old or the new file."""
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fo:
+            fo.write(text)
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,171 @@
+"""Declarative lists of tools, as read by `condax sync`.
+
+A manifest lists the tools that should be installed, optionally with the channels to
+install each from and the packages to inject into it:
+
+    channels: [conda-forge]
+    tools:
+      - jq
+      - name: black=24.*
+        inject: [black-macchiato]
+      - name: jupyterlab
+        channels: [conda-forge, bioconda]
+        inject_apps: [jupytext]
+
+It is compared with the metadata and conda-meta file names of the installed
+environments, without reading any file of the packages, so that syncing an unchanged
+manifest is cheap.
+"""
+
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import yaml
+from pydantic import BaseModel, Field, field_validator
+
+from .conda import (
+    conda_env_prefix,
+    find_conda_meta_record,
+    installed_prefixes,
+    package_name,
+    split_conda_meta_filename,
+)
+from .config import CONFIG
+from .metadata import read_prefix_metadata
+from .repodata import version_matches
+
+
+class ManifestTool(BaseModel):
+    name: str = Field(description="Package spec of the tool, e.g. `black` or `jq=1.7`")
+    channels: Optional[List[str]] = None
+    inject: List[str] = Field(
+        default_factory=list, description="Packages to inject, without their apps"
+    )
+    inject_apps: List[str] = Field(
+        default_factory=list, description="Packages to inject together with their apps"
+    )
+
+    @property
+    def env_name(self) -> str:
+        return package_name(self.name)
+
+
+class Manifest(BaseModel):
+    channels: Optional[List[str]] = None
+    tools: List[ManifestTool] = Field(default_factory=list)
+
+    @field_validator("tools", mode="before")
+    @classmethod
+    def expand_names(cls, v: List[Any]) -> List[Any]:
+        return [{"name": t} if isinstance(t, str) else t for t in v or []]
+
+    def tool_channels(self, tool: ManifestTool) -> List[str]:
+        return tool.channels or self.channels or CONFIG.channels
+
+
+def read_manifest(path: Path) -> Manifest:
+    with open(path) as fo:
+        try:
+            data = yaml.safe_load(fo)
+        except yaml.YAMLError as e:
+            raise ValueError(f"Invalid manifest {path}: {e}") from e
+    manifest = Manifest.model_validate(data or {})
+    names = [tool.env_name for tool in manifest.tools]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise ValueError(f"Tools listed more than once: {', '.join(duplicates)}")
+    return manifest
+
+
+class SyncAction(str, Enum):
+    INSTALL = "install"
+    # the channels changed or injected packages have to be removed
+    RECREATE = "recreate"
+    # the installed version doesn't match the spec
+    UPDATE = "update"
+    INJECT = "inject"
+    REMOVE = "remove"
+
+
+class ToolChange(BaseModel):
+    env_name: str
+    action: SyncAction
+    tool: Optional[ManifestTool] = None
+    channels: List[str] = Field(default_factory=list)
+    # packages to inject into an existing environment
+    inject: List[str] = Field(default_factory=list)
+    inject_apps: List[str] = Field(default_factory=list)
+
+    def describe(self) -> str:
+        if self.action == SyncAction.INJECT:
+            return (
+                f"inject    {self.env_name}: {' '.join(self.inject + self.inject_apps)}"
+            )
+        spec = self.tool.name if self.tool is not None else self.env_name
+        return f"{self.action.value:<9} {spec}"
+
+
+def plan_sync(manifest: Manifest, remove_unlisted: bool = True) -> List[ToolChange]:
+    """The changes needed to make the installed environments match `manifest`."""
+    changes: List[ToolChange] = []
+    for tool in manifest.tools:
+        change = _plan_tool(tool, manifest.tool_channels(tool))
+        if change is not None:
+            changes.append(change)
+    if remove_unlisted:
+        listed = {tool.env_name for tool in manifest.tools}
+        changes.extend(
+            ToolChange(env_name=env_prefix.name, action=SyncAction.REMOVE)
+            for env_prefix in installed_prefixes()
+            if env_prefix.name not in listed
+        )
+    return changes
+
+
+def _plan_tool(tool: ManifestTool, channels: List[str]) -> Optional[ToolChange]:
+    env_prefix = conda_env_prefix(tool.env_name)
+
+    def change(action: SyncAction, **kwargs: Any) -> ToolChange:
+        return ToolChange(
+            env_name=tool.env_name,
+            action=action,
+            tool=tool,
+            channels=channels,
+            **kwargs,
+        )
+
+    if not (env_prefix / "conda-meta").is_dir():
+        return change(SyncAction.INSTALL)
+    metadata = read_prefix_metadata(env_prefix)
+    injected = set(metadata.injected_packages)
+    injected_with_apps = set(metadata.injected_packages_with_apps)
+    wanted = set(tool.inject) | set(tool.inject_apps)
+    if (
+        (metadata.channels and metadata.channels != channels)
+        or injected - wanted
+        or injected_with_apps - set(tool.inject_apps)
+    ):
+        return change(SyncAction.RECREATE)
+    if not spec_satisfied(tool.name, env_prefix):
+        return change(SyncAction.UPDATE)
+    inject = sorted(set(tool.inject) - injected)
+    inject_apps = sorted(set(tool.inject_apps) - injected_with_apps)
+    if inject or inject_apps:
+        return change(SyncAction.INJECT, inject=inject, inject_apps=inject_apps)
+    return None
+
+
+def spec_satisfied(spec: str, env_prefix: Path) -> bool:
+    """Whether the package installed in `env_prefix` matches `spec`.
+
+    Only the version of the spec is checked.  Specs that are too complicated to check
+    here are assumed to match."""
+    spec = spec.split("::")[-1]
+    name = package_name(spec)
+    record = find_conda_meta_record(name, env_prefix)
+    parts = split_conda_meta_filename(record.name) if record is not None else None
+    if parts is None:
+        return False
+    matches = version_matches(spec[len(name) :], parts[1])
+    return True if matches is None else matches
@@ -1,8 +1,10 @@
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
+METADATA_FILENAME = ".condax-metadata.json"
+
 
 class PrefixMetadata(BaseModel):
     prefix: Path
@@ -18,3 +20,114 @@ class PrefixMetadata(BaseModel):
         default_factory=list,
         description="Extra packages to injected into in the environment with apps",
     )
+    spec: Optional[str] = Field(
+        default=None, description="Package spec the environment was installed from"
+    )
+    channels: List[str] = Field(
+        default_factory=list,
+        description="Channels the environment was created with, highest priority first",
+    )
+    resolved_hash: Optional[str] = Field(
+        default=None,
+        description="Hash of the exact packages installed, see `conda.resolved_hash`",
+    )
+    activate: bool = Field(
+        default=False,
+        description="Whether links are entrypoints that activate the environment",
+    )
+    link_dependencies: bool = Field(
+        default=False,
+        description="Whether the executables of all packages in the environment are "
+        "linked, not only those of the package and packages injected with apps",
+    )
+
+
+def read_prefix_metadata(env_prefix: Path) -> PrefixMetadata:
+    metadata_path = env_prefix / METADATA_FILENAME
+    if metadata_path.exists():
+        return PrefixMetadata.model_validate_json(metadata_path.read_text())
+    else:
+        return PrefixMetadata(prefix=env_prefix)
+
+
+class RunEnvironment(BaseModel):
+    """A cached environment of `condax run`."""
+
+    spec: str
+    channels: List[str] = Field(default_factory=list)
+    created: float = Field(description="Time the environment was created, in seconds")
+    environment: Dict[str, str] = Field(
+        default_factory=dict,
+        description="Variables set by activating the environment, other than PATH",
+    )
+
+
+class Registry(BaseModel):
+    environments: Dict[str, PrefixMetadata] = Field(
+        default_factory=dict,
+        description="Key is the name of the environment directory",
+    )
+    link_owners: Dict[Path, str] = Field(
+        default_factory=dict,
+        description="Key is the link path, value is the environment that owns it",
+    )
+
+
+class IndexedCondaMeta(BaseModel):
+    mtime_ns: int
+    size: int
+    name: str
+    executables: Optional[List[Path]] = Field(
+        default=None,
+        description="Executables provided by the package, as absolute paths.  None if "
+        "the record was skipped before its files were collected",
+    )
+
+
+class ExecutablesIndex(BaseModel):
+    records: Dict[str, IndexedCondaMeta] = Field(
+        default_factory=dict,
+        description="Key is the file name of the conda-meta record",
+    )
+
+
+class InstalledPackage(BaseModel):
+    """Summary of a condax managed environment, as shown by `condax list`."""
+
+    name: str
+    prefix: Path
+    version: Optional[str] = None
+    build: Optional[str] = None
+    channel: Optional[str] = None
+    links: Dict[Path, Path] = Field(default_factory=dict)
+    injected_packages: List[str] = Field(default_factory=list)
+    injected_packages_with_apps: List[str] = Field(default_factory=list)
+
+
+class LockedPackage(BaseModel):
+    url: str
+    md5: Optional[str] = None
+    sha256: Optional[str] = None
+
+
+class LockedEnvironment(BaseModel):
+    name: str = Field(description="Name of the environment directory")
+    platform: Optional[str] = Field(
+        default=None, description="conda subdir the environment was exported on"
+    )
+    channels: List[str] = Field(default_factory=list)
+    injected_packages: List[str] = Field(default_factory=list)
+    injected_packages_with_apps: List[str] = Field(default_factory=list)
+    activate: bool = False
+    link_dependencies: bool = False
+    packages: List[LockedPackage] = Field(
+        default_factory=list,
+        description="Every package in the environment, as an explicit url",
+    )
+
+
+class CondaxLock(BaseModel):
+    """Exact contents of condax environments, as written by `condax export`."""
+
+    version: int = 1
+    environments: List[LockedEnvironment] = Field(default_factory=list)
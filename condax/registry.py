@@ -0,0 +1,205 @@
+"""A single index of every environment managed by condax.
+
+The metadata of each environment lives in its own `.condax-metadata.json`, so
+questions about the whole installation (like which environment owns a link) would
+require opening every prefix.  The registry mirrors all of that metadata into one
+file under `CONFIG.prefix_path`, together with a reverse index of links.  It is
+updated whenever the metadata of a prefix is written, and is rebuilt from the
+per-prefix metadata when it is missing (e.g. after upgrading condax).
+
+The parsed registry is kept for as long as the file doesn't change, so looking up
+link owners doesn't parse it again.  Within a `batch` (a condax command) changes are
+collected in memory and written once at the end, rather than on every write of
+metadata.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Generator, List, Optional, Set, Tuple
+
+import yaml
+
+from . import conda, locking, tracing
+from .config import CONFIG
+from .metadata import PrefixMetadata, Registry, read_prefix_metadata
+
+REGISTRY_FILENAME = ".condax-registry.json"
+
+_lock = threading.RLock()
+# the last registry read or written, and the path and stat of the file it is from
+_cache: Optional[Tuple[Tuple[str, int, int, int], Registry]] = None
+# the registry with the changes of the ongoing batches, and the environments changed
+_batch_depth = 0
+_batch: Optional[Registry] = None
+_batch_changed: Set[str] = set()
+
+
+def registry_path() -> Path:
+    return CONFIG.prefix_path / REGISTRY_FILENAME
+
+
+def load_registry() -> Registry:
+    """The registry, including the changes of an ongoing batch.  It is shared, so it
+    must not be modified."""
+    with _lock:
+        if _batch is not None:
+            return _batch
+    path = registry_path()
+    try:
+        with open(path, encoding="utf-8") as fo:
+            key = _cache_key(path, os.fstat(fo.fileno()))
+            with _lock:
+                if _cache is not None and _cache[0] == key:
+                    return _cache[1]
+            registry = Registry.model_validate_json(fo.read())
+    except FileNotFoundError:
+        pass
+    except ValueError:
+        logging.warning("Rebuilding corrupt condax registry %s", path)
+    else:
+        _remember(key, registry)
+        return registry
+    with locking.registry_lock():
+        registry = build_registry()
+        save_registry(registry)
+    return registry
+
+
+def save_registry(registry: Registry) -> None:
+    """Write the registry, which must hold the registry lock.  It replaces the changes
+    of an ongoing batch, so it must include them."""
+    global _batch
+    CONFIG.prefix_path.mkdir(parents=True, exist_ok=True)
+    path = registry_path()
+    locking.write_text_atomic(path, registry.model_dump_json(indent=2))
+    _remember(_cache_key(path, path.stat()), registry)
+    with _lock:
+        _batch = None
+        _batch_changed.clear()
+
+
+@contextlib.contextmanager
+def batch() -> Generator[None, None, None]:
+    """Write the changes to the registry made in the block once, at its end."""
+    global _batch_depth, _batch
+    with _lock:
+        _batch_depth += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _batch_depth -= 1
+            changed, names = _batch, set(_batch_changed)
+            if _batch_depth == 0:
+                _batch = None
+                _batch_changed.clear()
+        if _batch_depth == 0 and changed is not None and names:
+            _write_changes(changed, names)
+
+
+def _write_changes(changed: Registry, names: Set[str]) -> None:
+    with locking.registry_lock(), tracing.span("update registry"):
+        # other processes may have changed other environments meanwhile
+        registry = load_registry().model_copy(deep=True)
+        for name in names:
+            metadata = changed.environments.get(name)
+            if metadata is None:
+                _remove_environment(registry, name)
+            else:
+                _set_environment(registry, name, metadata)
+        save_registry(registry)
+
+
+def build_registry() -> Registry:
+    """Import the per-prefix metadata of every environment into a new registry."""
+    registry = Registry()
+    for env_prefix in conda.installed_prefixes():
+        metadata = read_prefix_metadata(env_prefix)
+        if not metadata.channels:
+            metadata.channels = _condarc_channels(env_prefix)
+        _set_environment(registry, env_prefix.name, metadata)
+    return registry
+
+
+def record_environment(name: str, metadata: PrefixMetadata) -> None:
+    if _change_batch(name, metadata):
+        return
+    with locking.registry_lock(), tracing.span("update registry"):
+        registry = load_registry().model_copy(deep=True)
+        _set_environment(registry, name, metadata)
+        save_registry(registry)
+
+
+def forget_environment(name: str) -> None:
+    if _change_batch(name, None):
+        return
+    with locking.registry_lock():
+        registry = load_registry().model_copy(deep=True)
+        _remove_environment(registry, name)
+        save_registry(registry)
+
+
+def link_owner(link: Path) -> Optional[str]:
+    """Return the name of the environment that owns `link`, if any."""
+    return load_registry().link_owners.get(link)
+
+
+def _change_batch(name: str, metadata: Optional[PrefixMetadata]) -> bool:
+    """Record a change in the ongoing batch, if there is one."""
+    global _batch
+    with _lock:
+        if not _batch_depth:
+            return False
+        current = _batch
+    if current is None:
+        # read outside of `_lock`, since reading may rebuild it under the registry lock
+        current = load_registry().model_copy(deep=True)
+    with _lock:
+        if _batch is None:
+            _batch = current
+        if metadata is None:
+            _remove_environment(_batch, name)
+        else:
+            _set_environment(_batch, name, metadata)
+        _batch_changed.add(name)
+    return True
+
+
+def _cache_key(path: Path, st: os.stat_result) -> Tuple[str, int, int, int]:
+    # the registry is replaced rather than written to, so a new file is a new inode
+    return (str(path), st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _remember(key: Tuple[str, int, int, int], registry: Registry) -> None:
+    global _cache
+    with _lock:
+        _cache = (key, registry)
+
+
+def _set_environment(registry: Registry, name: str, metadata: PrefixMetadata) -> None:
+    _remove_environment(registry, name)
+    registry.environments[name] = metadata
+    for link in metadata.links.values():
+        registry.link_owners[link] = name
+
+
+def _remove_environment(registry: Registry, name: str) -> None:
+    metadata = registry.environments.pop(name, None)
+    if metadata is None:
+        return
+    for link in metadata.links.values():
+        if registry.link_owners.get(link) == name:
+            del registry.link_owners[link]
+
+
+def _condarc_channels(env_prefix: Path) -> List[str]:
+    """Channels recorded by `conda.write_condarc_to_prefix`."""
+    try:
+        with open(env_prefix / "condarc") as fo:
+            condarc = yaml.safe_load(fo) or {}
+    except (OSError, yaml.YAMLError):
+        return []
+    return list(condarc.get("channels") or [])
@@ -0,0 +1,326 @@
+"""Channel repodata, to tell whether an environment has anything to update.
+
+Running `conda update --all` means a full repodata fetch and solve for every
+environment, even when nothing changed.  Instead the packages that condax manages in
+an environment, the package it was installed from and the injected packages, are
+compared against the newest packages that match their specs in the repodata of the
+channel subdir each of them was installed from, which is fetched once per subdir.
+Dependencies aren't compared: they are often held back by the constraints of other
+packages, and a new version of a dependency alone isn't worth an update.
+
+Fetched repodata is kept in `CONFIG.prefix_path / ".cache" / "repodata"` and reused
+for `CONFIG.repodata_ttl` seconds, if that is set; in offline mode it is used
+regardless of its age.
+"""
+
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from . import locking, tracing
+from .conda import find_conda_meta_record, package_name
+from .conda_meta import read_record_fields
+from .config import CONFIG
+from .metadata import read_prefix_metadata
+
+# fields of a conda-meta record that are needed to look for newer packages
+_RECORD_FIELDS = ("build_number", "channel", "name", "subdir", "url", "version")
+
+_RE_VERSION_ATOM = re.compile(r"\d+|[^\d]+")
+_RE_CONSTRAINT = re.compile(r"^(==|!=|>=|<=|>|<|=)?([^=<>!\s]+)$")
+
+_Atom = Union[int, str]
+
+
+def _version_atoms(version: str) -> List[List[_Atom]]:
+    components: List[List[_Atom]] = []
+    for component in re.split(r"[._-]", version):
+        atoms: List[_Atom] = [
+            int(a) if a.isdigit() else a for a in _RE_VERSION_ATOM.findall(component)
+        ]
+        if not atoms or isinstance(atoms[0], str):
+            # like conda, `1.a` is `1.0a`
+            atoms.insert(0, 0)
+        components.append(atoms)
+    return components
+
+
+def _compare_atoms(a: _Atom, b: _Atom) -> int:
+    def rank(atom: _Atom) -> Tuple[int, int, str]:
+        if isinstance(atom, int):
+            return (2, atom, "")
+        if atom == "post":
+            return (3, 0, "")
+        if atom == "dev":
+            return (0, 0, "")
+        return (1, 0, atom)
+
+    ra, rb = rank(a), rank(b)
+    return (ra > rb) - (ra < rb)
+
+
+def compare_versions(a: str, b: str) -> int:
+    """Compare two conda version strings, returning -1, 0 or 1.
+
+    This follows the rules of conda's `VersionOrder` closely enough for telling
+    whether a package is newer: an optional epoch (`1!2.0`), components separated by
+    `.`, `_` or `-` that are compared number by number, `dev` releases before
+    pre-releases (`1.0a1`) before the release, and `post` releases after it.
+    Anything after `+` (the local version) only breaks ties.
+    """
+
+    def split(version: str) -> Tuple[int, List[List[_Atom]], List[List[_Atom]]]:
+        version = version.strip().lower()
+        epoch = 0
+        if "!" in version:
+            e, version = version.split("!", 1)
+            epoch = int(e) if e.isdigit() else 0
+        version, _, local = version.partition("+")
+        return epoch, _version_atoms(version), _version_atoms(local) if local else []
+
+    def compare_components(x: List[List[_Atom]], y: List[List[_Atom]]) -> int:
+        for i in range(max(len(x), len(y))):
+            cx = x[i] if i < len(x) else [0]
+            cy = y[i] if i < len(y) else [0]
+            for j in range(max(len(cx), len(cy))):
+                c = _compare_atoms(
+                    cx[j] if j < len(cx) else 0, cy[j] if j < len(cy) else 0
+                )
+                if c:
+                    return c
+        return 0
+
+    epoch_a, release_a, local_a = split(a)
+    epoch_b, release_b, local_b = split(b)
+    if epoch_a != epoch_b:
+        return -1 if epoch_a < epoch_b else 1
+    return compare_components(release_a, release_b) or compare_components(
+        local_a, local_b
+    )
+
+
+def version_matches(constraint: str, version: str) -> Optional[bool]:
+    """Whether `version` matches the version part of a package spec, like `=1.6`,
+    `>=1.6,<2`, ` 1.6.*` or `=1.6=build`.  None if the constraint isn't understood."""
+    constraint = constraint.strip()
+    if not constraint:
+        return True
+    if "[" in constraint:
+        return None
+    if constraint.startswith("=") and not constraint.startswith("=="):
+        # `=1.6=build` or `=1.6`, which means `1.6.*`
+        constraint = constraint[1:].split("=")[0].rstrip("*").rstrip(".") + ".*"
+    else:
+        # `1.6 build`
+        constraint = constraint.split()[0]
+    results = []
+    for alternative in constraint.split("|"):
+        matches = [_matches(c.strip(), version) for c in alternative.split(",")]
+        if None in matches:
+            return None
+        results.append(all(matches))
+    return any(results)
+
+
+def _matches(constraint: str, version: str) -> Optional[bool]:
+    m = _RE_CONSTRAINT.match(constraint)
+    if m is None:
+        return None
+    op, expected = m.group(1) or "==", m.group(2)
+    if expected.endswith("*"):
+        expected = expected.rstrip("*").rstrip(".")
+        starts_with = version == expected or version.startswith(f"{expected}.")
+        if op in ("==", "="):
+            return starts_with
+        if op == "!=":
+            return not starts_with
+    c = compare_versions(version, expected)
+    ops: Dict[str, bool] = {
+        "==": c == 0,
+        "=": c == 0,
+        "!=": c != 0,
+        ">=": c >= 0,
+        "<=": c <= 0,
+        ">": c > 0,
+        "<": c < 0,
+    }
+    return ops[op]
+
+
+def _newer(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    """Whether the package record `a` is newer than `b`."""
+    c = compare_versions(str(a.get("version", "")), str(b.get("version", "")))
+    if c:
+        return c > 0
+    return int(a.get("build_number") or 0) > int(b.get("build_number") or 0)
+
+
+class RepodataIndex:
+    """The packages in the channel subdirs that are asked for, by name.
+
+    The repodata of each subdir is fetched at most once, even when several threads
+    ask for it at the same time.  `current_repodata.json`, which only lists the
+    newest packages, is used unless a spec rules all of those out.
+    """
+
+    def __init__(self) -> None:
+        evict_expired()
+        self._records: Dict[Tuple[str, bool], Dict[str, List[Dict[str, Any]]]] = {}
+        self._errors: Dict[Tuple[str, bool], Exception] = {}
+        self._locks: Dict[Tuple[str, bool], threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def newest(
+        self, subdir_url: str, name: str, constraint: str = ""
+    ) -> Optional[Dict[str, Any]]:
+        """Return the newest record for package `name` in a channel subdir that
+        matches the version `constraint` of a spec, like `<23`."""
+        newest = None
+        for full in (False, True):
+            for record in self._by_name(subdir_url, full).get(name, []):
+                # constraints that aren't understood may match
+                if version_matches(constraint, str(record.get("version", ""))) is False:
+                    continue
+                if newest is None or _newer(record, newest):
+                    newest = record
+            if newest is not None or not constraint.strip():
+                break
+        return newest
+
+    def _by_name(self, subdir_url: str, full: bool) -> Dict[str, List[Dict[str, Any]]]:
+        key = (subdir_url, full)
+        with self._guard:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            if key in self._errors:
+                raise self._errors[key]
+            if key not in self._records:
+                try:
+                    self._records[key] = _records_by_name(_load(subdir_url, full))
+                except (OSError, ValueError) as e:
+                    # don't retry for every environment
+                    self._errors[key] = e
+                    raise
+        return self._records[key]
+
+    def has_updates(self, env_prefix: Path) -> bool:
+        """Whether the package of the environment or a package injected into it has
+        a newer version that matches its spec in the channel it was installed from.
+
+        If that can't be told (e.g. the repodata could not be fetched) the
+        environment is assumed to have updates."""
+        metadata = read_prefix_metadata(env_prefix)
+        for spec in [metadata.spec or env_prefix.name, *metadata.injected_packages]:
+            spec = spec.split("::")[-1]
+            name = package_name(spec)
+            path = find_conda_meta_record(name, env_prefix)
+            try:
+                if path is None:
+                    raise FileNotFoundError(f"no conda-meta record of {name}")
+                with open(path, encoding="utf-8") as fo:
+                    record = read_record_fields(fo, _RECORD_FIELDS)
+                subdir_url = _subdir_url(record)
+                if subdir_url is None:
+                    return True
+                newest = self.newest(subdir_url, name, spec[len(name) :])
+            except (OSError, ValueError, KeyError) as e:
+                logging.warning("Can't check %s for updates: %s", env_prefix.name, e)
+                return True
+            if newest is not None and _newer(newest, record):
+                return True
+        return False
+
+
+def _subdir_url(record: Dict[str, Any]) -> Optional[str]:
+    url = record.get("url")
+    if url:
+        return url.rsplit("/", 1)[0]
+    channel, subdir = record.get("channel"), record.get("subdir")
+    if channel and "://" in channel:
+        return channel if channel.endswith(f"/{subdir}") else f"{channel}/{subdir}"
+    return None
+
+
+def _records_by_name(repodata: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    by_name: Dict[str, List[Dict[str, Any]]] = {}
+    for key in ("packages", "packages.conda"):
+        for record in (repodata.get(key) or {}).values():
+            by_name.setdefault(record["name"], []).append(record)
+    return by_name
+
+
+def cache_dir() -> Path:
+    return CONFIG.prefix_path / ".cache" / "repodata"
+
+
+def _cache_path(url: str) -> Path:
+    return cache_dir() / f"{hashlib.sha256(url.encode()).hexdigest()[:16]}.json"
+
+
+def evict_expired() -> None:
+    """Remove cached repodata that is older than `CONFIG.repodata_ttl`."""
+    if CONFIG.offline or CONFIG.repodata_ttl is None:
+        # stale repodata is all there is offline, and without a TTL it is only kept
+        # for going offline
+        return
+    now = time.time()
+    for path in cache_dir().glob("*.json"):
+        with contextlib.suppress(OSError):
+            if now - path.stat().st_mtime > CONFIG.repodata_ttl:
+                path.unlink()
+
+
+def _load(subdir_url: str, full: bool = False) -> Dict[str, Any]:
+    """Fetch the repodata of a channel subdir.
+
+    `current_repodata.json` only lists the newest packages, which is usually all that
+    is needed here, and is a fraction of the size of the full `repodata.json`."""
+    from urllib.error import URLError
+
+    if full:
+        return _load_cached(f"{subdir_url}/repodata.json")
+    try:
+        return _load_cached(f"{subdir_url}/current_repodata.json")
+    except URLError:
+        return _load_cached(f"{subdir_url}/repodata.json")
+
+
+def _load_cached(url: str) -> Dict[str, Any]:
+    from urllib.error import URLError
+
+    if url.startswith("file://"):
+        # local channels are as fast to read as the cache, and may change any time
+        return json.loads(_fetch(url))
+    path = _cache_path(url)
+    with contextlib.suppress(OSError, ValueError):
+        if CONFIG.offline or (
+            CONFIG.repodata_ttl is not None
+            and time.time() - path.stat().st_mtime <= CONFIG.repodata_ttl
+        ):
+            return json.loads(path.read_bytes())
+    if CONFIG.offline:
+        raise URLError(f"{url} is not cached and condax is offline")
+    data = _fetch(url)
+    repodata = json.loads(data)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    locking.write_text_atomic(path, data.decode("utf-8"))
+    return repodata
+
+
+def _fetch(url: str) -> bytes:
+    from urllib.request import Request, urlopen
+
+    request = Request(url, headers={"Accept-Encoding": "gzip"})
+    with tracing.span("fetch repodata", url=url):
+        with urlopen(request, timeout=60) as response:
+            data = response.read()
+            if response.headers.get("Content-Encoding") == "gzip":
+                data = gzip.decompress(data)
+    return data
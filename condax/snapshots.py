@@ -0,0 +1,85 @@
+"""Snapshots of environments, taken before an update so that it can be undone.
+
+conda environments can't be moved: files of many packages (e.g. script shebangs)
+contain the prefix they were installed to.  So rather than building the updated
+environment in another directory, the current environment is copied aside and
+updated where it is.  The copy is made of hard links, which is cheap, and stays
+intact because conda replaces files instead of writing into them.  Only the files
+that are changed in place (`conda-meta`, and condax's own files at the top of the
+prefix) are copied.
+
+A snapshot lives in `CONFIG.prefix_path / ".snapshots"`, named like the environment.
+It can be swapped with the environment by renaming both, since the snapshot was taken
+at the same path that it is restored to.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from . import tracing
+from .config import CONFIG
+
+
+def snapshot_dir() -> Path:
+    return CONFIG.prefix_path / ".snapshots"
+
+
+def snapshot_path(env_prefix: Path) -> Path:
+    return snapshot_dir() / env_prefix.name
+
+
+def has_snapshot(env_prefix: Path) -> bool:
+    return snapshot_path(env_prefix).is_dir()
+
+
+def take(env_prefix: Path) -> Path:
+    """Snapshot `env_prefix`, replacing an older snapshot of it."""
+    snapshot = snapshot_path(env_prefix)
+    tmp = snapshot.with_name(f".{snapshot.name}.tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    snapshot.parent.mkdir(parents=True, exist_ok=True)
+    with tracing.span("snapshot", prefix=env_prefix.name):
+        _clone(env_prefix, tmp)
+        discard(env_prefix)
+        os.rename(tmp, snapshot)
+    return snapshot
+
+
+def swap(env_prefix: Path) -> None:
+    """Exchange `env_prefix` with its snapshot, so that swapping again undoes it."""
+    snapshot = snapshot_path(env_prefix)
+    tmp = snapshot.with_name(f".{snapshot.name}.swap")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.rename(env_prefix, tmp)
+    os.rename(snapshot, env_prefix)
+    os.rename(tmp, snapshot)
+
+
+def restore(env_prefix: Path) -> None:
+    """Replace `env_prefix` by its snapshot, which is used up."""
+    swap(env_prefix)
+    discard(env_prefix)
+
+
+def discard(env_prefix: Path) -> None:
+    shutil.rmtree(snapshot_path(env_prefix), ignore_errors=True)
+
+
+def _clone(src: Path, dst: Path) -> None:
+    for root, dirs, files in os.walk(src):
+        rel = Path(root).relative_to(src)
+        os.mkdir(dst / rel)
+        # conda appends to its history and condax rewrites its files at the top
+        copy = root == str(src) or rel.parts[:1] == ("conda-meta",)
+        for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+            source, target = os.path.join(root, name), dst / rel / name
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+            elif copy:
+                shutil.copy2(source, target)
+            else:
+                try:
+                    os.link(source, target)
+                except OSError:
+                    shutil.copy2(source, target)
@@ -0,0 +1,143 @@
+"""Timing of the phases of a condax command.
+
+Code that may be slow wraps itself in `span`, which is a no-op until tracing is
+enabled (by `--profile` or `--trace-file`).  Once enabled every span is recorded with
+its thread and arguments, so that the run can be summarized per phase or written as
+Chrome trace events (viewable in `chrome://tracing` or https://ui.perfetto.dev).
+With `--json` spans are also reported as events when they start and end.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Generator, List
+
+from . import events as json_events
+
+_enabled = False
+_start_ns = 0
+_events: List[Dict[str, Any]] = []
+_events_lock = threading.Lock()
+
+
+def enable() -> None:
+    global _enabled, _start_ns
+    _enabled = True
+    _start_ns = time.perf_counter_ns()
+    _events.clear()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+@contextlib.contextmanager
+def span(name: str, **args: Any) -> Generator[Dict[str, Any], None, None]:
+    """Time the enclosed block as the phase `name`.
+
+    Yields the arguments of the span, to which more can be added (e.g. an exit code).
+    If the block raises, the name of the exception is recorded as `error`.
+    """
+    if not (_enabled or json_events.is_enabled()):
+        yield args
+        return
+    start = time.perf_counter_ns()
+    json_events.emit("phase_start", phase=name, **_jsonable_args(args))
+    try:
+        yield args
+    except BaseException as e:
+        args.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        end = time.perf_counter_ns()
+        if _enabled:
+            _record(name, start, end, args)
+        json_events.emit(
+            "phase_end",
+            phase=name,
+            duration=round((end - start) / 1e9, 3),
+            **_jsonable_args(args),
+        )
+
+
+def _record(name: str, start_ns: int, end_ns: int, args: Dict[str, Any]) -> None:
+    event = {
+        "name": name,
+        "ph": "X",
+        "ts": (start_ns - _start_ns) / 1000,
+        "dur": (end_ns - start_ns) / 1000,
+        "pid": os.getpid(),
+        "tid": threading.get_ident(),
+        "args": _jsonable_args(args),
+    }
+    with _events_lock:
+        _events.append(event)
+
+
+def _jsonable_args(args: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _jsonable(v) for k, v in args.items()}
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return str(value)
+
+
+def finish(name: str) -> None:
+    """Record the whole run, from `enable` until now, as the span `name`."""
+    if _enabled:
+        _record(name, _start_ns, time.perf_counter_ns(), {})
+
+
+def events() -> List[Dict[str, Any]]:
+    with _events_lock:
+        return list(_events)
+
+
+def write_chrome_trace(path: Path) -> None:
+    """Write the recorded spans in the Chrome trace event format."""
+    trace_events = events()
+    threads = sorted({e["tid"] for e in trace_events})
+    names = {t.ident: t.name for t in threading.enumerate()}
+    for tid in threads:
+        trace_events.append(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": names.get(tid, f"thread-{tid}")},
+            }
+        )
+    path.write_text(
+        json.dumps({"traceEvents": trace_events, "displayTimeUnit": "ms"}, indent=1)
+    )
+
+
+def format_profile() -> str:
+    """Tabulate the number of calls, total and longest time and errors of each phase.
+
+    Phases nest (e.g. `conda create` runs within `install`), and concurrent phases
+    overlap, so the totals don't add up to the wall time of the run."""
+    phases: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    for event in events():
+        phases.setdefault(event["name"], []).append(event["dur"] / 1000)
+        if "error" in event["args"] or event["args"].get("exit_code"):
+            errors[event["name"]] = errors.get(event["name"], 0) + 1
+
+    lines = [
+        f"{'phase':<32} {'calls':>6} {'total ms':>10} {'max ms':>10} {'errors':>6}"
+    ]
+    for name, durations in sorted(phases.items(), key=lambda kv: -sum(kv[1])):
+        lines.append(
+            f"{name:<32} {len(durations):>6} {sum(durations):>10.1f} "
+            f"{max(durations):>10.1f} {errors.get(name, 0):>6}"
+        )
+    return "\n".join(lines)
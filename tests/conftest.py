@@ -0,0 +1,28 @@
+import stat
+import sys
+from pathlib import Path
+
+import pytest
+
+
+@pytest.fixture
+def fake_conda(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Point condax at temporary prefix/link directories and a stub conda."""
+    if sys.platform == "win32":
+        pytest.skip("the fake conda executable is a shell script")
+    import condax.config
+
+    prefix = tmp_path / "prefix"
+    link = tmp_path / "link"
+    prefix.mkdir()
+    link.mkdir()
+    exe = tmp_path / "conda"
+    exe.write_text(
+        f'#!/bin/sh\nexec "{sys.executable}" "{Path(__file__).parent / "fake_conda.py"}" "$@"\n'
+    )
+    exe.chmod(exe.stat().st_mode | stat.S_IEXEC)
+
+    monkeypatch.setattr(condax.config.CONFIG, "prefix_path", prefix)
+    monkeypatch.setattr(condax.config.CONFIG, "link_destination", link)
+    monkeypatch.setattr(condax.config.CONFIG, "conda_executable", exe)
+    return {"prefix": prefix, "link": link, "conda": exe}
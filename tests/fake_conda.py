@@ -0,0 +1,207 @@
+"""A tiny stand-in for the conda CLI, good enough to drive condax offline.
+
+Every package spec installed into a prefix gets a conda-meta record and a single
+executable `bin/<name>`.  `update` bumps the major version of every record.  Set
+`FAKE_CONDA_FAIL` to a comma separated list of prefix names for which every command
+should fail.
+
+Packages from `file://` channels are looked up in the channel's `repodata.json`.
+With `--offline` only those channels can be used.  `create --download-only` writes
+tarballs and extracted `info/repodata_record.json` files to the first of
+`CONDA_PKGS_DIRS`.
+
+Set `FAKE_CONDA_FILES` to a number of files to add to every package, which are listed
+in the conda-meta records (in `files` and `paths_data`) like conda does, though not
+actually written to the prefix.
+
+With `--json` create and install report download progress and the linked packages,
+and failures, as JSON like conda does.
+
+If `FAKE_CONDA_LOG` is set every invocation is appended to that file as a JSON line
+with the arguments and the conda related environment variables.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+from pathlib import Path
+from typing import List, Tuple
+
+
+def write_record(
+    prefix: Path, name: str, version: str, channel: str, build: str = "0"
+) -> None:
+    meta = prefix / "conda-meta"
+    meta.mkdir(parents=True, exist_ok=True)
+    for old in meta.glob(f"{name}-*.json"):
+        if json.loads(old.read_text())["name"] == name:
+            old.unlink()
+    exe = prefix / "bin" / name
+    exe.parent.mkdir(parents=True, exist_ok=True)
+    # like conda, replace files rather than writing into them
+    if exe.exists():
+        exe.unlink()
+    exe.write_text(f"#!/bin/sh\necho {name} {version}\n")
+    exe.chmod(0o755)
+    record = repodata_record(name, version, channel, build)
+    n_files = int(os.environ.get("FAKE_CONDA_FILES", "0"))
+    record["files"] = [f"bin/{name}", f"lib/{name}/__init__.py"] + [
+        f"lib/{name}/module_{i}.py" for i in range(n_files)
+    ]
+    if n_files:
+        record["paths_data"] = {
+            "paths": [
+                {"_path": fn, "path_type": "hardlink", "sha256": "0" * 64, "size": 1}
+                for fn in record["files"]
+            ],
+            "paths_version": 1,
+        }
+    (meta / f"{name}-{version}-{build}.json").write_text(
+        json.dumps(record, indent=2 if n_files else None, sort_keys=True)
+    )
+
+
+def channel_url(channel: str) -> str:
+    if "://" in channel:
+        return channel.rstrip("/")
+    return f"https://conda.anaconda.org/{channel}"
+
+
+def repodata_record(name: str, version: str, channel: str, build: str = "0") -> dict:
+    fn = f"{name}-{version}-{build}.tar.bz2"
+    return {
+        "build": build,
+        "build_number": 0,
+        "channel": f"{channel_url(channel)}/noarch",
+        "depends": [],
+        "fn": fn,
+        "md5": hashlib.md5(fn.encode()).hexdigest(),
+        "name": name,
+        "subdir": "noarch",
+        "url": f"{channel_url(channel)}/noarch/{fn}",
+        "version": version,
+    }
+
+
+def resolve(spec: str, channels: List[str], offline: bool) -> Tuple[str, str, str, str]:
+    """Return the name, version, channel and build that satisfy `spec`."""
+    m = re.match(r"^([a-zA-Z0-9._-]+)(?:[=<>!~]+([0-9][a-zA-Z0-9._]*))?", spec)
+    assert m is not None
+    name, version = m.group(1), m.group(2)
+    for channel in channels:
+        if not channel.startswith("file://"):
+            if offline:
+                continue
+            return name, version or "1.0", channel, "0"
+        channel_dir = Path(channel[len("file://") :])
+        for repodata in channel_dir.glob("*/repodata.json"):
+            for entry in json.loads(repodata.read_text()).get("packages", {}).values():
+                if entry["name"] == name and version in (None, entry["version"]):
+                    return name, entry["version"], channel, entry["build"]
+    raise LookupError(f"PackagesNotFoundError: {spec} in {channels}")
+
+
+def install(
+    prefix: Path, specs: List[str], channels: List[str], offline: bool, as_json: bool
+) -> None:
+    # solve everything before touching the prefix, like conda does
+    packages = [resolve(spec, channels, offline) for spec in specs]
+    for name, version, channel, build in packages:
+        if as_json:
+            for progress in (0.0, 0.5, 1.0):
+                progress_doc = {"fetch": name, "finished": progress == 1.0}
+                print(json.dumps({**progress_doc, "progress": progress}), end="\0")
+        write_record(prefix, name, version, channel, build)
+    if as_json:
+        link = [
+            {"name": n, "version": v, "build_string": b, "channel": c}
+            for n, v, c, b in packages
+        ]
+        print(json.dumps({"actions": {"LINK": link}, "success": True}, indent=2))
+
+
+def download(specs: List[str], channels: List[str], offline: bool) -> None:
+    pkgs_dir = Path(os.environ["CONDA_PKGS_DIRS"].split(",")[0])
+    for spec in specs:
+        record = repodata_record(*resolve(spec, channels, offline))
+        pkgs_dir.mkdir(parents=True, exist_ok=True)
+        (pkgs_dir / record["fn"]).write_bytes(record["md5"].encode())
+        info = pkgs_dir / record["fn"][: -len(".tar.bz2")] / "info"
+        info.mkdir(parents=True, exist_ok=True)
+        (info / "repodata_record.json").write_text(json.dumps(record))
+
+
+def install_explicit(prefix: Path, explicit_file: Path) -> None:
+    lines = explicit_file.read_text().splitlines()
+    assert lines[0] == "@EXPLICIT"
+    for line in lines[1:]:
+        url, _, _md5 = line.partition("#")
+        channel = url.split("/")[-3]
+        fn = url.rsplit("/", 1)[1][: -len(".tar.bz2")]
+        name, version, build = fn.rsplit("-", 2)
+        write_record(prefix, name, version, channel, build)
+
+
+def main(argv: List[str]) -> int:
+    command, args = argv[0], argv[1:]
+    if "FAKE_CONDA_LOG" in os.environ:
+        env = {
+            k: v for k, v in os.environ.items() if k.startswith(("CONDA_", "MAMBA_"))
+        }
+        with open(os.environ["FAKE_CONDA_LOG"], "a") as fo:
+            fo.write(json.dumps({"args": argv, "env": env}) + "\n")
+    if command == "search":
+        print(json.dumps({}))
+        return 0
+    prefix = Path(args[args.index("--prefix") + 1])
+    as_json = "--json" in args
+    if prefix.name in os.environ.get("FAKE_CONDA_FAIL", "").split(","):
+        print(f"fake conda: {command} failed for {prefix}")
+        if as_json:
+            print(json.dumps({"error": f"{command} failed", "exception_name": "Fake"}))
+        return 1
+    channels = [args[i + 1] for i, a in enumerate(args) if a == "--channel"]
+    channels = channels or ["conda-forge"]
+    offline = "--offline" in args
+    specs = [
+        a
+        for i, a in enumerate(args)
+        if not a.startswith("-")
+        and args[i - 1] not in ("--prefix", "--channel", "--file")
+    ]
+    try:
+        if command == "create" and "--download-only" in args:
+            download(specs, channels, offline)
+        elif command == "create":
+            if "--file" in args:
+                prefix.mkdir(parents=True)
+                install_explicit(prefix, Path(args[args.index("--file") + 1]))
+            else:
+                install(prefix, specs, channels, offline, as_json)
+        elif command == "install":
+            install(prefix, specs, channels, offline, as_json)
+        elif command == "update":
+            for path in (prefix / "conda-meta").glob("*.json"):
+                record = json.loads(path.read_text())
+                major = int(record["version"].split(".")[0]) + 1
+                write_record(
+                    prefix, record["name"], f"{major}.0", channels[0], record["build"]
+                )
+        elif command == "remove":
+            shutil.rmtree(prefix)
+        else:
+            print(f"fake conda: unsupported command {command}")
+            return 1
+    except LookupError as e:
+        print(f"fake conda: {e}")
+        return 1
+    if not as_json:
+        print(f"fake conda: {command} {prefix.name} done")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    sys.platform == "win32", reason="activation scripts are shell scripts"
+)
+
+
+def test_activation_environment(tmp_path):
+    from condax.activation import activation_environment
+
+    activate_d = tmp_path / "etc" / "conda" / "activate.d"
+    activate_d.mkdir(parents=True)
+    (activate_d / "java.sh").write_text(
+        'echo noise\nexport JAVA_HOME="$CONDA_PREFIX/lib/jvm"\nexport PATH=/x:$PATH\n'
+    )
+    (tmp_path / "conda-meta").mkdir()
+    (tmp_path / "conda-meta" / "state").write_text(
+        json.dumps({"env_vars": {"R_LIBS": "/opt/r"}})
+    )
+
+    assert activation_environment(tmp_path) == {
+        "JAVA_HOME": f"{tmp_path}/lib/jvm",
+        "PATH": "/x",
+        "R_LIBS": "/opt/r",
+    }
+
+
+def test_activation_variables_already_set_are_kept(tmp_path, monkeypatch):
+    from condax.activation import (
+        activation_environment,
+        write_activating_entrypoint_unix,
+    )
+
+    activate_d = tmp_path / "etc" / "conda" / "activate.d"
+    activate_d.mkdir(parents=True)
+    (activate_d / "java.sh").write_text(
+        'export JAVA_HOME="$CONDA_PREFIX/lib/jvm"\n'
+        'export PATH="$JAVA_HOME/bin:$PATH"\n'
+    )
+    # the installer's environment happens to agree with the scripts
+    monkeypatch.setenv("JAVA_HOME", f"{tmp_path}/lib/jvm")
+    monkeypatch.setenv(
+        "PATH", f"{tmp_path}/lib/jvm/bin{os.pathsep}{os.environ['PATH']}"
+    )
+
+    env = activation_environment(tmp_path)
+    assert env == {
+        "JAVA_HOME": f"{tmp_path}/lib/jvm",
+        "PATH": f"{tmp_path}/lib/jvm/bin",
+    }
+
+    # the directories the scripts add come before the caller's PATH
+    (tmp_path / "bin").mkdir()
+    exe = tmp_path / "bin" / "java"
+    exe.write_text('#!/bin/sh\necho "$JAVA_HOME" "$PATH"\n')
+    exe.chmod(0o755)
+    entrypoint = tmp_path / "entrypoint"
+    entrypoint.write_text(write_activating_entrypoint_unix(exe, tmp_path, env))
+    entrypoint.chmod(0o755)
+    res = subprocess.run(
+        [str(entrypoint)],
+        env={"PATH": "/usr/bin:/bin"},
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert res.stdout == (
+        f"{tmp_path}/lib/jvm {tmp_path}/bin:{tmp_path}/lib/jvm/bin:/usr/bin:/bin\n"
+    )
+
+
+def test_install_with_activating_entrypoints(fake_conda, capsys):
+    from condax.core import (
+        install_package,
+        refresh_entrypoints,
+        relink_packages,
+        remove_package,
+    )
+
+    install_package("jq", activate=True)
+    prefix = fake_conda["prefix"] / "jq"
+    link = fake_conda["link"] / "jq"
+    assert not link.is_symlink()
+    assert os.access(link, os.X_OK)
+    res = subprocess.run([str(link)], capture_output=True, text=True, check=True)
+    assert res.stdout == "jq 1.0\n"
+
+    # the activation scripts of an update are picked up
+    activate_d = prefix / "etc" / "conda" / "activate.d"
+    activate_d.mkdir(parents=True)
+    (activate_d / "jq.sh").write_text("export JQ_COLORS='1;30'\n")
+    refresh_entrypoints(prefix)
+    assert "export JQ_COLORS='1;30'\n" in link.read_text()
+
+    relink_packages(dry_run=True)
+    assert "All links are up to date" in capsys.readouterr().err
+
+    remove_package("jq")
+    assert not link.exists()
+
+
+def test_paths_are_quoted_for_the_shell(fake_conda, tmp_path, monkeypatch):
+    import tempfile
+
+    from condax.activation import (
+        activation_environment,
+        write_activating_entrypoint_unix,
+    )
+    from condax.links import LinkDestination
+
+    odd = tmp_path / 'it\'s "$HOME" `x`'
+    (odd / "bin").mkdir(parents=True)
+    exe = odd / "bin" / "tool"
+    exe.write_text('#!/bin/sh\necho tool "$@"\n')
+    exe.chmod(0o755)
+    link = fake_conda["link"] / "tool"
+    link.write_text(write_activating_entrypoint_unix(exe, odd, {}))
+    link.chmod(0o755)
+
+    res = subprocess.run([str(link), "a b"], capture_output=True, text=True)
+    assert res.stdout == "tool a b\n"
+    assert LinkDestination.scan().target("tool") == exe
+
+    # the environment is dumped to a file in the temporary directory
+    monkeypatch.setattr(tempfile, "tempdir", str(odd))
+    activate_d = odd / "etc" / "conda" / "activate.d"
+    activate_d.mkdir(parents=True)
+    (activate_d / "tool.sh").write_text("export TOOL_HOME=/opt/tool\n")
+    assert activation_environment(odd) == {"TOOL_HOME": "/opt/tool"}
@@ -0,0 +1,83 @@
+import importlib.util
+
+import pytest
+
+
+@pytest.fixture
+def reset_backend(monkeypatch):
+    from condax import conda
+
+    monkeypatch.setattr(conda, "_backend", None)
+
+
+def test_custom_backend_runs_every_command(fake_conda, reset_backend):
+    from condax import conda
+    from condax.core import install_packages, remove_package
+
+    class RecordingBackend(conda.SubprocessBackend):
+        def __init__(self):
+            self.commands = []
+
+        def run(self, args, capture_output, env):
+            self.commands.append(args[1])
+            return super().run(args, capture_output, env)
+
+    backend = RecordingBackend()
+    conda.set_backend(backend)
+    install_packages(["jq", "yq"], jobs=2)
+    remove_package("jq")
+
+    assert backend.commands == ["search", "create", "create", "remove"]
+
+
+def test_in_process_backend_falls_back_without_conda(
+    fake_conda, reset_backend, monkeypatch
+):
+    import condax.config
+    from condax import conda
+    from condax.core import install_package
+
+    if importlib.util.find_spec("conda") is not None:
+        pytest.skip("conda is installed")
+    monkeypatch.setattr(condax.config.CONFIG, "conda_backend", "in-process")
+
+    install_package("jq")
+    assert isinstance(conda.get_backend(), conda.SubprocessBackend)
+    assert (fake_conda["link"] / "jq").exists()
+
+
+def test_backend_must_implement_run():
+    from condax import conda
+
+    class NoRun(conda.Backend):
+        pass
+
+    with pytest.raises(TypeError):
+        NoRun()
+
+
+def test_backend_that_is_not_thread_safe_runs_on_calling_thread(
+    fake_conda, reset_backend
+):
+    import threading
+
+    from condax import conda
+    from condax.core import install_packages, update_all_packages
+
+    class SingleThreadBackend(conda.SubprocessBackend):
+        thread_safe = False
+
+        def __init__(self):
+            self.threads = set()
+
+        def run(self, args, capture_output, env):
+            self.threads.add(threading.get_ident())
+            return super().run(args, capture_output, env)
+
+    backend = SingleThreadBackend()
+    conda.set_backend(backend)
+    install_packages(["jq", "yq"], jobs=2)
+    update_all_packages(jobs=2)
+
+    assert backend.threads == {threading.get_ident()}
+    assert (fake_conda["link"] / "yq").exists()
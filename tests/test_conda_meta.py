@@ -0,0 +1,80 @@
+import io
+import json
+
+import pytest
+
+RECORD = {
+    "build": "h1234_0",
+    "depends": ["libzlib >=1.2", "openssl >=3"],
+    "files": ["bin/tool", 'bin/tool "quoted"', "lib/libtool.so", "sbin/toold"],
+    "link": {"source": "/pkgs/tool-1.0-h1234_0", "type": 1},
+    "name": "tool",
+    "paths_data": {
+        "paths": [{"_path": "bin/tool", "size": 10, "sha256": "ab"}],
+        "paths_version": 1,
+    },
+    "size": 1234,
+    "version": "1.0",
+}
+
+
+def is_executable(fn):
+    return fn.startswith("bin/") or fn.startswith("sbin/")
+
+
+@pytest.fixture(params=[3, 64 * 1024], ids=["tiny-chunks", "default-chunks"])
+def chunk_size(request, monkeypatch):
+    from condax import conda_meta
+
+    monkeypatch.setattr(conda_meta, "_CHUNK_SIZE", request.param)
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("sort_keys", [True, False])
+def test_read_package_files(chunk_size, indent, sort_keys):
+    from condax.conda_meta import read_package_files
+
+    record = dict(RECORD)
+    if not sort_keys:
+        # name before files, so mismatches are abandoned before reading files
+        record = {"name": record.pop("name"), **record}
+    text = json.dumps(record, indent=indent, sort_keys=sort_keys)
+
+    name, files = read_package_files(io.StringIO(text), "tool", is_executable)
+    assert name == "tool"
+    assert files == [fn for fn in RECORD["files"] if is_executable(fn)]
+
+    assert read_package_files(io.StringIO(text), "tool-extras", is_executable) == (
+        "tool",
+        None,
+    )
+
+
+def test_read_package_files_stops_after_name_and_files(chunk_size):
+    from condax.conda_meta import read_package_files
+
+    # anything following `name` and `files` is never parsed
+    text = '{"files": ["bin/tool"], "name": "tool", "paths_data": {not json'
+    assert read_package_files(io.StringIO(text), "tool", is_executable) == (
+        "tool",
+        ["bin/tool"],
+    )
+
+
+def test_read_package_files_truncated(chunk_size):
+    from condax.conda_meta import read_package_files
+
+    with pytest.raises(ValueError):
+        read_package_files(io.StringIO('{"files": ["bin/to'), "tool", is_executable)
+
+
+@pytest.mark.parametrize("value", [1.5, -12, 1e300, 0.25, True, None, [1.5, 2]])
+def test_read_record_fields_split_values(monkeypatch, value):
+    from condax import conda_meta
+
+    text = json.dumps({"size": value, "name": "tool"})
+    # split the record at every offset
+    for chunk_size in range(1, len(text) + 1):
+        monkeypatch.setattr(conda_meta, "_CHUNK_SIZE", chunk_size)
+        fields = conda_meta.read_record_fields(io.StringIO(text), ["size", "name"])
+        assert fields == {"size": value, "name": "tool"}, chunk_size
@@ -0,0 +1,79 @@
+def test_dedupe_links_identical_files(fake_conda, capsys):
+    from condax.core import dedupe_environments, inject_packages, install_package
+
+    for name in ("jq", "yq", "black"):
+        install_package(name)
+        inject_packages(name, ["pycore"])
+    prefix = fake_conda["prefix"]
+    copies = [prefix / name / "bin" / "pycore" for name in ("jq", "yq", "black")]
+    # a file that conda rewrote for its prefix
+    (prefix / "black" / "bin" / "pycore").write_text("#!/bin/sh\necho patched 1.0\n")
+    size = copies[0].stat().st_size
+
+    dedupe_environments(dry_run=True)
+    assert len({p.stat().st_ino for p in copies}) == 3
+    assert f"Would hard-link 1 identical file(s), saving {size} B" in (
+        capsys.readouterr().err
+    )
+
+    dedupe_environments()
+    assert copies[0].stat().st_ino == copies[1].stat().st_ino
+    assert copies[2].stat().st_ino != copies[0].stat().st_ino
+    assert copies[1].read_text() == "#!/bin/sh\necho pycore 1.0\n"
+    assert f"Hard-linked 1 identical file(s), saving {size} B" in (
+        capsys.readouterr().err
+    )
+
+    # nothing left to do
+    dedupe_environments()
+    assert "Hard-linked 0 identical file(s)" in capsys.readouterr().err
+
+
+def test_dedupe_only_replaces_files_of_given_packages(fake_conda):
+    from condax.core import dedupe_environments, inject_packages, install_package
+
+    for name in ("jq", "yq"):
+        install_package(name)
+        inject_packages(name, ["pycore"])
+    jq, yq = (fake_conda["prefix"] / n / "bin" / "pycore" for n in ("jq", "yq"))
+    jq_inode = jq.stat().st_ino
+
+    dedupe_environments(["jq"])
+    # the copy in jq was replaced by a link to the one in yq
+    assert jq.stat().st_ino == yq.stat().st_ino != jq_inode
+
+
+def test_package_files_skip_prefix_files_and_links(tmp_path):
+    import json
+
+    from condax.dedupe import _package_files
+
+    (tmp_path / "conda-meta").mkdir()
+    record = {
+        "build": "0",
+        "files": ["bin/tool", "bin/tool-config", "bin/tool2", "lib/libtool.so"],
+        "name": "tool",
+        "paths_data": {
+            "paths": [
+                {"_path": "bin/tool", "path_type": "hardlink"},
+                {
+                    "_path": "bin/tool-config",
+                    "path_type": "hardlink",
+                    "prefix_placeholder": "/opt/placeholder",
+                },
+                {"_path": "bin/tool2", "path_type": "softlink"},
+                {"_path": "lib/libtool.so", "path_type": "hardlink"},
+            ],
+            "paths_version": 1,
+        },
+        "version": "1.0",
+    }
+    (tmp_path / "conda-meta" / "tool-1.0-0.json").write_text(
+        json.dumps(record, sort_keys=True)
+    )
+    (tmp_path / "conda-meta" / "broken-1.0-0.json").write_text('{"files": [')
+
+    assert sorted(_package_files(tmp_path)) == [
+        ("tool-1.0-0", "bin/tool"),
+        ("tool-1.0-0", "lib/libtool.so"),
+    ]
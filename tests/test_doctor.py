@@ -0,0 +1,89 @@
+import os
+import shutil
+
+import pytest
+
+
+def test_doctor_finds_and_fixes_problems(fake_conda, capsys):
+    from condax.core import check_installation, install_package
+    from condax.metadata import METADATA_FILENAME, read_prefix_metadata
+
+    for name in ("jq", "yq", "black"):
+        install_package(name)
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    check_installation()
+    assert "No problems found" in capsys.readouterr().err
+
+    # a prefix deleted by hand
+    shutil.rmtree(prefix / "jq")
+    # a link deleted by hand
+    (link / "yq").unlink()
+    # metadata lost
+    (prefix / "black" / METADATA_FILENAME).unlink()
+
+    with pytest.raises(SystemExit) as excinfo:
+        check_installation()
+    assert excinfo.value.code == 1
+    err = capsys.readouterr().err
+    assert f"dangling link: {link / 'jq'}" in err
+    assert f"stale link record: {link / 'yq'}" in err
+    assert "missing metadata: " in err
+    assert "stale registry: " in err
+    assert "Found 4 problem(s)" in err
+
+    check_installation(fix=True)
+    assert not os.path.lexists(link / "jq")
+    assert os.readlink(link / "yq") == str(prefix / "yq" / "bin" / "yq")
+    # the existing link was taken over
+    metadata = read_prefix_metadata(prefix / "black")
+    assert list(metadata.links.values()) == [link / "black"]
+
+    check_installation()
+    assert "No problems found" in capsys.readouterr().err
+
+
+def test_doctor_ignores_links_that_are_not_condax(fake_conda, capsys):
+    from condax.core import check_installation
+
+    os.symlink("/nonexistent/tool", fake_conda["link"] / "tool")
+    (fake_conda["link"] / "script").write_text("#!/bin/sh\n")
+    check_installation()
+    assert "No problems found" in capsys.readouterr().err
+
+
+def test_doctor_recreates_spec_named_environments(fake_conda, capsys):
+    from condax.core import check_installation, install_package, prefix_metadata
+    from condax.metadata import read_prefix_metadata
+
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    install_package("jq=1.0")
+    install_package("yq")
+    # environments as older versions of condax named them
+    os.rename(prefix / "jq", prefix / "jq=1.0")
+    os.unlink(link / "jq")
+    os.symlink(prefix / "jq=1.0" / "bin" / "jq", link / "jq")
+    with prefix_metadata(prefix / "jq=1.0") as metadata:
+        metadata.prefix = prefix / "jq=1.0"
+        metadata.spec = None
+        metadata.links = {prefix / "jq=1.0" / "bin" / "jq": link / "jq"}
+    shutil.copytree(prefix / "yq", prefix / "yq>=1")
+    capsys.readouterr()
+
+    with pytest.raises(SystemExit):
+        check_installation()
+    err = capsys.readouterr().err
+    assert f"spec named environment: {prefix / 'jq=1.0'}" in err
+    assert f"spec named environment: {prefix / 'yq>=1'}" in err
+
+    check_installation(fix=True)
+    assert sorted(p.name for p in prefix.iterdir() if not p.name.startswith(".")) == [
+        "jq",
+        "yq",
+    ]
+    assert os.readlink(link / "jq") == str(prefix / "jq" / "bin" / "jq")
+    assert read_prefix_metadata(prefix / "jq").spec == "jq=1.0"
+    # the environment named after the package is kept
+    assert os.readlink(link / "yq") == str(prefix / "yq" / "bin" / "yq")
+
+    check_installation()
+    assert "No problems found" in capsys.readouterr().err
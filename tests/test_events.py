@@ -0,0 +1,138 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def cli_runner(fake_conda, monkeypatch):
+    from typer.testing import CliRunner
+
+    from condax.config import Config
+
+    # keep the fake conda
+    monkeypatch.setattr(Config, "ensure_conda_executable", lambda self, **kwargs: None)
+    return CliRunner()
+
+
+def read_events(stdout):
+    return [json.loads(line) for line in stdout.splitlines()]
+
+
+def test_json_install(cli_runner):
+    from condax.cli import cli
+
+    result = cli_runner.invoke(cli, ["--json", "install", "-j", "2", "jq", "yq"])
+    assert result.exit_code == 0, result.output
+    events = read_events(result.stdout)
+
+    downloads = [e for e in events if e["event"] == "conda_download"]
+    assert {(e["environment"], e["package"]) for e in downloads} == {
+        ("jq", "jq"),
+        ("yq", "yq"),
+    }
+    assert downloads[-1]["command"] == "create"
+    links = [e for e in events if e["event"] == "conda_link"]
+    assert sorted((e["package"], e["version"]) for e in links) == [
+        ("jq", "1.0"),
+        ("yq", "1.0"),
+    ]
+    phases = {e["phase"] for e in events if e["event"] == "phase_end"}
+    assert {"conda create", "create links"} <= phases
+
+    result_event = events[-1]
+    assert result_event["event"] == "result"
+    assert result_event["command"] == "install"
+    assert result_event["success"] is True
+    assert sorted(result_event["succeeded"]) == ["jq", "yq"]
+    # the human readable messages went to stderr
+    assert "Installed 2 package(s), 0 failed" in result.stderr
+
+
+def test_json_reports_conda_errors(cli_runner, monkeypatch):
+    from condax.cli import cli
+
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "yq")
+    result = cli_runner.invoke(cli, ["--json", "install", "-j", "2", "jq", "yq"])
+    assert result.exit_code == 1
+    events = read_events(result.stdout)
+    (error,) = [e for e in events if e["event"] == "conda_error"]
+    assert (error["environment"], error["message"]) == ("yq", "create failed")
+    assert events[-1]["event"] == "result"
+    assert events[-1]["exit_code"] == 1
+    assert events[-1]["failed"] == {"yq": "conda exited with status 1"}
+
+
+def test_json_stream_skips_other_output():
+    from condax.events import JsonStream
+
+    doc = {
+        "actions": {"LINK": [{"name": "jq", "version": "1.6"}]},
+        "message": 'a "quoted" {brace} \\',
+        "success": True,
+    }
+    data = (
+        '{"fetch": "jq", "progress": 0.5}\0'
+        "not json\n"
+        "[warning] not json either\n"
+        "1234\0"
+        f"{json.dumps(doc, indent=2)}\n"
+    )
+    for size in range(1, len(data) + 1):
+        stream = JsonStream()
+        documents = []
+        for i in range(0, len(data), size):
+            documents.extend(stream.feed(data[i : i + size]))
+        assert documents == [{"fetch": "jq", "progress": 0.5}, 1234, doc], size
+
+
+def run_json(cli_runner, args):
+    from condax.cli import cli
+
+    result = cli_runner.invoke(cli, ["--json", *args])
+    assert result.exit_code == 0, result.output
+    events = read_events(result.stdout)
+    assert events[-1]["event"] == "result"
+    return events[-1]
+
+
+def test_json_list_has_packages(cli_runner):
+    from condax.core import install_package
+
+    install_package("jq")
+    (package,) = run_json(cli_runner, ["list"])["packages"]
+    assert (package["name"], package["version"]) == ("jq", "1.0")
+
+
+def test_json_export_has_lock(cli_runner):
+    from condax.core import install_package
+
+    install_package("jq")
+    (env,) = run_json(cli_runner, ["export"])["lock"]["environments"]
+    assert env["name"] == "jq"
+
+
+def test_json_prefix(cli_runner, fake_conda):
+    from condax.core import install_package
+
+    install_package("jq")
+    result = run_json(cli_runner, ["prefix", "jq"])
+    assert result["prefix"] == str(fake_conda["prefix"] / "jq")
+
+
+def test_json_child_output_goes_to_stderr(cli_runner, fake_conda, capfd):
+    from condax import conda, events
+
+    events.enable()
+    try:
+        # a command whose output isn't captured
+        conda.run_conda([str(fake_conda["conda"]), "search", "jq"])
+    finally:
+        events.finish("search")
+    out, err = capfd.readouterr()
+    assert "{}" not in out
+    assert "{}" in err
+
+    run_json(cli_runner, ["run", "jq"])
+    out, err = capfd.readouterr()
+    assert "jq 1.0" not in out
+    assert "jq 1.0" in err
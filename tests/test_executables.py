@@ -0,0 +1,90 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture
+def env_prefix(tmp_path):
+    prefix = tmp_path / "env"
+    (prefix / "conda-meta").mkdir(parents=True)
+    (prefix / "bin").mkdir()
+    for name, files in [
+        ("python", ["bin/python", "bin/python3", "lib/python3.11/os.py"]),
+        ("python-dateutil", ["lib/python3.11/dateutil/__init__.py"]),
+    ]:
+        record = {"name": name, "version": "1.0", "build": "0", "files": files}
+        (prefix / "conda-meta" / f"{name}-1.0-0.json").write_text(json.dumps(record))
+        for fn in files:
+            (prefix / fn).parent.mkdir(parents=True, exist_ok=True)
+            (prefix / fn).touch()
+            if fn.startswith("bin/"):
+                os.chmod(prefix / fn, 0o755)
+    return prefix
+
+
+def test_executables_index_is_reused(env_prefix, monkeypatch):
+    from condax import conda
+
+    expected = {env_prefix / "bin" / "python", env_prefix / "bin" / "python3"}
+    assert conda.determine_executables_from_env("python", env_prefix) == expected
+    assert (env_prefix / conda.EXECUTABLES_INDEX).exists()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("conda-meta should not be parsed again")
+
+    monkeypatch.setattr(conda.json, "loads", fail)
+    assert conda.determine_executables_from_env("python", env_prefix) == expected
+    assert conda.determine_executables_from_env("python=3.11", env_prefix) == expected
+
+
+def test_executables_index_notices_changed_records(env_prefix):
+    from condax import conda
+
+    conda.determine_executables_from_env("python", env_prefix)
+    meta = env_prefix / "conda-meta" / "python-1.0-0.json"
+    record = json.loads(meta.read_text())
+    record["files"].remove("bin/python3")
+    meta.write_text(json.dumps(record))
+
+    assert conda.determine_executables_from_env("python", env_prefix) == {
+        env_prefix / "bin" / "python"
+    }
+
+    conda.invalidate_executables_index(env_prefix)
+    assert not (env_prefix / conda.EXECUTABLES_INDEX).exists()
+
+
+def test_executables_opens_only_the_package_record(env_prefix, monkeypatch):
+    from condax import conda
+
+    opened = []
+    index_conda_meta = conda._index_conda_meta
+
+    def record_opened(path, *args):
+        opened.append(path.name)
+        return index_conda_meta(path, *args)
+
+    monkeypatch.setattr(conda, "_index_conda_meta", record_opened)
+    conda.determine_executables_from_env("python", env_prefix)
+    assert opened == ["python-1.0-0.json"]
+    with pytest.raises(ValueError):
+        conda.determine_executables_from_env("black", env_prefix)
+
+
+def test_install_all_deps_apps(fake_conda):
+    from condax import conda
+    from condax.core import install_package, relink_packages, update_package
+    from condax.metadata import read_prefix_metadata
+
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    install_package("jq")
+    install_package("yq", all_deps_apps=True)
+    assert read_prefix_metadata(prefix / "yq").link_dependencies
+    # the fake conda doesn't install dependencies, so add one by hand
+    conda.install_conda_packages(["libyaml"], prefix / "yq")
+
+    relink_packages()
+    assert sorted(p.name for p in link.iterdir()) == ["jq", "libyaml", "yq"]
+    update_package("yq")
+    assert (link / "libyaml").resolve() == prefix / "yq" / "bin" / "libyaml"
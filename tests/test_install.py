@@ -0,0 +1,93 @@
+import pytest
+
+
+def test_install_many_from_file(fake_conda, tmp_path, capsys):
+    from condax.core import install_packages, read_package_file
+
+    tools = tmp_path / "tools.txt"
+    tools.write_text("# developer tools\njq\n\nyq=4.2  # pinned\nblack\njq\n")
+    packages = read_package_file(tools)
+    assert packages == ["jq", "yq=4.2", "black", "jq"]
+
+    install_packages(packages, jobs=4)
+
+    for name in ("jq", "yq", "black"):
+        assert (fake_conda["link"] / name).resolve().exists()
+    assert "Installed 3 package(s), 0 failed" in capsys.readouterr().err
+
+
+def test_install_many_reports_failures(fake_conda, monkeypatch, capsys):
+    from condax.core import install_package, install_packages
+
+    install_package("jq")
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "yq")
+
+    with pytest.raises(SystemExit):
+        install_packages(["jq", "yq", "black"], jobs=2)
+
+    assert (fake_conda["link"] / "black").exists()
+    err = capsys.readouterr().err
+    assert "Installed 1 package(s), 1 failed, 1 already installed" in err
+    assert "yq: conda exited with status 1" in err
+
+
+def test_install_many_prefetches_repodata_once(fake_conda, tmp_path, monkeypatch):
+    import json
+
+    from condax.core import install_packages
+
+    import condax.config
+
+    log = tmp_path / "conda.log"
+    monkeypatch.setenv("FAKE_CONDA_LOG", str(log))
+    monkeypatch.delenv("CONDA_LOCAL_REPODATA_TTL", raising=False)
+    install_packages(["jq", "yq"], jobs=2)
+
+    calls = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [c["args"][0] for c in calls] == ["search", "create", "create"]
+    # conda follows the channel's Cache-Control unless a TTL is set
+    assert not any("CONDA_LOCAL_REPODATA_TTL" in c["env"] for c in calls)
+
+    log.unlink()
+    monkeypatch.setattr(condax.config.CONFIG, "repodata_ttl", 600)
+    install_packages(["jq", "black"], jobs=2)
+    calls = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [c["args"][0] for c in calls] == ["search", "create"]
+    assert all(c["env"]["CONDA_LOCAL_REPODATA_TTL"] == "600" for c in calls)
+
+
+def test_install_spec_of_installed_package(fake_conda, tmp_path, monkeypatch, capsys):
+    import json
+
+    from condax.core import install_package, install_packages
+    from condax.metadata import read_prefix_metadata
+
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    install_package("jq=1.6")
+    metadata = read_prefix_metadata(prefix / "jq")
+    assert metadata.spec == "jq=1.6"
+    assert metadata.resolved_hash
+    assert [p.name for p in prefix.iterdir() if not p.name.startswith(".")] == ["jq"]
+
+    # satisfied by what is installed, without running conda
+    log = tmp_path / "conda.log"
+    monkeypatch.setenv("FAKE_CONDA_LOG", str(log))
+    install_package("jq>=1.5")
+    assert "`jq>=1.5` already installed" in capsys.readouterr().err
+    assert not log.exists()
+
+    with pytest.raises(SystemExit):
+        install_package("jq=2.0")
+    assert "use --force to change it to `jq=2.0`" in capsys.readouterr().err
+    with pytest.raises(SystemExit):
+        install_packages(["jq=2.0", "yq"], jobs=2)
+    assert "Installed 1 package(s), 1 failed" in capsys.readouterr().err
+
+    install_package("jq=2.0", force=True)
+    last_call = json.loads(log.read_text().splitlines()[-1])["args"]
+    assert last_call[0] == "install" and last_call[-1] == "jq=2.0"
+    assert list((prefix / "jq" / "conda-meta").glob("jq-2.0-*.json"))
+    changed = read_prefix_metadata(prefix / "jq")
+    assert changed.spec == "jq=2.0"
+    assert changed.resolved_hash != metadata.resolved_hash
+    assert (link / "jq").resolve() == prefix / "jq" / "bin" / "jq"
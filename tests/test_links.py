@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+
+def test_plan_from_snapshot(fake_conda):
+    from condax.links import LinkConflictAction, LinkDestination, LinkPlan
+
+    link = fake_conda["link"]
+    exes = [fake_conda["prefix"] / "tool" / "bin" / n for n in ("a", "b", "c", "d")]
+    os.symlink(exes[1], link / "b")
+    os.symlink("/elsewhere/c", link / "c")
+    (link / "d").write_text("not ours")
+
+    snapshot = LinkDestination.scan()
+    plan = LinkPlan()
+    plan.add_links(exes, LinkConflictAction.SKIP, snapshot)
+    assert plan.create == [(exes[0], link / "a")]
+    assert plan.unchanged == [(exes[1], link / "b")]
+    assert plan.skip == [(exes[2], link / "c"), (exes[3], link / "d")]
+    assert not plan.overwrite and not plan.conflicts
+
+    plan = LinkPlan()
+    plan.remove_links(exes, snapshot)
+    # only links that point to the executable are removed
+    assert plan.remove == [(exes[1], link / "b")]
+
+
+def test_conflict_aborts_before_any_link_is_made(fake_conda):
+    from condax.core import create_links
+    from condax.links import LinkConflictAction
+
+    env_prefix = fake_conda["prefix"] / "tool"
+    env_prefix.mkdir()
+    exes = [env_prefix / "bin" / n for n in ("a", "b")]
+    (fake_conda["link"] / "b").write_text("not ours")
+
+    with pytest.raises(SystemExit):
+        create_links(exes, LinkConflictAction.ERROR, env_prefix)
+    assert not (fake_conda["link"] / "a").exists()
+
+
+def test_relink(fake_conda, capsys):
+    from condax.core import install_package, relink_packages
+    from condax.metadata import read_prefix_metadata
+
+    install_package("jq")
+    link = fake_conda["link"] / "jq"
+    target = os.readlink(link)
+    link.unlink()
+
+    relink_packages(dry_run=True)
+    assert f"create    {link} -> {target}" in capsys.readouterr().out
+    assert not os.path.lexists(link)
+
+    relink_packages()
+    assert os.readlink(link) == target
+    assert "Created 1 and removed 0 link(s)" in capsys.readouterr().err
+    metadata = read_prefix_metadata(fake_conda["prefix"] / "jq")
+    assert list(metadata.links.values()) == [link]
+
+    relink_packages(["jq"], dry_run=True)
+    assert "All links are up to date" in capsys.readouterr().err
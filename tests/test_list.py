@@ -0,0 +1,35 @@
+def test_list_packages(fake_conda):
+    from condax.core import inject_packages, install_package, list_packages
+
+    install_package("jq=1.6")
+    install_package("yq", channels=["bioconda"])
+    inject_packages("yq", ["black"], include_apps=True)
+    # not an environment
+    (fake_conda["prefix"] / ".cache").mkdir()
+
+    jq, yq = list_packages()
+    assert (jq.name, jq.version, jq.build, jq.channel) == (
+        "jq",
+        "1.6",
+        "0",
+        "conda-forge",
+    )
+    assert jq.links == {
+        fake_conda["prefix"] / "jq" / "bin" / "jq": fake_conda["link"] / "jq"
+    }
+    assert (yq.name, yq.channel) == ("yq", "bioconda")
+    assert yq.injected_packages == yq.injected_packages_with_apps == ["black"]
+
+
+def test_list_cli(fake_conda):
+    from typer.testing import CliRunner
+
+    from condax.cli import cli
+    from condax.core import install_package
+
+    install_package("jq")
+    result = CliRunner().invoke(cli, ["list", "--links"])
+    assert result.stdout.splitlines() == [
+        "jq 1.0 0 conda-forge",
+        f"    link: {fake_conda['link'] / 'jq'}",
+    ]
@@ -0,0 +1,54 @@
+import shutil
+
+
+def test_export_and_install_locked(fake_conda, tmp_path):
+    from condax.core import (
+        export_environments,
+        inject_packages,
+        install_locked,
+        install_package,
+        list_packages,
+    )
+
+    install_package("jq=1.6", channels=["bioconda"])
+    inject_packages("jq=1.6", ["yq=4.2"], include_apps=True)
+    lock = export_environments()
+    (env,) = lock.environments
+    assert env.name == "jq"
+    assert env.channels == ["bioconda"]
+    assert env.injected_packages_with_apps == ["yq=4.2"]
+    assert [p.url.rsplit("/", 1)[1] for p in env.packages] == [
+        "jq-1.6-0.tar.bz2",
+        "yq-4.2-0.tar.bz2",
+    ]
+    assert all(p.md5 for p in env.packages)
+
+    # a fresh machine
+    shutil.rmtree(fake_conda["prefix"])
+    shutil.rmtree(fake_conda["link"])
+    fake_conda["prefix"].mkdir()
+    fake_conda["link"].mkdir()
+
+    install_locked(lock)
+
+    (package,) = list_packages()
+    assert (package.name, package.version, package.channel) == ("jq", "1.6", "bioconda")
+    assert package.injected_packages_with_apps == ["yq=4.2"]
+    assert sorted(link.name for link in package.links.values()) == ["jq", "yq"]
+    assert (fake_conda["prefix"] / "jq" / "condarc").read_text().count("bioconda")
+    assert export_environments() == lock
+
+
+def test_install_locked_rejects_other_options(fake_conda, tmp_path):
+    from typer.testing import CliRunner
+
+    from condax.cli import cli
+
+    lock = tmp_path / "condax.lock"
+    lock.write_text('{"environments": []}')
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["install", "--locked", str(lock), "-c", "bioconda", "--force"]
+    )
+    assert result.exit_code == 1
+    assert "Cannot specify --channel, --force with --locked" in result.output
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+INJECT = textwrap.dedent("""
+    import sys
+    from condax.core import inject_packages
+
+    inject_packages("jq", [sys.argv[1]], include_apps=True)
+    """)
+
+
+def test_concurrent_injects_keep_all_links(fake_conda):
+    from condax.core import install_package
+
+    install_package("jq")
+    env = dict(
+        os.environ,
+        CONDAX_PREFIX_PATH=str(fake_conda["prefix"]),
+        CONDAX_LINK_DESTINATION=str(fake_conda["link"]),
+        CONDAX_CONDA_EXECUTABLE=str(fake_conda["conda"]),
+    )
+    extras = [f"tool{i}" for i in range(6)]
+    procs = [
+        subprocess.Popen([sys.executable, "-c", INJECT, extra], env=env)
+        for extra in extras
+    ]
+    assert [p.wait() for p in procs] == [0] * len(extras)
+
+    metadata = json.loads(
+        (fake_conda["prefix"] / "jq" / ".condax-metadata.json").read_text()
+    )
+    assert sorted(metadata["injected_packages_with_apps"]) == extras
+    assert sorted(os.path.basename(link) for link in metadata["links"].values()) == [
+        "jq",
+        *extras,
+    ]
+    assert not list((fake_conda["prefix"] / "jq").glob(".*.tmp"))
+
+
+def test_metadata_is_loaded_and_flushed_once(fake_conda, monkeypatch):
+    from condax import core
+    from condax.core import prefix_metadata
+
+    prefix = fake_conda["prefix"] / "env"
+    prefix.mkdir()
+    writes = []
+    write = core.locking.write_text_atomic
+    monkeypatch.setattr(
+        core.locking,
+        "write_text_atomic",
+        lambda path, text: writes.append(path) or write(path, text),
+    )
+
+    with prefix_metadata(prefix) as outer:
+        with prefix_metadata(prefix) as inner:
+            assert inner is outer
+            inner.injected_packages.append("black")
+        assert writes == []
+
+    assert writes.count(prefix / ".condax-metadata.json") == 1
+    assert core.read_prefix_metadata(prefix).injected_packages == ["black"]
@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+
+def test_populate_local_channel_and_install_offline(fake_conda, tmp_path, monkeypatch):
+    import condax.config
+    from condax.core import install_packages, list_packages, populate_cache
+    from condax.local_channel import channel_url
+
+    channel_dir = tmp_path / "channel"
+    populate_cache(["jq=1.6", "yq"], channels=["conda-forge"], channel_dir=channel_dir)
+
+    repodata = json.loads((channel_dir / "noarch" / "repodata.json").read_text())
+    assert sorted(repodata["packages"]) == ["jq-1.6-0.tar.bz2", "yq-1.0-0.tar.bz2"]
+    assert "url" not in repodata["packages"]["jq-1.6-0.tar.bz2"]
+    assert (channel_dir / "noarch" / "jq-1.6-0.tar.bz2").is_file()
+
+    monkeypatch.setattr(condax.config.CONFIG, "offline", True)
+    url = channel_url(channel_dir)
+    with pytest.raises(SystemExit):
+        install_packages(["jq"], channels=["conda-forge"])
+
+    install_packages(["jq", "yq"], channels=[url])
+    versions = {p.name: (p.version, p.channel) for p in list_packages()}
+    assert versions == {"jq": ("1.6", url), "yq": ("1.0", url)}
+
+
+def test_populate_shared_pkgs_dir(fake_conda, tmp_path, monkeypatch):
+    import condax.config
+    from condax.core import populate_cache
+
+    pkgs_dir = tmp_path / "pkgs"
+    monkeypatch.setattr(condax.config.CONFIG, "pkgs_dirs", [pkgs_dir])
+    populate_cache(["jq"])
+    assert (pkgs_dir / "jq-1.0-0" / "info" / "repodata_record.json").is_file()
+
+    # adding to an existing channel keeps what is already there
+    channel_dir = tmp_path / "channel"
+    populate_cache(["yq"], channel_dir=channel_dir)
+    repodata = json.loads((channel_dir / "noarch" / "repodata.json").read_text())
+    assert sorted(repodata["packages"]) == ["jq-1.0-0.tar.bz2", "yq-1.0-0.tar.bz2"]
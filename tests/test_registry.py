@@ -0,0 +1,102 @@
+import pytest
+
+
+def test_registry_tracks_environments(fake_conda, capsys):
+    from condax import registry
+    from condax.core import (
+        LinkConflictAction,
+        create_links,
+        install_package,
+        remove_package,
+    )
+
+    install_package("jq", channels=["bioconda"])
+    jq_link = fake_conda["link"] / "jq"
+    assert registry.link_owner(jq_link) == "jq"
+    assert registry.load_registry().environments["jq"].channels == ["bioconda"]
+
+    # another environment providing the same executable
+    install_package("yq")
+    other_jq = fake_conda["prefix"] / "yq" / "bin" / "jq"
+    other_jq.write_text("")
+    with pytest.raises(SystemExit):
+        create_links(
+            [other_jq], LinkConflictAction.ERROR, env_prefix=other_jq.parent.parent
+        )
+    assert "owned by condax package `jq`" in capsys.readouterr().err
+
+    remove_package("jq")
+    assert registry.link_owner(jq_link) is None
+    assert "jq" not in registry.load_registry().environments
+
+
+def test_registry_migrates_prefix_metadata(fake_conda):
+    from condax import registry
+    from condax.core import install_package
+
+    install_package("jq")
+    install_package("yq", channels=["bioconda"])
+    registry.registry_path().unlink()
+    # metadata written before channels were recorded
+    metadata = fake_conda["prefix"] / "yq" / ".condax-metadata.json"
+    metadata.write_text(metadata.read_text().replace('"bioconda"', ""))
+
+    migrated = registry.load_registry()
+
+    assert registry.registry_path().exists()
+    assert sorted(migrated.environments) == ["jq", "yq"]
+    assert migrated.environments["yq"].channels == ["bioconda"]
+    assert migrated.link_owners[fake_conda["link"] / "yq"] == "yq"
+
+
+def test_registry_is_parsed_once_until_it_changes(fake_conda, monkeypatch):
+    from condax import registry
+    from condax.core import install_package
+    from condax.metadata import Registry
+
+    install_package("jq")
+    parsed = []
+    original = Registry.model_validate_json
+    monkeypatch.setattr(
+        Registry,
+        "model_validate_json",
+        lambda data: parsed.append(data) or original(data),
+    )
+    registry.load_registry()
+    for _ in range(3):
+        assert registry.link_owner(fake_conda["link"] / "jq") == "jq"
+    assert len(parsed) <= 1
+
+    # changed by another process
+    text = registry.registry_path().read_text()
+    registry.registry_path().unlink()
+    registry.registry_path().write_text(text.replace('"jq"', '"other"'))
+    assert registry.link_owner(fake_conda["link"] / "jq") == "other"
+
+
+def test_registry_is_written_once_per_batch(fake_conda, monkeypatch):
+    from condax import locking, registry
+    from condax.core import install_package, remove_package
+
+    install_package("black")
+    writes = []
+    original = locking.write_text_atomic
+
+    def write_text_atomic(path, text):
+        if path == registry.registry_path():
+            writes.append(path)
+        original(path, text)
+
+    monkeypatch.setattr(locking, "write_text_atomic", write_text_atomic)
+    with registry.batch():
+        install_package("jq")
+        install_package("yq")
+        remove_package("black")
+        # the changes are visible before they are written
+        assert registry.link_owner(fake_conda["link"] / "jq") == "jq"
+        assert writes == []
+
+    assert len(writes) == 1
+    assert sorted(registry.load_registry().environments) == ["jq", "yq"]
+    registry.registry_path().unlink()
+    assert sorted(registry.load_registry().environments) == ["jq", "yq"]
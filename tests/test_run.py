@@ -0,0 +1,106 @@
+import json
+import time
+
+import pytest
+
+
+def conda_calls(log):
+    if not log.exists():
+        return []
+    return [json.loads(line)["args"][0] for line in log.read_text().splitlines()]
+
+
+def test_run_reuses_environment(fake_conda, tmp_path, monkeypatch, capfd):
+    from condax import ephemeral
+    from condax.core import run_package
+
+    log = tmp_path / "conda.log"
+    monkeypatch.setenv("FAKE_CONDA_LOG", str(log))
+
+    assert run_package("jq", ["--version"]) == 0
+    assert capfd.readouterr().out == "jq 1.0\n"
+    assert conda_calls(log) == ["create"]
+
+    assert run_package("jq", ["--version"]) == 0
+    assert capfd.readouterr().out == "jq 1.0\n"
+    assert conda_calls(log) == ["create"]
+
+    # nothing is installed or linked
+    assert not list(fake_conda["link"].iterdir())
+    assert [p.name for p in ephemeral.cache_dir().iterdir()] == [
+        ephemeral.environment_prefix("jq", ["conda-forge", "defaults"]).name
+    ]
+
+
+def test_run_recreates_expired_environment(fake_conda, tmp_path, monkeypatch):
+    from condax import ephemeral
+    from condax.config import CONFIG
+    from condax.core import run_package
+
+    log = tmp_path / "conda.log"
+    monkeypatch.setenv("FAKE_CONDA_LOG", str(log))
+    run_package("jq", [])
+    env_prefix = ephemeral.environment_prefix("jq", CONFIG.channels)
+    info = ephemeral.read_info(env_prefix)
+    assert info is not None
+    info.created = time.time() - CONFIG.run_cache_max_age - 1
+    ephemeral.write_info(env_prefix, info)
+
+    run_package("jq", [])
+    assert conda_calls(log) == ["create", "create"]
+
+
+def test_run_evicts_least_recently_used(fake_conda, monkeypatch):
+    import os
+
+    from condax import ephemeral
+    from condax.config import CONFIG
+    from condax.core import run_package
+
+    monkeypatch.setattr(CONFIG, "run_cache_size", 2)
+    prefixes = {}
+    for i, name in enumerate(("jq", "yq", "black")):
+        run_package(name, [])
+        prefixes[name] = ephemeral.environment_prefix(name, CONFIG.channels)
+        # make the order of use unambiguous
+        t = time.time() - 100 + i
+        os.utime(prefixes[name] / ephemeral.RUN_INFO_FILENAME, (t, t))
+
+    assert not prefixes["jq"].exists()
+    assert prefixes["yq"].exists() and prefixes["black"].exists()
+
+
+def test_run_unknown_app(fake_conda, capsys):
+    from condax.core import run_package
+
+    with pytest.raises(SystemExit):
+        run_package("jq", [], app="nope")
+    assert "`jq` has no executable `nope`, use --app to run one of: jq" in (
+        capsys.readouterr().err
+    )
+
+
+def test_run_keeps_environments_in_use(fake_conda, monkeypatch):
+    import subprocess
+    import sys
+
+    from condax import ephemeral
+    from condax.config import CONFIG
+    from condax.core import run_package
+
+    monkeypatch.setattr(CONFIG, "run_cache_size", 1)
+    run_package("jq", [])
+    jq = ephemeral.environment_prefix("jq", CONFIG.channels)
+    # another process is still running jq
+    with ephemeral.using(jq):
+        run_package("yq", [])
+        assert jq.exists()
+        assert ephemeral.in_use(jq)
+
+    # a marker left behind by a process that died
+    pid = subprocess.check_output(
+        [sys.executable, "-c", "import os; print(os.getpid())"], text=True
+    )
+    (jq / f"{ephemeral.IN_USE_PREFIX}{pid.strip()}-0").touch()
+    run_package("black", [])
+    assert not jq.exists()
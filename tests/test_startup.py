@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.mark.parametrize("args", [["--version"], ["prefix", "--help"]])
+def test_startup_does_not_resolve_conda(args):
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "condax.cli", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {
+        line.rsplit("|", 1)[-1].strip()
+        for line in proc.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+    assert "requests" not in imported
+    assert "ensureconda" not in imported
@@ -0,0 +1,122 @@
+import json
+import os
+
+import pytest
+
+
+def conda_calls(log):
+    if not log.exists():
+        return []
+    return [json.loads(line)["args"][0] for line in log.read_text().splitlines()]
+
+
+def sync(path, text, **kwargs):
+    from condax.core import sync_tools
+    from condax.manifest import plan_sync, read_manifest
+
+    path.write_text(text)
+    changes = plan_sync(read_manifest(path), **kwargs)
+    if changes:
+        sync_tools(changes)
+    return changes
+
+
+def test_sync_installs_updates_and_removes(fake_conda, tmp_path, monkeypatch):
+    from condax.core import install_package
+    from condax.manifest import SyncAction
+    from condax.metadata import read_prefix_metadata
+
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    install_package("yq")
+    install_package("black")
+    manifest = tmp_path / "condax.yml"
+
+    changes = sync(
+        manifest,
+        "tools:\n"
+        "  - jq\n"
+        "  - name: yq=2.0\n"
+        "  - name: black\n"
+        "    inject_apps: [isort]\n",
+    )
+    assert {c.env_name: c.action for c in changes} == {
+        "jq": SyncAction.INSTALL,
+        "yq": SyncAction.UPDATE,
+        "black": SyncAction.INJECT,
+    }
+    assert os.readlink(link / "jq") == str(prefix / "jq" / "bin" / "jq")
+    assert list((prefix / "yq" / "conda-meta").glob("yq-2.0-*.json"))
+    assert os.readlink(link / "isort") == str(prefix / "black" / "bin" / "isort")
+    assert read_prefix_metadata(prefix / "black").injected_packages_with_apps == [
+        "isort"
+    ]
+
+    # an unchanged manifest doesn't run conda at all
+    log = tmp_path / "conda.log"
+    monkeypatch.setenv("FAKE_CONDA_LOG", str(log))
+    assert not sync(manifest, manifest.read_text())
+    assert conda_calls(log) == []
+
+    # leaving out a tool and an injected package
+    changes = sync(manifest, "tools: [jq, yq=2.0, black]\n")
+    assert {c.env_name: c.action for c in changes} == {
+        "black": SyncAction.RECREATE,
+    }
+    assert not os.path.lexists(link / "isort")
+    assert read_prefix_metadata(prefix / "black").injected_packages == []
+
+    changes = sync(manifest, "tools: [jq]\n")
+    assert {c.env_name: c.action for c in changes} == {
+        "yq": SyncAction.REMOVE,
+        "black": SyncAction.REMOVE,
+    }
+    assert sorted(p.name for p in link.iterdir()) == ["jq"]
+    assert not (prefix / "yq").exists()
+
+
+def test_sync_recreates_on_channel_change(fake_conda, tmp_path):
+    from condax.manifest import SyncAction
+    from condax.metadata import read_prefix_metadata
+
+    manifest = tmp_path / "condax.yml"
+    sync(manifest, "tools: [jq]\n")
+    changes = sync(manifest, "channels: [bioconda]\ntools: [jq]\n")
+    assert [c.action for c in changes] == [SyncAction.RECREATE]
+    assert read_prefix_metadata(fake_conda["prefix"] / "jq").channels == ["bioconda"]
+
+
+def test_sync_keep_unlisted(fake_conda, tmp_path):
+    from condax.core import install_package
+
+    install_package("yq")
+    assert not sync(tmp_path / "condax.yml", "tools: []\n", remove_unlisted=False)
+
+
+def test_read_manifest_rejects_duplicates(tmp_path):
+    from condax.manifest import read_manifest
+
+    path = tmp_path / "condax.yml"
+    path.write_text("tools: [jq, jq=1.7]\n")
+    with pytest.raises(ValueError, match="more than once: jq"):
+        read_manifest(path)
+
+
+@pytest.mark.parametrize(
+    "constraint, version, expected",
+    [
+        ("", "1.6", True),
+        ("=1.6", "1.6.2", True),
+        ("=1.6", "1.7", False),
+        ("==1.6", "1.6.2", False),
+        (">=1.6,<2", "1.9", True),
+        (">=1.6,<2", "2.0", False),
+        ("<1|>2", "3", True),
+        (" 1.6.*", "1.6.0", True),
+        ("=1.6=h1234_0", "1.6", True),
+        ("[version='>=1']", "1.6", None),
+    ],
+)
+def test_version_matches(constraint, version, expected):
+    from condax.manifest import version_matches
+
+    assert version_matches(constraint, version) is expected
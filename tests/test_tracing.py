@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def tracing(monkeypatch):
+    from condax import tracing
+
+    # restored to disabled after the test
+    monkeypatch.setattr(tracing, "_enabled", False)
+    tracing.enable()
+    return tracing
+
+
+def test_trace_install(fake_conda, tracing, monkeypatch):
+    from condax.core import install_package, install_packages
+
+    install_package("jq")
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "yq")
+    with pytest.raises(SystemExit):
+        install_packages(["yq", "black"], jobs=2)
+
+    events = tracing.events()
+    creates = [e for e in events if e["name"] == "conda create"]
+    assert sorted(e["args"]["exit_code"] for e in creates) == [0, 0, 1]
+    assert all(e["dur"] > 0 for e in creates)
+    assert {"create links", "determine executables", "write metadata"} <= {
+        e["name"] for e in events
+    }
+
+    profile = tracing.format_profile().splitlines()
+    (create_row,) = [line for line in profile if line.startswith("conda create")]
+    assert create_row.split()[2] == "3"
+    assert create_row.split()[-1] == "1"
+
+
+def test_trace_file_cli(fake_conda, tracing, tmp_path):
+    from typer.testing import CliRunner
+
+    from condax.cli import cli
+
+    trace_file = tmp_path / "trace.json"
+    result = CliRunner().invoke(
+        cli, ["--profile", "--trace-file", str(trace_file), "list"]
+    )
+    assert result.exit_code == 0, result.output
+    assert "condax list" in result.stderr
+
+    trace = json.loads(trace_file.read_text())
+    names = [e["name"] for e in trace["traceEvents"]]
+    assert "condax list" in names
+    assert "thread_name" in names
@@ -0,0 +1,239 @@
+import json
+
+import pytest
+
+
+def installed_version(prefix, name):
+    (record,) = (prefix / name / "conda-meta").glob(f"{name}-*.json")
+    return json.loads(record.read_text())["version"]
+
+
+def test_update_all_parallel(fake_conda):
+    from condax import snapshots
+    from condax.core import install_package, update_all_packages
+
+    for name in ("jq", "yq", "black"):
+        install_package(name)
+
+    update_all_packages(jobs=3)
+
+    for name in ("jq", "yq", "black"):
+        assert installed_version(fake_conda["prefix"], name) == "2.0"
+        assert (fake_conda["link"] / name).resolve().exists()
+    # snapshots are opt-in
+    assert not snapshots.snapshot_dir().exists()
+
+
+def test_update_all_parallel_reports_failures(fake_conda, monkeypatch, capsys):
+    import condax.config
+    from condax.core import install_package, update_all_packages
+
+    monkeypatch.setattr(condax.config.CONFIG, "update_snapshots", True)
+    for name in ("jq", "yq"):
+        install_package(name)
+    # the update fails for yq, which is restored from its snapshot
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "yq")
+
+    with pytest.raises(SystemExit) as excinfo:
+        update_all_packages(jobs=2)
+
+    assert excinfo.value.code == 1
+    assert installed_version(fake_conda["prefix"], "jq") == "2.0"
+    err = capsys.readouterr().err
+    assert "Updated 1 package(s), 1 failed" in err
+    assert "fake conda: update failed" in err
+    assert "`yq` could not be updated, restored" in err
+    assert installed_version(fake_conda["prefix"], "yq") == "1.0"
+
+
+def write_channel(channel_dir, versions, dependencies=()):
+    (channel_dir / "noarch").mkdir(parents=True, exist_ok=True)
+    packages = {
+        f"{name}-{v}-0.tar.bz2": {
+            "build": "0",
+            "build_number": 0,
+            "name": name,
+            "version": v,
+        }
+        for name, v in [*(("jq", v) for v in versions), *dependencies]
+    }
+    (channel_dir / "noarch" / "repodata.json").write_text(
+        json.dumps({"packages": packages})
+    )
+
+
+def test_update_all_check_skips_up_to_date(fake_conda, tmp_path, capsys):
+    from condax.core import install_package, update_all_packages
+
+    channel_dir = tmp_path / "channel"
+    write_channel(channel_dir, ["1.0"])
+    install_package("jq", channels=[channel_dir.as_uri()])
+
+    update_all_packages(jobs=2, check=True)
+    assert installed_version(fake_conda["prefix"], "jq") == "1.0"
+    err = capsys.readouterr().err
+    assert "`jq` is up to date" in err
+    assert "Updated 0 package(s), 0 failed, 1 up to date" in err
+
+    write_channel(channel_dir, ["1.0", "1.0.1"])
+    update_all_packages(jobs=2, check=True)
+    # the fake conda update always bumps the major version
+    assert installed_version(fake_conda["prefix"], "jq") == "2.0"
+
+
+def test_update_check_finds_conda_only_when_needed(fake_conda, tmp_path, monkeypatch):
+    from typer.testing import CliRunner
+
+    from condax.cli import cli
+    from condax.config import Config
+    from condax.core import install_package
+
+    channel_dir = tmp_path / "channel"
+    write_channel(channel_dir, ["1.0"])
+    install_package("jq", channels=[channel_dir.as_uri()])
+    calls = []
+    monkeypatch.setattr(
+        Config, "ensure_conda_executable", lambda self, **kwargs: calls.append(kwargs)
+    )
+    runner = CliRunner()
+
+    for args in (["--check", "jq"], ["--all", "--check"]):
+        result = runner.invoke(cli, ["update", *args])
+        assert result.exit_code == 0, result.output
+    assert calls == []
+
+    write_channel(channel_dir, ["1.0", "1.0.1"])
+    result = runner.invoke(cli, ["update", "--check", "jq"])
+    assert result.exit_code == 0, result.output
+    assert len(calls) == 1
+    assert installed_version(fake_conda["prefix"], "jq") == "2.0"
+
+
+def test_update_check_ignores_dependencies_and_respects_spec(fake_conda, tmp_path):
+    from condax.core import install_package, prefix_metadata
+    from condax.repodata import RepodataIndex
+
+    channel_dir = tmp_path / "channel"
+    write_channel(channel_dir, ["1.0"], dependencies=[("oniguruma", "6.0")])
+    install_package("jq", channels=[channel_dir.as_uri()])
+    env_prefix = fake_conda["prefix"] / "jq"
+    # a dependency that a constraint holds back
+    (env_prefix / "conda-meta" / "oniguruma-5.0-0.json").write_text(
+        json.dumps(
+            {
+                "build_number": 0,
+                "name": "oniguruma",
+                "url": f"{channel_dir.as_uri()}/noarch/oniguruma-5.0-0.tar.bz2",
+                "version": "5.0",
+            }
+        )
+    )
+    assert not RepodataIndex().has_updates(env_prefix)
+
+    # an upper bound in the spec
+    with prefix_metadata(env_prefix) as metadata:
+        metadata.spec = "jq<2"
+    write_channel(channel_dir, ["1.0", "2.0"])
+    assert not RepodataIndex().has_updates(env_prefix)
+    write_channel(channel_dir, ["1.0", "1.5", "2.0"])
+    assert RepodataIndex().has_updates(env_prefix)
+
+
+@pytest.mark.parametrize(
+    "older, newer",
+    [
+        ("1.9", "1.10"),
+        ("1.0a1", "1.0"),
+        ("1.0dev1", "1.0a1"),
+        ("1.0", "1.0.post1"),
+        ("1.0", "1.0.1"),
+        ("2.0", "1!1.0"),
+        ("1.0_1", "1.0_2"),
+    ],
+)
+def test_compare_versions(older, newer):
+    from condax.repodata import compare_versions
+
+    assert compare_versions(older, newer) == -1
+    assert compare_versions(newer, older) == 1
+    assert compare_versions(newer, newer) == 0
+
+
+def test_repodata_is_cached(fake_conda, monkeypatch):
+    import condax.config
+    from condax import repodata
+
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return json.dumps({"packages": {}}).encode()
+
+    monkeypatch.setattr(repodata, "_fetch", fetch)
+    url = "https://conda.anaconda.org/conda-forge/noarch"
+    # without a TTL repodata is fetched once per command
+    repodata.RepodataIndex().newest(url, "jq")
+    repodata.RepodataIndex().newest(url, "jq")
+    assert len(fetched) == 2
+
+    # but kept, and with a TTL reused
+    monkeypatch.setattr(condax.config.CONFIG, "repodata_ttl", 1800)
+    repodata.RepodataIndex().newest(url, "jq")
+    assert fetched == [f"{url}/current_repodata.json"] * 2
+
+    monkeypatch.setattr(condax.config.CONFIG, "repodata_ttl", -1)
+    repodata.RepodataIndex().newest(url, "jq")
+    assert len(fetched) == 3
+
+
+def test_rollback_after_update(fake_conda, monkeypatch, capsys):
+    import subprocess
+
+    import condax.config
+    from condax import snapshots
+    from condax.core import install_package, rollback_package, update_package
+
+    monkeypatch.setattr(condax.config.CONFIG, "update_snapshots", True)
+    prefix, link = fake_conda["prefix"], fake_conda["link"]
+    install_package("jq")
+    with pytest.raises(SystemExit):
+        rollback_package("jq")
+    assert "`jq` has no snapshot to roll back to" in capsys.readouterr().err
+
+    update_package("jq")
+    assert installed_version(prefix, "jq") == "2.0"
+    assert subprocess.check_output([link / "jq"], text=True) == "jq 2.0\n"
+
+    rollback_package("jq")
+    assert installed_version(prefix, "jq") == "1.0"
+    assert subprocess.check_output([link / "jq"], text=True) == "jq 1.0\n"
+    # and forward again
+    rollback_package("jq")
+    assert installed_version(prefix, "jq") == "2.0"
+
+    # a failed update is undone from the snapshot instead of reinstalling
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "jq")
+    with pytest.raises(subprocess.CalledProcessError):
+        update_package("jq")
+    assert installed_version(prefix, "jq") == "2.0"
+    assert not snapshots.has_snapshot(prefix / "jq")
+    assert (link / "jq").resolve().exists()
+
+
+def test_update_all_sequential_continues_after_failure(fake_conda, monkeypatch, capsys):
+    from condax.core import install_package, update_all_packages
+
+    for name in ("black", "jq"):
+        install_package(name)
+    # black is updated first
+    monkeypatch.setenv("FAKE_CONDA_FAIL", "black")
+
+    with pytest.raises(SystemExit) as excinfo:
+        update_all_packages()
+
+    assert excinfo.value.code == 1
+    assert installed_version(fake_conda["prefix"], "black") == "1.0"
+    assert installed_version(fake_conda["prefix"], "jq") == "2.0"
+    err = capsys.readouterr().err
+    assert "Updated 1 package(s), 1 failed" in err
+    assert "black: conda exited with status 1" in err